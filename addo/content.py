@@ -0,0 +1,40 @@
+"""Converts the XML content of a destination into python data.
+
+Each element with child elements becomes a dict of its children by tag, with repeated tags collected into a list in
+document order. An element without children becomes its stripped text (or an empty dict if it has no text).
+
+The tag names are interned, so every dict holding a section shares the same key objects.
+"""
+
+from lxml.etree import Element
+
+# The canonical object for each tag name seen. ``intern`` only accepts byte strings, but lxml returns unicode for
+# tags that are not plain ASCII.
+_tags = {}
+
+
+def intern_tag(tag):
+    return _tags.get(tag) or _tags.setdefault(tag, tag)
+
+
+def build_content(element):
+    """Convert the children of ``element`` into a dict. Comments and processing instructions are skipped."""
+    data = {}
+    for child in element.iterchildren(Element):
+        tag = intern_tag(child.tag)
+        if len(child):
+            value = build_content(child)
+        elif child.text is None:
+            value = {}
+        else:
+            value = unicode(child.text.strip())
+
+        if tag in data:
+            existing = data[tag]
+            if type(existing) is list:
+                existing.append(value)
+            else:
+                data[tag] = [existing, value]
+        else:
+            data[tag] = value
+    return data
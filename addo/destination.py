@@ -1,22 +1,45 @@
 import logging
 
+log = logging.getLogger(__name__)
+
 
 class Destination(object):
     """The container class for all of the Destination data.
 
     The metadata are object attributes deliberately, so as to mimic pulling/pushing the data via an ORM.
+
+    The ``children`` and ``parents`` are lists of the metadata of those destinations, or of their names to be looked
+    up in the ``source`` when they are used.
+
+    The content can be given directly, or as a ``loader`` which is called to produce it the first time ``content`` is
+    used. Code that only needs the metadata or the navigation then never pays for converting the content.
+    Destinations are slotted and share the module's logger, as there may be a very large number of them.
     """
+    __slots__ = ('source', 'asset_id', 'name', 'title', 'atlas_id', '_content', '_loader', '_children_list',
+                 '_parent_list')
 
-    def __init__(self, source, asset_id, name, title, content, children, parents):
-        self.log = logging.getLogger('addo.destination.%s' % name)
+    def __init__(self, source, asset_id, name, title, content=None, children=(), parents=(), loader=None):
         self.source = source
         self.asset_id = asset_id
         self.name = name
         self.title = title
-        self.content = content
+        self._content = content
+        self._loader = loader
         self._children_list = children
         self._parent_list = parents
 
+    @property
+    def content(self):
+        if self._loader is not None:
+            self._content = self._loader()
+            self._loader = None
+        return self._content
+
+    @content.setter
+    def content(self, content):
+        self._content = content
+        self._loader = None
+
     def get_content(self, *path):
         current = self.content
         for path_location in path:
@@ -26,22 +49,119 @@ class Destination(object):
                 current = None
         return current
 
-    def children(self):
-        for child_name in self._children_list:
-            if child_name in self.source.metadata:
-                yield self.source.metadata[child_name]
+    def _resolve(self, links, relation):
+        """Yields the metadata of each of the ``links``. A link is usually the metadata itself, already resolved by the
+        parser, but may be a name to look up in the source."""
+        for link in links:
+            if isinstance(link, dict):
+                yield link
+            elif link in self.source.metadata:
+                yield self.source.metadata[link]
             else:
-                self.log.warn('Source does not know of child %s' % child_name)
+                log.warn('%s: Source does not know of %s %s' % (self.name, relation, link))
+
+    def _count(self, links):
+        """The number of ``links`` that can be resolved"""
+        return sum(1 for link in links if isinstance(link, dict) or link in self.source.metadata)
+
+    def children(self):
+        return self._resolve(self._children_list, 'child')
 
     def number_children(self):
-        return len(self._children_list)
+        return self._count(self._children_list)
 
     def parents(self):
-        for parent_name in self._parent_list:
-            if parent_name in self.source.metadata:
-                yield self.source.metadata[parent_name]
-            else:
-                self.log.warn('Source does not know of parent %s' % parent_name)
+        return self._resolve(self._parent_list, 'parent')
 
     def number_parents(self):
-        return len(self._parent_list)
+        return self._count(self._parent_list)
+
+    def _taxonomy(self):
+        """The taxonomy of the source, if it has one and it knows of this destination"""
+        taxonomy = getattr(self.source, 'taxonomy', None)
+        if taxonomy is not None and self.name in taxonomy:
+            return taxonomy
+        return None
+
+    def _known(self, names):
+        """The metadata of each of ``names`` known to the source. Taxonomy nodes without a destination are skipped."""
+        return [self.source.metadata[name] for name in names if name in self.source.metadata]
+
+    def descendants(self):
+        """The metadata of every destination below this one in the taxonomy, in taxonomy order"""
+        taxonomy = self._taxonomy()
+        return self._known(taxonomy.descendants(self.name)) if taxonomy else []
+
+    def ancestors(self):
+        """The metadata of every destination above this one in the taxonomy, from the top down"""
+        taxonomy = self._taxonomy()
+        return self._known(taxonomy.ancestors(self.name)) if taxonomy else []
+
+    def is_ancestor_of(self, other):
+        """True if this destination is above ``other`` in the taxonomy. ``other`` may be a Destination, its metadata,
+        or its name."""
+        taxonomy = self._taxonomy()
+        other = _name_of(other)
+        return bool(taxonomy) and other in taxonomy and taxonomy.is_ancestor(self.name, other)
+
+    def is_descendant_of(self, other):
+        """True if this destination is below ``other`` in the taxonomy"""
+        taxonomy = self._taxonomy()
+        other = _name_of(other)
+        return bool(taxonomy) and other in taxonomy and taxonomy.is_ancestor(other, self.name)
+
+    def subtree_size(self):
+        """The number of taxonomy nodes under (and including) this destination"""
+        taxonomy = self._taxonomy()
+        return taxonomy.subtree_size(self.name) if taxonomy else 1
+
+    def payload(self):
+        """A light, picklable copy of this destination, with its neighbours already resolved. It can be turned back
+        into a Destination with ``from_payload``, for example in another process.
+        """
+        payload = {
+            'asset_id': self.asset_id,
+            'name': self.name,
+            'title': self.title,
+            'content': self.content,
+            'children': list(self.children()),
+            'parents': list(self.parents()),
+        }
+        if hasattr(self, 'atlas_id'):
+            payload['atlas_id'] = self.atlas_id
+        return payload
+
+    @classmethod
+    def from_payload(cls, payload, source=None):
+        """Create a Destination from the dict returned by ``payload``. If no ``source`` is given, the destination will
+        only know of its neighbours."""
+        if source is None:
+            source = PayloadSource(payload['children'] + payload['parents'])
+        destination = cls(source=source,
+                          asset_id=payload['asset_id'],
+                          name=payload['name'],
+                          title=payload['title'],
+                          content=payload['content'],
+                          children=payload['children'],
+                          parents=payload['parents'])
+        if 'atlas_id' in payload:
+            destination.atlas_id = payload['atlas_id']
+        return destination
+
+
+def _name_of(destination):
+    """The name of a Destination, a destination's metadata, or a name"""
+    if isinstance(destination, Destination):
+        return destination.name
+    if isinstance(destination, dict):
+        return destination['name']
+    return destination
+
+
+class PayloadSource(object):
+    """Stands in for the parser of a Destination created from a payload. It knows of the metadata of the given
+    destinations (usually just the destination's neighbours), and optionally the taxonomy."""
+
+    def __init__(self, destinations, taxonomy=None):
+        self.metadata = {metadata['name']: metadata for metadata in destinations}
+        self.taxonomy = taxonomy
@@ -1,6 +1,12 @@
-import logging
+import os, sys, time, logging, threading
+import cPickle as pickle
+from array import array
+from functools import partial
+from collections import OrderedDict, Mapping
 from lxml import etree
+from addo import metrics
 from addo.destination import Destination
+from addo.content import build_content
 
 log = logging.getLogger(__name__)
 
@@ -10,66 +16,425 @@ class LegacyTaxonomies(dict):
     Parse the Taxonomy XML from the legacy CMS. This is a heirarchical set of XML data which links the different
     destinations together. It is used by the Destinations Parser to provide relational information to the Destination
     class.
+
+    The nodes are stored in a compact table rather than a dict each. Every node has an integer id (assigned in
+    document order), and the table holds its key and name, the id of its parent in an array, its children as a range
+    of an array of child ids, and each of the INT_PROPERTIES in a typed array. The dict itself maps each node key to
+    its id, but looking up a key returns a read-only TaxonomyNode view, so ``taxonomy[key]['children']`` and
+    ``taxonomy[key]['parents']`` work as if each node were still a dict.
+
+    As ids are assigned in document (pre-order) order, the descendants of a node are exactly the ids after it up to
+    the id of its last descendant, which is kept in the ``_exits`` array along with the depth of each node. These
+    nested-set intervals answer ``descendants``, ``is_ancestor`` and ``subtree_size`` without walking the tree.
     """
     INT_PROPERTIES = [
         'geo_id',
         'atlas_node_id',
         'ethyl_content_object_id',
     ]
+    # The states of a node's INT_PROPERTIES in the _property_states arrays
+    PROPERTY_MISSING, PROPERTY_EMPTY, PROPERTY_SET = range(3)
 
     def __init__(self):
         self._sets = {}
+        self._keys = []
+        self._names = []
+        self._parents = array('l')
+        self._child_offsets = array('l', [0])  # The children of node i are _child_ids[offsets[i]:offsets[i + 1]]
+        self._child_ids = array('l')
+        self._exits = array('l')  # The id of the last descendant of each node, or its own id
+        self._depths = array('l')
+        self._properties = {property: array('l') for property in self.INT_PROPERTIES}
+        self._property_states = {property: array('B') for property in self.INT_PROPERTIES}
+
+    def __getitem__(self, key):
+        return TaxonomyNode(self, dict.__getitem__(self, key))
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def itervalues(self):
+        for node_id in dict.itervalues(self):
+            yield TaxonomyNode(self, node_id)
+
+    def iteritems(self):
+        for key, node_id in dict.iteritems(self):
+            yield key, TaxonomyNode(self, node_id)
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def __eq__(self, other):
+        if not isinstance(other, dict):
+            return NotImplemented
+        return dict(self.iteritems()) == dict(other.iteritems() if isinstance(other, LegacyTaxonomies) else other)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __repr__(self):
+        return repr(dict((key, dict(node)) for key, node in self.iteritems()))
+
+    def __reduce__(self):
+        # The default pickling of a dict subclass would store the views, rather than the node ids
+        return self.__class__, (), self.__dict__, None, dict.iteritems(self)
+
+    def _parent_keys(self, node_id):
+        """The keys of the ancestors of a node, from the root of its set down to its parent"""
+        keys = []
+        parent_id = self._parents[node_id]
+        while parent_id >= 0:
+            keys.append(self._keys[parent_id])
+            parent_id = self._parents[parent_id]
+        keys.reverse()
+        return keys
+
+    def _children_keys(self, node_id):
+        return [self._keys[child_id] for child_id in
+                self._child_ids[self._child_offsets[node_id]:self._child_offsets[node_id + 1]]]
+
+    def descendants(self, key):
+        """The keys of every node below ``key``, in document order"""
+        node_id = dict.__getitem__(self, key)
+        return self._keys[node_id + 1:self._exits[node_id] + 1]
+
+    def parent(self, key):
+        """The key of the parent of ``key``, or None for the top level nodes"""
+        parent_id = self._parents[dict.__getitem__(self, key)]
+        return self._keys[parent_id] if parent_id >= 0 else None
+
+    def ancestors(self, key):
+        """The keys of every node above ``key``, from the root of its set down to its parent"""
+        return self._parent_keys(dict.__getitem__(self, key))
+
+    def is_ancestor(self, ancestor, key):
+        """True if the node ``ancestor`` is above the node ``key``"""
+        ancestor_id = dict.__getitem__(self, ancestor)
+        return ancestor_id < dict.__getitem__(self, key) <= self._exits[ancestor_id]
+
+    def subtree_size(self, key):
+        """The number of nodes in the subtree under (and including) ``key``"""
+        node_id = dict.__getitem__(self, key)
+        return self._exits[node_id] - node_id + 1
+
+    def depth(self, key):
+        """The depth of ``key`` in its set, the top level nodes are 0"""
+        return self._depths[dict.__getitem__(self, key)]
+
+    def _property(self, node_id, property):
+        """Returns a (present, value) tuple for one of the INT_PROPERTIES of a node"""
+        state = self._property_states[property][node_id]
+        if state == self.PROPERTY_MISSING:
+            return False, None
+        return True, self._properties[property][node_id] if state == self.PROPERTY_SET else None
 
     def parse_xml(self, source):
-        """Iterates each taxonomy object in the source XML and parses it"""
-        xml = etree.parse(source)
-        for taxonomy_data in xml.findall('taxonomy'):
-            self.parse_taxonomy_set(taxonomy_data)
+        """Parses each taxonomy object in the source XML. The source is read as a stream of events, and each node
+        element is cleared once it has been parsed, so the XML tree is never held in memory. ``huge_tree`` lifts
+        libxml2's limit on the depth of the document."""
+        events = etree.iterparse(source, events=('start', 'end'), huge_tree=True)
+        self._parse_events(events, set_depth=1, clear=True)
 
     def parse_taxonomy_set(self, taxonomy_xml):
+        """Parses all of the node objects in an already parsed taxonomy element. The element is left untouched."""
+        self._parse_events(etree.iterwalk(taxonomy_xml, events=('start', 'end')), set_depth=0, clear=False)
+
+    def _parse_events(self, events, set_depth, clear):
         """
-        Recursively iterates all of the node object in the taxonomy.
+        Iterates the start/end events of the taxonomy XML, without recursion, so the depth of a taxonomy is only
+        limited by memory. An explicit stack holds an entry for each open element: the _OpenSet or _OpenNode it
+        represents, or None for any other element.
 
-        cPython has an inbuilt default recursion limit of 100. If we expect a taxonomy depth greater than that
-        this code should be modified to parse via events instead.
+        Taxonomy sets are elements at ``set_depth`` (which must be a ``taxonomy`` unless it is the root). The nodes of
+        a set are collected in document order, and resolved into node data once the whole set has been parsed.
         """
+        stack = []
+        current_set = None
+        properties = self.INT_PROPERTIES
+        for event, element in events:
+            if event == 'start':
+                parent = stack[-1] if stack else None
+                entry = None
+                if len(stack) == set_depth and (set_depth == 0 or element.tag == 'taxonomy'):
+                    entry = current_set = _OpenSet()
+                elif parent is not None and element.tag == 'node':
+                    attrib = element.attrib
+                    entry = _OpenNode(None if parent is current_set else parent,
+                                      {name: attrib[name] for name in properties if name in attrib})
+                    current_set.nodes.append(entry)
+                stack.append(entry)
+                continue
 
-        set_name = taxonomy_xml.findtext('taxonomy_name')
-
-        def _parse_node(parent_node, parents=None):
-            """The actual recursion function (generator). This iterates all of the child nodes of the element passed.
-            It yields the node data, and node keys as it finds. It keeps a few lists in memory to collate the
-            child/parent information as it is being parsed
-            """
-            for node in parent_node.findall('node'):
-                node_name = node.findtext('node_name')
-                if node_name is None:
-                    # We cannot proceed without a name
-                    log.warn('Taxonomy Source has a node missing a node name')
+            entry = stack.pop()
+            parent = stack[-1] if stack else None
+            if entry is None:
+                if parent is None:
                     continue
-                node_key = node_name.strip().lower().replace(' ', '_')
-                node_data = {
-                    'name': node_name,
-                    'parents': parents,
-                    'children': [],
-                }
-                # capture the integer properties of the node
-                for property in self.INT_PROPERTIES:
-                    if property in node.attrib:
-                        node_data[property] = int(node.get(property)) if len(node.get(property)) > 0 else None
-                # Loop the children nodes
-                parents.append(node_key)
-                for child_key, child_data in _parse_node(node, parents[:]):
-                    if child_data['parents'][-1] == node_key:
-                        node_data['children'].append(child_key)
-                    yield child_key, child_data
-                parents.pop()
-
-                yield node_key, node_data
-
-        set_data = {key: data for key, data in _parse_node(taxonomy_xml, [])}
-        self._sets[set_name] = [key for key in set_data.keys()]
-        self.update(set_data)
+                tag = element.tag
+                if tag == 'node_name' and parent is not current_set:
+                    if parent.name is None:
+                        parent.name = element.text or ''
+                elif tag == 'taxonomy_name' and parent is current_set and not parent.named:
+                    parent.name = element.text or ''
+                    parent.named = True
+            elif entry is current_set:
+                self._add_set(entry)
+                current_set = None
+
+            if clear:
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+
+    def _add_set(self, taxonomy_set):
+        """Appends the parsed nodes of a set to the node table. Nodes are in document order, so each parent is always
+        given an id before its children, and the children of each node can be laid out in a single range."""
+        first_id = next_id = len(self._keys)
+        set_keys = {}
+        keys = []
+        names = []
+        parents = []
+        child_counts = []
+        depths = []
+        properties = {property: ([], []) for property in self.INT_PROPERTIES}  # The (states, values) of each
+        for node in taxonomy_set.nodes:
+            if node.name is None:
+                # We cannot proceed without a name
+                log.warn('Taxonomy Source has a node missing a node name')
+                continue
+            parent = node.parent
+            if parent is not None and parent.id is None:
+                continue  # An ancestor was skipped, so is this node
+            node.id = next_id
+            next_id += 1
+            key = node.name.strip().lower().replace(' ', '_')
+            keys.append(key)
+            names.append(node.name)
+            child_counts.append(0)
+            if parent is None:
+                parents.append(-1)
+                depths.append(0)
+            else:
+                parents.append(parent.id)
+                depths.append(depths[parent.id - first_id] + 1)
+                child_counts[parent.id - first_id] += 1
+            # capture the integer properties of the node
+            for property, (states, values) in properties.iteritems():
+                value = node.properties.get(property)
+                if value is None:
+                    states.append(self.PROPERTY_MISSING)
+                    values.append(0)
+                elif len(value) == 0:
+                    states.append(self.PROPERTY_EMPTY)
+                    values.append(0)
+                else:
+                    states.append(self.PROPERTY_SET)
+                    values.append(int(value))
+            set_keys[key] = node.id
+
+        self._keys.extend(keys)
+        self._names.extend(names)
+        self._parents.extend(parents)
+        for property, (states, values) in properties.iteritems():
+            self._property_states[property].extend(states)
+            self._properties[property].extend(values)
+
+        # Lay out the children of each new node as a range of the child ids
+        offset = self._child_offsets[-1]
+        positions = []
+        for count in child_counts:
+            positions.append(offset)
+            offset += count
+        self._child_offsets.extend(positions[1:] + [offset] if positions else [])
+        child_ids = [0] * (offset - len(self._child_ids))
+        start = len(self._child_ids)
+        for node_id, parent_id in enumerate(parents, first_id):
+            if parent_id >= 0:
+                child_ids[positions[parent_id - first_id] - start] = node_id
+                positions[parent_id - first_id] += 1
+        self._child_ids.extend(child_ids)
+
+        # Each subtree is a contiguous range of ids, so the sizes of the subtrees give their last ids
+        sizes = [1] * len(parents)
+        for index in xrange(len(parents) - 1, -1, -1):
+            if parents[index] >= 0:
+                sizes[parents[index] - first_id] += sizes[index]
+        self._exits.extend([node_id + size - 1 for node_id, size in enumerate(sizes, first_id)])
+        self._depths.extend(depths)
+
+        self._sets[taxonomy_set.name] = set_keys.keys()
+        dict.update(self, set_keys)
+
+
+class TaxonomyNode(Mapping):
+    """A read-only view of one node in a LegacyTaxonomies table. It behaves like the dict each node used to be, with a
+    ``name``, ``parents`` and ``children`` (both lists of node keys), and any of the INT_PROPERTIES the node has."""
+    __slots__ = ('taxonomy', 'id')
+
+    def __init__(self, taxonomy, node_id):
+        self.taxonomy = taxonomy
+        self.id = node_id
+
+    def __getitem__(self, item):
+        if item == 'name':
+            return self.taxonomy._names[self.id]
+        if item == 'parents':
+            return self.taxonomy._parent_keys(self.id)
+        if item == 'children':
+            return self.taxonomy._children_keys(self.id)
+        if item in self.taxonomy._properties:
+            present, value = self.taxonomy._property(self.id, item)
+            if present:
+                return value
+        raise KeyError(item)
+
+    def __iter__(self):
+        yield 'name'
+        yield 'parents'
+        yield 'children'
+        for property in self.taxonomy.INT_PROPERTIES:
+            if self.taxonomy._property(self.id, property)[0]:
+                yield property
+
+    def __len__(self):
+        return sum(1 for item in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class _OpenSet(object):
+    """A taxonomy set element, while it is being parsed"""
+    __slots__ = ('name', 'named', 'nodes')
+
+    def __init__(self):
+        self.name = None
+        self.named = False
+        self.nodes = []
+
+
+class _OpenNode(object):
+    """A taxonomy node element, while it is being parsed. ``parent`` is None for the top level nodes of a set, and
+    ``properties`` is a dict of the values of its INT_PROPERTIES attributes."""
+    __slots__ = ('parent', 'properties', 'name', 'id')
+
+    def __init__(self, parent, properties):
+        self.parent = parent
+        self.properties = properties
+        self.name = None
+        self.id = None
+
+
+class WorkerError(ValueError):
+    """
+    An error parsing in a worker process. The errors of lxml cannot be unpickled, and a result which cannot be
+    unpickled leaves the parent process waiting for it forever, so workers raise this instead, with the message of
+    the error.
+    """
+
+
+def _parse_taxonomy_file(filename):
+    """Parses the taxonomy in ``filename``, in a worker process of a _TaxonomyParse. Returns the taxonomy and the
+    seconds taken to parse it."""
+    started = time.time()
+    taxonomy = LegacyTaxonomies()
+    try:
+        taxonomy.parse_xml(filename)
+    except Exception, e:
+        raise WorkerError('Could not parse the taxonomy %s: %s' % (filename, e))
+    return taxonomy, time.time() - started
+
+
+class _TaxonomyParse(object):
+    """
+    Parses a taxonomy in the background, while the destinations are parsed. It is parsed on a thread, as lxml does
+    not hold the GIL while reading and parsing. A taxonomy file of at least ``PROCESS_THRESHOLD`` bytes is parsed in
+    a process instead, as building the node table is Python code which would otherwise compete for the GIL.
+
+    Once the result has been returned, ``elapsed`` holds the seconds the parse itself took.
+    """
+    PROCESS_THRESHOLD = 32 << 20
+
+    def __init__(self, source):
+        self.taxonomy = None
+        self.error = None
+        self.pool = None
+        self.elapsed = None
+        filename = self._filename(source)
+        if filename is not None and os.path.getsize(filename) >= self.PROCESS_THRESHOLD:
+            from multiprocessing import Pool
+            self.pool = Pool(1)
+            self.async_result = self.pool.apply_async(_parse_taxonomy_file, (filename,))
+        else:
+            self.thread = threading.Thread(target=self._parse, args=(source,), name='addo-taxonomy')
+            self.thread.daemon = True
+            self.thread.start()
+
+    @staticmethod
+    def _filename(source):
+        """The name of the file ``source`` reads, if it can be read again from the start by another process"""
+        if isinstance(source, basestring):
+            return source
+        name = getattr(source, 'name', None)
+        if isinstance(name, basestring) and os.path.isfile(name) and hasattr(source, 'tell') and source.tell() == 0:
+            return name
+        return None
+
+    def _parse(self, source):
+        started = time.time()
+        try:
+            self.taxonomy = LegacyTaxonomies()
+            self.taxonomy.parse_xml(source)
+        except Exception:
+            self.error = sys.exc_info()
+        self.elapsed = time.time() - started
+
+    def wait(self):
+        """Waits for the parse to finish, ignoring any error"""
+        try:
+            self.result()
+        except Exception:
+            pass
+
+    def result(self):
+        """Waits for the parse to finish, and returns the taxonomy or raises the error of the parse"""
+        if self.pool is not None:
+            try:
+                taxonomy, self.elapsed = self.async_result.get()
+                return taxonomy
+            finally:
+                self.pool.terminate()
+                self.pool.join()
+        self.thread.join()
+        if self.error is not None:
+            error_type, error, traceback = self.error
+            raise error_type, error, traceback
+        return self.taxonomy
+
+
+def select_destinations(known, taxonomy, only=(), subtree=None):
+    """
+    The set of the names of the destinations ``only`` and, if given a ``subtree`` name, of that destination and every
+    destination below it in the ``taxonomy``. The subtree is taken from the taxonomy's nested-set ranges, so it takes
+    time proportional to its size. Only names in ``known`` are selected. Raises a ValueError for a name which is not
+    known, or a subtree which is not in the taxonomy.
+    """
+    names = set()
+    for name in only:
+        if name not in known:
+            raise ValueError('There is no destination named %s' % name)
+        names.add(name)
+    if subtree is not None:
+        if subtree not in taxonomy:
+            raise ValueError('%s cannot be found in the taxonomy' % subtree)
+        if subtree in known:
+            names.add(subtree)
+        names.update(name for name in taxonomy.descendants(subtree) if name in known)
+    return names
 
 
 class LegacyParser(object):
@@ -77,100 +442,332 @@ class LegacyParser(object):
     This parsing class takes a source IO of some kind (usually a file handle, but could be a stream from elsewhere)
     and emits a sequence of Destination objects.
 
-    Its current implementation uses lxml to parse the entire source IO object into memory, and then iterates the
-    elements in the source structure. If we were expecting gigabytes of XML, we could alter this implementation to
-    use SAX (or equivalent) events to parse the structure, only holding in memory at most 2 Destination objects
-    at a time.
+    By default it uses lxml to parse the entire source IO object into memory, and then iterates the elements in the
+    source structure. Enough memory is required for the source IO and a small dict for each destination. Each
+    destination object is not kept inside of the loop.
+
+    If ``streaming`` is set the source is instead read with ``iterparse`` events, and each ``<destination>`` element
+    is cleared (along with its preceding siblings) as soon as it has been processed. The source is read twice, once
+    to collect the metadata used by ``Destination.children()``/``parents()``, and again by ``destinations()``. It
+    must therefore be a filename, or a seekable file object. Memory use stays flat no matter how large the source is.
 
-    Even in its current implementation enough memory is only required for the source IO and a small dict for each
-    destination. Each destination object is not kept inside of the loop.
+    The taxonomy is parsed in the background while the destinations are parsed, unless ``concurrent`` is False, so
+    start up takes about as long as the larger of the two. The wall time each of them took is kept in
+    ``parse_times``, under ``taxonomy`` and ``destinations``.
     """
 
-    def __init__(self, source, taxonomy=None):
+    def __init__(self, source, taxonomy=None, streaming=False, concurrent=True):
         """If we had some schema knowledge we could validate here, although validating an XSD schema would load
-        the entire source into memory. If we wanted to parse using events (see above) we definitely would not want
-        to do that here
+        the entire source into memory. When streaming we definitely would not want to do that here
         """
-        self.xml = etree.parse(source)
+        self.streaming = streaming
         self.taxonomy = LegacyTaxonomies()
+        self.parse_times = {}
+        taxonomy_parse = None
         if taxonomy:
-            self.taxonomy.parse_xml(taxonomy)
-        # Fetch the dest metadata
+            if concurrent:
+                taxonomy_parse = _TaxonomyParse(taxonomy)
+            else:
+                started = time.time()
+                self.taxonomy.parse_xml(taxonomy)
+                self.parse_times['taxonomy'] = time.time() - started
+        started = time.time()
+        try:
+            self._parse_destinations(source)
+        except:
+            # Wait for the taxonomy anyway, so its parse is never left running, but raise the first error
+            error_type, error, traceback = sys.exc_info()
+            if taxonomy_parse is not None:
+                taxonomy_parse.wait()
+            raise error_type, error, traceback
+        self.parse_times['destinations'] = time.time() - started
+        if taxonomy_parse is not None:
+            self.taxonomy = taxonomy_parse.result()
+            self.parse_times['taxonomy'] = taxonomy_parse.elapsed
+
+    def _parse_destinations(self, source):
+        """Parses the destinations in ``source``, collecting their metadata and indexing them by name"""
+        streaming = self.streaming
+        if streaming:
+            if not isinstance(source, basestring) and not hasattr(source, 'seek'):
+                raise ValueError('Streaming requires a filename or a seekable source')
+            self.source = source
+            self._source_start = source.tell() if hasattr(source, 'seek') else None
+            self.xml = None
+            elements = self._iterparse()
+        else:
+            self.xml = etree.parse(source)
+            elements = self.xml.iter('destination')
+        # Fetch the dest metadata, and index each destination by name. The index holds the element itself, or its
+        # position in the source when streaming, so destinations() does not have to derive the names again.
         self.metadata = {}
-        for destination_xml in self.xml.iter('destination'):
-            title = destination_xml.get('title')
-            if title is None or len(title) == 0:
-                log.warn('Destination is missing the title attribute, or it is empty.')
+        self.index = OrderedDict()
+        self._links = None
+        hooks = metrics.active
+        for position, destination_xml in enumerate(elements):
+            name = self._destination_name(destination_xml)
+            if name is None:
                 continue
-            title = title.strip()
-            title_ascii = destination_xml.get('title-ascii')
-            if title_ascii is not None and len(title_ascii) > 0:
-                name = destination_xml.get('title-ascii').lower().replace(' ', '_')
-            else:
-                name = title.lower().replace(' ', '_')
-            metadata = {
-                'title': title,
-                'name': name,
-                'asset_id': destination_xml.get('asset_id'),
-            }
-            self.metadata[name] = metadata
-
-    def destinations(self):
-        for destination_xml in self.xml.iter('destination'):
-            title = destination_xml.get('title')
-            if title is None or len(title) == 0:
-                log.warn('Destination is missing the title attribute, or it is empty.')
+            if name in self.index:
+                log.warn('Destination %s is duplicated in the source, the last one is used' % name)
+                del self.index[name]
+            self.index[name] = position if streaming else destination_xml
+            self.metadata[name] = self._element_metadata(name, destination_xml)
+            if hooks is not None:
+                hooks.destination_parsed(name)
+
+    @staticmethod
+    def _destination_name(destination_xml):
+        """Derive the name of a destination from its element, or return None (with a warning) if it has no title"""
+        title = destination_xml.get('title')
+        if title is None or len(title) == 0:
+            log.warn('Destination is missing the title attribute, or it is empty.')
+            return None
+        title_ascii = destination_xml.get('title-ascii')
+        if title_ascii is not None and len(title_ascii) > 0:
+            return title_ascii.lower().replace(' ', '_')
+        return title.strip().lower().replace(' ', '_')
+
+    @staticmethod
+    def _element_metadata(name, destination_xml):
+        """The metadata of a destination element, used by ``Destination.children()``/``parents()``"""
+        return {
+            'title': destination_xml.get('title').strip(),
+            'name': name,
+            'asset_id': destination_xml.get('asset_id'),
+        }
+
+    def _iterparse(self):
+        """Yields each destination element of the source as it is parsed. Once the caller is finished with an element
+        it is cleared, and any preceding siblings are removed from the root, so the parsed tree never grows.
+        """
+        if self._source_start is not None:
+            self.source.seek(self._source_start)
+        for event, element in etree.iterparse(self.source, events=('end',), tag='destination'):
+            yield element
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+    def destinations(self, names=None):
+        """Yields each destination, in source order. If given ``names`` (such as a set) only the destinations in it are
+        yielded, and the content of the others is never converted."""
+        for name, atlas_id, content, loader in self._records(names):
+            yield self._make_destination(name, atlas_id, content, loader)
+
+    def _records(self, names=None):
+        """Yields a (name, atlas_id, content, loader) record for each indexed destination (or each of ``names``), in
+        source order. Only one of ``content`` or ``loader`` is set. The content of elements held in memory, and of
+        snapshots, is converted lazily by the loader. A streamed element is cleared as soon as the next one is parsed,
+        so its content is converted straight away.
+        """
+        if self.streaming:
+            positions = dict((position, name) for name, position in self.index.iteritems()
+                             if names is None or name in names)
+            for position, destination_xml in enumerate(self._iterparse()):
+                if position in positions:
+                    yield (positions[position], self._element_atlas_id(destination_xml),
+                           self._element_content(destination_xml), None)
+            return
+        for name, entry in self.index.iteritems():
+            if names is not None and name not in names:
                 continue
-            title = title.strip()
-            title_ascii = destination_xml.get('title-ascii')
-            if title_ascii is not None and len(title_ascii) > 0:
-                name = destination_xml.get('title-ascii').lower().replace(' ', '_')
-            else:
-                name = title.lower().replace(' ', '_')
-            metadata = self.metadata[name]  # Fetched from XML earlier.
-            content = self._recursive_dict(destination_xml)[1]  # As it is a recursive function, it returns a set
-            # Clean up the content a little
-            self.cleanup_content(content)
-
-            if name not in self.taxonomy:
-                log.warn('%s in destinations cannot be found in the taxonomy' % name)
-                children = []
-                parents = []
-            else:
-                children = self.taxonomy[name]['children']
-                parents = self.taxonomy[name]['parents']
-            destination = Destination(source=self,
-                                      content=content,
-                                      children=children,
-                                      parents=parents,
-                                      **metadata)
-            atlas_id = destination_xml.get('atlas_id')
-            if atlas_id is not None and len(atlas_id.strip()) > 0:
-                destination.atlas_id = int(atlas_id)
-            yield destination
-
-    def _recursive_dict(self, element):
-        '''Recursively iterate an element and convert all of its members to a either a dict or a list
-        '''
-        child_data = map(self._recursive_dict, element)
-        if len(child_data) == 0:
-            if element.text is None:
-                return element.tag, {}
+            if isinstance(entry, tuple):
+                atlas_id, pickled_content = entry  # From a snapshot
+                yield name, atlas_id, None, partial(pickle.loads, pickled_content)
             else:
-                return element.tag, unicode(element.text.strip())
-
-        lists = {}
-        data = {}
-        for tag_name, tag_data in child_data:
-            if tag_name in data:
-                if tag_name in lists:
-                    lists[tag_name].append(tag_data)
+                yield name, self._element_atlas_id(entry), None, partial(self._element_content, entry)
+
+    def _element_content(self, destination_xml):
+        """Convert the children of a destination element into its content dict"""
+        content = build_content(destination_xml)
+        # Clean up the content a little
+        self.cleanup_content(content)
+        return content
+
+    @staticmethod
+    def _element_atlas_id(destination_xml):
+        atlas_id = destination_xml.get('atlas_id')
+        if atlas_id is not None and len(atlas_id.strip()) > 0:
+            return int(atlas_id)
+        return None
+
+    def links(self, name):
+        """The (children, parents) of the destination ``name``, as lists of the metadata of those destinations. The
+        children of every destination are resolved against the metadata once, the first time this is called, while
+        the parents are listed from the taxonomy when they are asked for."""
+        if self._links is None:
+            self._links = self._resolve_links()
+        children = self._links.get(name)
+        if children is None:
+            return [], []
+        metadata = self.metadata
+        return children, [metadata[key] for key in self.taxonomy.ancestors(name) if key in metadata]
+
+    def _resolve_links(self):
+        """Resolves the taxonomy children of every indexed destination into references to their metadata, in a single
+        pass over the child and parent links. Each child, or parent, link to a node without a destination is reported
+        once, in a single summary."""
+        links = {}
+        unresolved = []
+        metadata = self.metadata
+        taxonomy = self.taxonomy
+        for name in self.index:
+            if name not in taxonomy:
+                continue
+            node = taxonomy[name]
+            children = []
+            for link in node['children']:
+                if link in metadata:
+                    children.append(metadata[link])
                 else:
-                    lists[tag_name] = [data[tag_name], tag_data]
-            else:
-                data[tag_name] = tag_data
-        data.update(lists)
-        return element.tag, data
+                    unresolved.append('%s children %s' % (name, link))
+            links[name] = children
+            parent = taxonomy.parent(name)
+            if parent is not None and parent not in metadata:
+                unresolved.append('%s parents %s' % (name, parent))
+        if unresolved:
+            unresolved.sort()
+            log.warn('%d taxonomy links have no destination, such as: %s' % (len(unresolved),
+                                                                             ', '.join(unresolved[:10])))
+            for link in unresolved:
+                log.debug('Taxonomy link has no destination: %s' % link)
+        return links
+
+    def _make_destination(self, name, atlas_id, content=None, loader=None):
+        """Build the Destination object for an indexed destination"""
+        if name not in self.taxonomy:
+            log.warn('%s in destinations cannot be found in the taxonomy' % name)
+        children, parents = self.links(name)
+        destination = Destination(source=self,
+                                  content=content,
+                                  loader=loader,
+                                  children=children,
+                                  parents=parents,
+                                  **self.metadata[name])
+        if atlas_id is not None:
+            destination.atlas_id = atlas_id
+        return destination
+
+    def select(self, only=(), subtree=None):
+        """The names of the destinations ``only``, and of the destinations in the taxonomy ``subtree`` (see
+        ``select_destinations``)"""
+        return select_destinations(self.metadata, self.taxonomy, only, subtree)
+
+    def snapshot(self):
+        """Returns the parsed state as a picklable dict, from which ``from_snapshot`` can recreate the parser without
+        the source XML. The content of each destination is converted and pickled on its own, so a parser created from
+        the snapshot only unpickles the content of the destinations that are used.
+        """
+        index = []
+        for name, atlas_id, content, loader in self._records():
+            if loader is not None:
+                content = loader()
+            index.append((name, atlas_id, pickle.dumps(content, pickle.HIGHEST_PROTOCOL)))
+        return {
+            'metadata': self.metadata,
+            'index': index,
+            'taxonomy': self.taxonomy,
+        }
+
+    @classmethod
+    def from_snapshot(cls, state):
+        """Create a parser from the state returned by ``snapshot``"""
+        parser = cls.__new__(cls)
+        parser.streaming = False
+        parser.xml = None
+        parser.metadata = state['metadata']
+        parser.taxonomy = state['taxonomy']
+        parser.parse_times = {}
+        parser._links = None
+        parser.index = OrderedDict((name, (atlas_id, pickled_content))
+                                   for name, atlas_id, pickled_content in state['index'])
+        return parser
+
+    @classmethod
+    def from_sharded(cls, filename, taxonomy=None, processes=2, concurrent=True):
+        """
+        Create a parser by parsing the destinations file ``filename`` in ``processes`` worker processes, each parsing
+        a byte range of the file (see addo.shards). The taxonomy is parsed at the same time, unless ``concurrent``
+        is False. Files which cannot be split are parsed as usual.
+        """
+        from multiprocessing import Pool
+        from .shards import parse_sharded
+        # The workers are forked before the taxonomy thread starts, as a fork while it is inside libxml2 may deadlock
+        pool = Pool(processes)
+        try:
+            taxonomy_parse = _TaxonomyParse(taxonomy) if taxonomy and concurrent else None
+        except:
+            pool.terminate()
+            raise
+        started = time.time()
+        try:
+            state = parse_sharded(filename, processes, pool)
+        except:
+            error_type, error, traceback = sys.exc_info()
+            if taxonomy_parse is not None:
+                taxonomy_parse.wait()
+            raise error_type, error, traceback
+        parse_times = {'destinations': time.time() - started}
+        if taxonomy_parse is not None:
+            parsed_taxonomy = taxonomy_parse.result()
+            parse_times['taxonomy'] = taxonomy_parse.elapsed
+        else:
+            started = time.time()
+            parsed_taxonomy = LegacyTaxonomies()
+            if taxonomy:
+                parsed_taxonomy.parse_xml(taxonomy)
+                parse_times['taxonomy'] = time.time() - started
+
+        if state is None:
+            parser = cls(filename)
+            parser.taxonomy = parsed_taxonomy
+            parse_times['destinations'] = parser.parse_times['destinations']
+        else:
+            state['taxonomy'] = parsed_taxonomy
+            parser = cls.from_snapshot(state)
+            hooks = metrics.active
+            if hooks is not None:
+                for name in parser.index:
+                    hooks.destination_parsed(name)
+        parser.parse_times = parse_times
+        return parser
+
+    @classmethod
+    def from_offsets(cls, offset_index, names=None, taxonomy=None):
+        """
+        Create a parser of only the destinations ``names`` (or all of them), parsing each from its range of the file
+        of ``offset_index`` (an addo.offsets.OffsetIndex). The metadata of every destination comes from the index, so
+        their children and parents are the same as with a full parse. Unknown names raise a KeyError. The
+        ``taxonomy`` may be a source, or an already parsed LegacyTaxonomies.
+        """
+        parser = cls.__new__(cls)
+        parser.streaming = False
+        parser.xml = None
+        parser.metadata = offset_index.metadata()
+        parser.taxonomy = LegacyTaxonomies()
+        parser.parse_times = {}
+        if isinstance(taxonomy, LegacyTaxonomies):
+            parser.taxonomy = taxonomy
+        elif taxonomy:
+            started = time.time()
+            parser.taxonomy.parse_xml(taxonomy)
+            parser.parse_times['taxonomy'] = time.time() - started
+        parser._links = None
+        if names is None:
+            names = offset_index
+        else:
+            names = set(names)
+            for name in names:
+                if name not in offset_index:
+                    raise KeyError('There is no destination named %s' % name)
+            names = [name for name in offset_index if name in names]  # In source order
+        parser.index = OrderedDict((name, offset_index.element(name)) for name in names)
+        hooks = metrics.active
+        if hooks is not None:
+            for name in parser.index:
+                hooks.destination_parsed(name)
+        return parser
 
     def cleanup_content(self, content):
         if 'history' in content and len(content['history']) == 1:
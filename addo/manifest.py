@@ -0,0 +1,212 @@
+"""Provides the Manifest class, which records what each rendered page was built from so that a later run only needs
+to render the pages whose inputs have changed.
+
+A build may also be split into shards, each rendering the destinations whose names hash to it (see ``shard_of``) and
+saving a manifest of its own. ``merge_manifests`` combines the manifests of every shard, checking that each page was
+produced by exactly one of them.
+"""
+
+import os, glob, json, struct, hashlib
+from logging import getLogger
+
+log = getLogger(__name__)
+
+
+def file_digest(filename, block_size=1 << 20):
+    """The sha1 hex digest of the contents of ``filename``"""
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as fh:
+        for block in iter(lambda: fh.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def names_digest(names):
+    """The sha1 hex digest of a collection of destination names, in any order"""
+    digest = hashlib.sha1()
+    for name in sorted(names):
+        digest.update(name.encode('utf-8'))
+        digest.update('\0')
+    return digest.hexdigest()
+
+
+def shard_of(name, count):
+    """The shard (from 0 to ``count - 1``) the destination ``name`` belongs to. It only depends on the name, so every
+    host assigns a destination to the same shard no matter what order the destinations are in."""
+    return struct.unpack('>Q', hashlib.sha1(name.encode('utf-8')).digest()[:8])[0] % count
+
+
+def parse_shard(value):
+    """Parses a shard given as ``i/N``, the i-th (from 1) of N shards, into an (i, N) tuple. Raises a ValueError if it
+    is invalid."""
+    index, _, count = value.partition('/')
+    index, count = int(index), int(count)
+    if not 1 <= index <= count:
+        raise ValueError('Invalid shard %s' % value)
+    return index, count
+
+
+def write_json(path, data):
+    """Writes ``data`` as JSON into ``path``. It is written to a temporary file first, so an interrupted write never
+    leaves a truncated file behind."""
+    with open(path + '.tmp', 'wb') as fh:
+        json.dump(data, fh, sort_keys=True)
+    if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)  # Windows will not rename over an existing file
+    os.rename(path + '.tmp', path)
+
+
+class MergeError(ValueError):
+    """The manifests of a sharded build do not add up to one complete build"""
+
+
+class Manifest(object):
+    """
+    A manifest is stored in the output directory. For each destination it holds a digest of everything its page is
+    rendered from: the destination's content and metadata, the names and titles of its taxonomy parents and
+    children, and the template. A page only needs to be rendered again when that digest changes, which includes a
+    neighbour being renamed as it shows up in the navigation.
+
+    The manifest of a shard, given as an (i, N) tuple, is saved under a name of its own along with the number of
+    pages it rendered and a digest of the ``names`` of every destination in the build, for ``merge_manifests``.
+    """
+    FILENAME = '.addo-manifest.json'
+    SHARD_FILENAME = '.addo-manifest.shard-%d-of-%d.json'
+
+    def __init__(self, output_dir, template, shard=None, names=None):
+        self.output_dir = output_dir
+        self.template_digest = file_digest(template)
+        self.shard = shard
+        self.names = names
+        self.previous = {}
+        self.current = {}
+        self.skipped = 0
+        path = self.path()
+        if os.path.isfile(path):
+            try:
+                with open(path, 'rb') as fh:
+                    self.previous = json.load(fh)['destinations']
+            except (ValueError, KeyError, TypeError):
+                log.warn('Ignoring unreadable manifest %s' % path)
+
+    def path(self):
+        filename = self.FILENAME if self.shard is None else self.SHARD_FILENAME % self.shard
+        return os.path.join(self.output_dir, filename)
+
+    def output_filename(self, name):
+        return os.path.join(self.output_dir, '%s.html' % name)
+
+    def digest(self, destination):
+        """The digest of everything the page for ``destination`` is rendered from"""
+        digest = hashlib.sha1(self.template_digest)
+        digest.update(json.dumps(destination.payload(), sort_keys=True))
+        return digest.hexdigest()
+
+    def changed(self, destinations):
+        """Records each of ``destinations`` in the manifest, and yields only those that need to be rendered"""
+        for destination in destinations:
+            digest = self.digest(destination)
+            self.current[destination.name] = digest
+            if self.previous.get(destination.name) == digest and \
+                    os.path.isfile(self.output_filename(destination.name)):
+                self.skipped += 1
+                continue
+            yield destination
+
+    def record(self, destinations):
+        """Records each of ``destinations`` in the manifest, and yields them all"""
+        for destination in destinations:
+            self.current[destination.name] = self.digest(destination)
+            yield destination
+
+    def keep(self, names):
+        """Keeps the previous digests of ``names``, destinations which are not being built this time"""
+        for name in names:
+            if name in self.previous:
+                self.current[name] = self.previous[name]
+
+    def removed(self):
+        """The names of destinations in the previous manifest which no longer exist"""
+        return sorted(set(self.previous) - set(self.current))
+
+    def remove_stale(self):
+        """Deletes the pages of destinations that have disappeared since the previous manifest"""
+        for name in self.removed():
+            filename = self.output_filename(name)
+            if os.path.isfile(filename):
+                log.info('Removing %s' % filename)
+                os.remove(filename)
+
+    def save(self, rendered=None):
+        """Writes the manifest into the output directory, along with the number of pages ``rendered``"""
+        data = {'destinations': self.current}
+        if rendered is not None:
+            data['rendered'] = rendered
+        if self.shard is not None:
+            data['shard'] = list(self.shard)
+            data['template'] = self.template_digest
+            data['destination_count'] = len(self.names)
+            data['names'] = names_digest(self.names)
+        write_json(self.path(), data)
+
+
+def find_shard_manifests(directories):
+    """The filenames of the shard manifests in each of ``directories``"""
+    pattern = Manifest.SHARD_FILENAME.replace('%d', '*')
+    return sorted(filename for directory in directories for filename in glob.glob(os.path.join(directory, pattern)))
+
+
+def merge_manifests(filenames):
+    """
+    Combines the shard manifests ``filenames`` into one. Returns the merged manifest data, whose ``rendered`` is the
+    pages rendered by all of the shards.
+
+    Raises a MergeError unless there is exactly one manifest for each shard, they were all built from the same
+    destinations and template, and every destination was produced by exactly one shard.
+    """
+    shards = {}
+    for filename in filenames:
+        try:
+            with open(filename, 'rb') as fh:
+                data = json.load(fh)
+            index, count = data['shard']
+        except (IOError, ValueError, KeyError, TypeError), e:
+            raise MergeError('Unreadable shard manifest %s: %s' % (filename, e))
+        if (index, count) in shards:
+            raise MergeError('Shard %d/%d has more than one manifest: %s and %s' % (
+                index, count, shards[index, count][0], filename))
+        shards[index, count] = (filename, data)
+    if not shards:
+        raise MergeError('There are no shard manifests to merge')
+
+    counts = set(count for _, count in shards)
+    if len(counts) > 1:
+        raise MergeError('The manifests are of builds split into different numbers of shards: %s' %
+                         ', '.join(str(count) for count in sorted(counts)))
+    count = counts.pop()
+    missing = [index for index in range(1, count + 1) if (index, count) not in shards]
+    if missing:
+        raise MergeError('Missing the manifests of shards %s of %d' % (', '.join(map(str, missing)), count))
+
+    first_filename, first = shards[1, count]
+    for filename, data in shards.itervalues():
+        for key in ('names', 'template'):
+            if data.get(key) != first.get(key):
+                raise MergeError('%s and %s were not built from the same %s' % (
+                    first_filename, filename, 'destinations' if key == 'names' else key))
+
+    destinations = {}
+    producers = {}
+    rendered = 0
+    for (index, _), (filename, data) in sorted(shards.items()):
+        for name, digest in data['destinations'].iteritems():
+            if name in producers:
+                raise MergeError('%s was produced by shards %d and %d' % (name, producers[name], index))
+            producers[name] = index
+            destinations[name] = digest
+        rendered += data.get('rendered', 0)
+    if len(destinations) != first['destination_count']:
+        raise MergeError('The shards produced %d of %d destinations' % (len(destinations), first['destination_count']))
+    if names_digest(destinations) != first['names']:
+        raise MergeError('The shards did not produce the destinations they were built from')
+    return {'destinations': destinations, 'rendered': rendered}
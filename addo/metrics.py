@@ -0,0 +1,252 @@
+"""Hooks which export metrics of builds as they run, for when Addo is embedded in a long running process.
+
+The parser, the renderer and the render loops report events to the installed hooks: each destination parsed, each
+page rendered (with the seconds it took and its size in bytes), and each warning logged by Addo. Nothing is installed
+by default, and callers only report an event once they have checked that ``active`` is not None, so hooks cost
+nothing until they are installed::
+
+    from addo import metrics
+    metrics.install(metrics.StatsdHooks('localhost', 8125))
+
+Pages rendered by worker processes (with ``--jobs``) are reported by the process which started them.
+"""
+
+import os, time, socket, logging, threading
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+# The installed hooks, or None
+active = None
+_handler = None
+
+
+class Hooks(object):
+    """
+    The events reported to hooks. Each method does nothing, so hooks only implement those they need. Events may be
+    reported from several threads at once.
+    """
+    def destination_parsed(self, name):
+        pass
+
+    def page_rendered(self, name, seconds, size):
+        pass
+
+    def warning(self, logger, message):
+        pass
+
+    def flush(self):
+        """Called at the end of each build"""
+        pass
+
+    def close(self):
+        pass
+
+
+class HookSet(Hooks):
+    """Reports each event to each of ``hooks`` in turn"""
+    def __init__(self, hooks):
+        self.hooks = list(hooks)
+
+    def destination_parsed(self, name):
+        for hook in self.hooks:
+            hook.destination_parsed(name)
+
+    def page_rendered(self, name, seconds, size):
+        for hook in self.hooks:
+            hook.page_rendered(name, seconds, size)
+
+    def warning(self, logger, message):
+        for hook in self.hooks:
+            hook.warning(logger, message)
+
+    def flush(self):
+        for hook in self.hooks:
+            hook.flush()
+
+    def close(self):
+        for hook in self.hooks:
+            hook.close()
+
+
+class _WarningHandler(logging.Handler):
+    """Reports the warnings (and errors) logged by Addo to the active hooks"""
+    def emit(self, record):
+        hooks = active
+        if hooks is not None:
+            hooks.warning(record.name, record.getMessage())
+
+
+def install(*hooks):
+    """Installs ``hooks``, replacing any already installed"""
+    global active, _handler
+    active = hooks[0] if len(hooks) == 1 else HookSet(hooks)
+    if _handler is None:
+        _handler = _WarningHandler(logging.WARNING)
+        logging.getLogger('addo').addHandler(_handler)
+
+
+def uninstall():
+    """Removes the installed hooks, without closing them"""
+    global active, _handler
+    active = None
+    if _handler is not None:
+        logging.getLogger('addo').removeHandler(_handler)
+        _handler = None
+
+
+@contextmanager
+def installed(*hooks):
+    """Installs ``hooks`` alongside any already installed, for the duration of the block"""
+    previous = active
+    if not hooks:
+        yield
+        return
+    install(*(((previous,) if previous is not None else ()) + hooks))
+    try:
+        yield
+    finally:
+        if previous is None:
+            uninstall()
+        else:
+            install(previous)
+
+
+def parse_address(address, default_port=8125):
+    """Splits a ``host:port`` address, where the port is optional"""
+    host, _, port = address.rpartition(':')
+    if not host:
+        return port or 'localhost', default_port
+    return host, int(port)
+
+
+class StatsdHooks(Hooks):
+    """
+    Sends metrics to a StatsD server over UDP: counters of the destinations parsed, pages rendered, bytes rendered and
+    warnings, and a timer of the render time of each page. Metrics are batched into packets of up to ``packet_size``
+    bytes, and the last packet is sent when the hooks are flushed. Sending is best effort, errors are ignored.
+    """
+    def __init__(self, host='localhost', port=8125, prefix='addo', packet_size=512):
+        self.address = (host, int(port))
+        self.prefix = prefix
+        self.packet_size = packet_size
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._buffer = []
+        self._buffered = 0
+        self._lock = threading.Lock()
+
+    def _add(self, *metrics):
+        with self._lock:
+            for metric in metrics:
+                if self._buffered + len(metric) >= self.packet_size:
+                    self._send()
+                self._buffer.append(metric)
+                self._buffered += len(metric) + 1
+
+    def _send(self):
+        if self._buffer:
+            try:
+                self.socket.sendto('\n'.join(self._buffer), self.address)
+            except socket.error:
+                pass
+            self._buffer = []
+            self._buffered = 0
+
+    def destination_parsed(self, name):
+        self._add('%s.destinations.parsed:1|c' % self.prefix)
+
+    def page_rendered(self, name, seconds, size):
+        self._add('%s.pages.rendered:1|c' % self.prefix,
+                  '%s.pages.bytes:%d|c' % (self.prefix, size),
+                  '%s.pages.render_time:%.3f|ms' % (self.prefix, seconds * 1000))
+
+    def warning(self, logger, message):
+        self._add('%s.warnings:1|c' % self.prefix)
+
+    def flush(self):
+        with self._lock:
+            self._send()
+
+    def close(self):
+        self.flush()
+        self.socket.close()
+
+
+class PrometheusTextfileHooks(Hooks):
+    """
+    Writes metrics in the Prometheus text format into ``filename``, for the textfile collector of the node exporter:
+    counters of the destinations parsed, pages rendered, bytes rendered and warnings, and a histogram of the render
+    time of each page. The counters keep counting across builds. The file is written when the hooks are flushed, and
+    also while pages are rendered at most every ``interval`` seconds. It is written to a temporary file and renamed,
+    so the collector never reads a partial file.
+    """
+    # The upper bounds, in seconds, of the buckets of the render time histogram
+    BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+    def __init__(self, filename, interval=15.0, prefix='addo'):
+        self.filename = filename
+        self.interval = interval
+        self.prefix = prefix
+        self.destinations = 0
+        self.pages = 0
+        self.bytes = 0
+        self.warnings = 0
+        self.buckets = [0] * len(self.BUCKETS)
+        self.render_seconds = 0.0
+        self._written = time.time()
+        self._lock = threading.RLock()  # An error logged while writing is itself reported as a warning
+
+    def destination_parsed(self, name):
+        with self._lock:
+            self.destinations += 1
+
+    def page_rendered(self, name, seconds, size):
+        with self._lock:
+            self.pages += 1
+            self.bytes += size
+            self.render_seconds += seconds
+            for index, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    self.buckets[index] += 1
+            if time.time() - self._written >= self.interval:
+                self._write()
+
+    def warning(self, logger, message):
+        with self._lock:
+            self.warnings += 1
+
+    def flush(self):
+        with self._lock:
+            self._write()
+
+    def text(self):
+        """The metrics in the Prometheus text format"""
+        prefix = self.prefix
+        lines = []
+        for name, help, value in (('destinations_parsed_total', 'Destinations parsed', self.destinations),
+                                  ('pages_rendered_total', 'Pages rendered', self.pages),
+                                  ('page_bytes_total', 'Bytes of pages rendered', self.bytes),
+                                  ('warnings_total', 'Warnings logged', self.warnings)):
+            lines.append('# HELP %s_%s %s.' % (prefix, name, help))
+            lines.append('# TYPE %s_%s counter' % (prefix, name))
+            lines.append('%s_%s %d' % (prefix, name, value))
+        lines.append('# HELP %s_page_render_seconds Time taken to render each page.' % prefix)
+        lines.append('# TYPE %s_page_render_seconds histogram' % prefix)
+        for bound, count in zip(self.BUCKETS, self.buckets):
+            lines.append('%s_page_render_seconds_bucket{le="%g"} %d' % (prefix, bound, count))
+        lines.append('%s_page_render_seconds_bucket{le="+Inf"} %d' % (prefix, self.pages))
+        lines.append('%s_page_render_seconds_sum %r' % (prefix, self.render_seconds))
+        lines.append('%s_page_render_seconds_count %d' % (prefix, self.pages))
+        return '\n'.join(lines) + '\n'
+
+    def _write(self):
+        self._written = time.time()
+        temp_filename = '%s.%d.tmp' % (self.filename, os.getpid())
+        try:
+            with open(temp_filename, 'wb') as fh:
+                fh.write(self.text())
+            if os.name == 'nt' and os.path.exists(self.filename):
+                os.remove(self.filename)  # Windows will not rename over an existing file
+            os.rename(temp_filename, self.filename)
+        except (IOError, OSError), e:
+            log.error('Could not write metrics to %s: %s' % (self.filename, e))
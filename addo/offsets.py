@@ -0,0 +1,169 @@
+"""Provides the OffsetIndex class, for parsing single destinations out of a large destinations file.
+
+The index maps the name of each destination to the byte range of its element in the file, along with the metadata
+``Destination.children()``/``parents()`` need. It is built by scanning the file (see addo.shards) and parsing only the
+start tag of each element, and can be kept in the temporary directory. A destination is then parsed from its range of
+a memory map of the file, without reading the rest of it.
+"""
+
+import os, mmap, hashlib
+import cPickle as pickle
+from array import array
+from collections import Mapping
+from logging import getLogger
+from lxml import etree
+from .shards import declared_encoding, destination_offsets
+
+log = getLogger(__name__)
+
+
+class OffsetIndex(object):
+    """
+    An index of the ``<destination>`` elements of the file ``filename``. For each destination, in source order, it
+    holds the name, the start and end offsets of the element in arrays, and the title and asset_id. When
+    ``temp_dir`` is given the index is saved there, keyed by the path, size and modification time of the file, and
+    loaded instead of scanning the file while those are unchanged.
+    """
+    PREFIX = 'addo-offsets-'
+    FORMAT = 1  # Part of the key, and increased whenever the layout of the index changes
+
+    def __init__(self, filename, temp_dir=None):
+        self.filename = os.path.abspath(filename)
+        stat = os.stat(self.filename)
+        self.key = (self.FORMAT, stat.st_size, stat.st_mtime)
+        self._fh = None
+        self._data = None
+        self.path = None
+        if temp_dir is not None:
+            self.path = os.path.join(temp_dir, '%s%s.pickle' % (self.PREFIX, hashlib.sha1(self.filename).hexdigest()))
+        if not self._load():
+            self._scan()
+            if self.path is not None:
+                self._save()
+        self.positions = dict((name, position) for position, name in enumerate(self.names))
+
+    def _load(self):
+        if self.path is None or not os.path.isfile(self.path):
+            return False
+        try:
+            with open(self.path, 'rb') as fh:
+                key, state = pickle.load(fh)
+        except Exception, e:
+            log.warn('Ignoring unreadable offset index %s: %s' % (self.path, e))
+            return False
+        if key != self.key:
+            log.debug('Ignoring stale offset index %s' % self.path)
+            return False
+        self.encoding, self.names, self.starts, self.ends, self.titles, self.asset_ids = state
+        return True
+
+    def _save(self):
+        with open(self.path + '.tmp', 'wb') as fh:
+            state = (self.encoding, self.names, self.starts, self.ends, self.titles, self.asset_ids)
+            pickle.dump((self.key, state), fh, pickle.HIGHEST_PROTOCOL)
+        if os.name == 'nt' and os.path.exists(self.path):
+            os.remove(self.path)  # Windows will not rename over an existing file
+        os.rename(self.path + '.tmp', self.path)
+
+    def _scan(self):
+        """Finds the range of each destination element, and parses its start tag for its name and metadata"""
+        from .legacy_parser import LegacyParser
+        data = self.data
+        self.encoding = declared_encoding(data)
+        if self.encoding == 'UTF-16':
+            raise ValueError('%s cannot be indexed, as it is not in an ASCII compatible encoding' % self.filename)
+        offsets = destination_offsets(data)
+        end = data.rfind('</destinations')
+        if not offsets or end < offsets[-1]:
+            end = len(data)
+        parser = etree.XMLParser(encoding=self.encoding, huge_tree=True)
+        entries = {}
+        for start, next_start in zip(offsets, offsets[1:] + [end]):
+            destination_xml = self._start_tag(data, start, next_start, parser)
+            name = LegacyParser._destination_name(destination_xml)
+            if name is None:
+                continue
+            if name in entries:
+                log.warn('Destination %s is duplicated in the source, the last one is used' % name)
+            entries[name] = (start, next_start, destination_xml.get('title').strip(), destination_xml.get('asset_id'))
+        self.names = sorted(entries, key=lambda name: entries[name][0])
+        self.starts = array('l', (entries[name][0] for name in self.names))
+        self.ends = array('l', (entries[name][1] for name in self.names))
+        self.titles = [entries[name][2] for name in self.names]
+        self.asset_ids = [entries[name][3] for name in self.names]
+
+    @staticmethod
+    def _start_tag(data, start, end, parser):
+        """The element of just the start tag at ``start``, or of the whole range when the tag cannot be parsed alone
+        (a '>' inside an attribute value)"""
+        tag_end = data.find('>', start, end) + 1
+        tag = data[start:tag_end]
+        try:
+            return etree.fromstring(tag if tag.endswith('/>') else tag + '</destination>', parser)
+        except etree.XMLSyntaxError:
+            return etree.fromstring(data[start:end], parser)
+
+    @property
+    def data(self):
+        """A read only memory map of the file"""
+        if self._data is None:
+            self._fh = open(self.filename, 'rb')
+            self._data = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._data
+
+    def close(self):
+        if self._data is not None:
+            self._data.close()
+            self._fh.close()
+            self._data = self._fh = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __contains__(self, name):
+        return name in self.positions
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def metadata(self):
+        """The metadata of every destination, as held by ``LegacyParser.metadata``"""
+        return OffsetMetadata(self)
+
+    def element(self, name):
+        """Parses the ``<destination>`` element of ``name`` from its range of the file"""
+        position = self.positions[name]
+        fragment = self.data[self.starts[position]:self.ends[position]]
+        return etree.fromstring(fragment, etree.XMLParser(encoding=self.encoding, huge_tree=True))
+
+
+class OffsetMetadata(Mapping):
+    """The metadata of the destinations in an OffsetIndex, as a mapping of name to metadata dict. Each dict is only
+    built when it is first looked up."""
+    def __init__(self, offset_index):
+        self.offset_index = offset_index
+        self._records = {}
+
+    def __getitem__(self, name):
+        record = self._records.get(name)
+        if record is None:
+            index = self.offset_index
+            position = index.positions[name]
+            record = self._records[name] = {'title': index.titles[position], 'name': name,
+                                            'asset_id': index.asset_ids[position]}
+        return record
+
+    def __contains__(self, name):
+        return name in self.offset_index.positions
+
+    def __iter__(self):
+        return iter(self.offset_index.names)
+
+    def __len__(self):
+        return len(self.offset_index.names)
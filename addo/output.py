@@ -0,0 +1,48 @@
+"""Writes rendered pages out, for the write stage of the pipeline (see addo.pipeline).
+
+Writing a page is blocking I/O, which on a network filesystem can take as long as rendering it. The write stage runs
+``write_page`` on a pool of threads (which do not hold the GIL while writing), so rendering the next page overlaps
+with writing the previous ones.
+"""
+
+import os
+from logging import getLogger
+from .render import replace_file
+
+log = getLogger(__name__)
+
+
+class WriteError(IOError):
+    """A page could not be written. ``name`` is the destination of the page."""
+    def __init__(self, name, filename, error):
+        super(WriteError, self).__init__('Could not write %s to %s: %s' % (name, filename, error))
+        self.name = name
+        self.filename = filename
+
+
+def write_page(name, filename, blocks):
+    """Writes the encoded ``blocks`` of the page of destination ``name`` to ``filename``, through a temporary file
+    which is renamed into place. Raises a WriteError on failure."""
+    temp_filename = '%s.%d.tmp' % (filename, os.getpid())
+    try:
+        with open(temp_filename, 'wb') as fh:
+            fh.writelines(blocks)
+        replace_file(temp_filename, filename)
+    except Exception, e:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise WriteError(name, filename, e)
+
+
+def sync_directories(directories):
+    """Syncs each of ``directories``, so the files renamed into them are durable"""
+    if os.name == 'nt':
+        return  # Directories cannot be opened, or synced, on Windows
+    for directory in directories:
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        except OSError, e:
+            log.debug('Could not sync %s: %s' % (directory, e))
+        finally:
+            os.close(fd)
@@ -0,0 +1,60 @@
+"""Renders destinations across a pool of worker processes.
+
+Each worker compiles the template once, when it starts, and is then sent light payloads of destination data (see
+``Destination.payload``) rather than the parser, which holds lxml objects and cannot be pickled. Each worker is also
+given the metadata and taxonomy of the parser when it starts, so templates can query the whole taxonomy.
+"""
+
+import time
+from multiprocessing import Pool
+from . import metrics
+from .destination import Destination, PayloadSource
+from .render import FileRenderer, write_destination
+
+# The renderer and output directory of the current worker process, set by _init_worker
+_worker = {}
+
+
+def _init_worker(template, module_directory, template_cache, output, metadata, taxonomy):
+    metrics.uninstall()  # Pages are reported by the parent, from the results of the workers
+    _worker['renderer'] = FileRenderer(filename=template, module_directory=module_directory,
+                                       template_cache=template_cache)
+    _worker['output'] = output
+    _worker['source'] = PayloadSource(metadata.itervalues(), taxonomy)
+
+
+def _render_payload(payload):
+    """Renders a destination, returning its name, the seconds taken and the bytes written"""
+    destination = Destination.from_payload(payload, _worker['source'])
+    started = time.time()
+    size = write_destination(_worker['renderer'], destination.source, destination, _worker['output'])
+    return destination.name, time.time() - started, size
+
+
+def render_parallel(source, destinations, template, output, jobs, module_directory=None, template_cache='disk',
+                    chunksize=8):
+    """Render and write each of the ``destinations`` of the parser ``source`` into the ``output`` directory using
+    ``jobs`` processes.
+    Returns the number of files rendered by all of the workers. Each page is reported to the active metrics hooks.
+
+    The template is compiled here first, so errors in it are raised before any worker starts (a worker that fails
+    to initialise is simply replaced by the pool). The forked workers then find it already compiled.
+    """
+    FileRenderer(filename=template, module_directory=module_directory, template_cache=template_cache)
+    pool = Pool(processes=jobs, initializer=_init_worker,
+                initargs=(template, module_directory, template_cache, output, source.metadata, source.taxonomy))
+    try:
+        payloads = (destination.payload() for destination in destinations)
+        rendered = 0
+        for name, seconds, size in pool.imap_unordered(_render_payload, payloads, chunksize):
+            rendered += 1
+            hooks = metrics.active
+            if hooks is not None:
+                hooks.page_rendered(name, seconds, size)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return rendered
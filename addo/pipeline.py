@@ -0,0 +1,181 @@
+"""Provides the Pipeline class, which runs the stages of a build (such as parsing, rendering and writing) concurrently.
+
+Items from a source iterable flow through a series of stages, each run by its own threads and joined by bounded
+queues. A stage blocks when the queue after it is full, so a slow stage holds back the ones before it rather than
+letting items pile up in memory. Parsing with lxml and writing files release the GIL, so they overlap with rendering.
+"""
+
+import os, sys, threading, time
+from Queue import Queue
+from logging import getLogger
+from .output import write_page, sync_directories
+
+log = getLogger(__name__)
+
+# Put on a queue once for each thread of the stage reading it, when there are no more items
+_END = object()
+
+
+class Stage(object):
+    """
+    A stage of a pipeline, calling ``function`` with each item on ``workers`` threads. The result is passed on to
+    the next stage, unless it is None. At most ``depth`` items wait in the queue in front of the stage.
+
+    Each stage keeps stats of the items it has handled, the time its threads spent busy, waiting for an item, and
+    waiting for room in the next queue.
+    """
+    def __init__(self, name, function, workers=1, depth=16):
+        if workers < 1 or depth < 1:
+            raise ValueError('The workers and depth of stage %s must be at least 1' % name)
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.depth = depth
+        self.items = 0
+        self.busy = 0.0
+        self.input_wait = 0.0
+        self.output_wait = 0.0
+        self._lock = threading.Lock()
+
+    def _record(self, busy, input_wait, output_wait):
+        with self._lock:
+            self.items += 1
+            self.busy += busy
+            self.input_wait += input_wait
+            self.output_wait += output_wait
+
+    def throughput(self):
+        """The items handled each second by a thread of the stage while it was busy"""
+        return self.items / self.busy if self.busy else 0.0
+
+    def stats(self):
+        return {'items': self.items, 'busy': self.busy, 'throughput': self.throughput(),
+                'input_wait': self.input_wait, 'output_wait': self.output_wait}
+
+
+class Pipeline(object):
+    """
+    Runs each item of ``source`` through the ``stages`` in order. The source is read by a thread of its own, which
+    is reported as a stage named ``source_name``.
+
+    When any stage raises an exception the source stops being read, the items already queued are dropped, and the
+    first exception is raised again from ``run`` once every thread has finished.
+    """
+    def __init__(self, source, stages, source_name='source'):
+        if not stages:
+            raise ValueError('A pipeline needs at least one stage')
+        self.source = source
+        self.source_stage = Stage(source_name, None)
+        self.stages = stages
+        self.error = None
+        self._lock = threading.Lock()
+
+    def run(self):
+        """Runs the pipeline until the source is exhausted or a stage fails. Returns the number of items which made
+        it through the last stage."""
+        queues = [Queue(stage.depth) for stage in self.stages]
+        threads = [threading.Thread(target=self._read_source, args=(queues[0], self.stages[0].workers),
+                                    name='addo-%s' % self.source_stage.name)]
+        for index, stage in enumerate(self.stages):
+            if index + 1 < len(self.stages):
+                output, readers = queues[index + 1], self.stages[index + 1].workers
+            else:
+                output, readers = None, 0
+            remaining = [stage.workers]
+            for number in range(stage.workers):
+                threads.append(threading.Thread(target=self._run_stage,
+                                                args=(stage, queues[index], output, readers, remaining),
+                                                name='addo-%s-%d' % (stage.name, number)))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self.error is not None:
+            error_type, error, traceback = self.error
+            raise error_type, error, traceback
+        return self.stages[-1].items
+
+    def log_stats(self):
+        """Logs the throughput and queue waits of each stage"""
+        for stage in [self.source_stage] + self.stages:
+            log.info('%s: %d items, %.1f/s per thread, %.2fs waiting for input, %.2fs waiting for output' % (
+                stage.name, stage.items, stage.throughput(), stage.input_wait, stage.output_wait))
+
+    def _fail(self):
+        with self._lock:
+            if self.error is None:
+                self.error = sys.exc_info()
+
+    def _read_source(self, output, readers):
+        stage = self.source_stage
+        try:
+            iterator = iter(self.source)
+            while self.error is None:
+                started = time.time()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                produced = time.time()
+                output.put(item)
+                stage._record(produced - started, 0.0, time.time() - produced)
+        except Exception:
+            self._fail()
+        finally:
+            for _ in range(readers):
+                output.put(_END)
+
+    def _run_stage(self, stage, input, output, readers, remaining):
+        try:
+            while True:
+                waiting = time.time()
+                item = input.get()
+                started = time.time()
+                if item is _END:
+                    break
+                if self.error is not None:
+                    continue  # Drain the queue, so the stages before this one are never left blocked
+                try:
+                    result = stage.function(item)
+                except Exception:
+                    self._fail()
+                    continue
+                finished = time.time()
+                if output is not None and result is not None:
+                    output.put(result)
+                stage._record(finished - started, started - waiting, time.time() - finished)
+        finally:
+            with stage._lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last and output is not None:
+                for _ in range(readers):
+                    output.put(_END)
+
+
+def render_pipeline(renderer, source, destinations, output, content_threads=1, render_threads=1, writers=4, depth=16):
+    """
+    Renders and writes each of the ``destinations`` of the parser ``source`` into the ``output`` directory, with a
+    pipeline of stages: reading the destinations (parsing them, when streaming), converting their content, rendering
+    them with ``renderer`` and writing the pages. Returns the Pipeline, once it has been run.
+    """
+    def load_content(destination):
+        destination.content
+        return destination
+
+    def render(destination):
+        log.info('Rendering %s' % destination.name)
+        filename = os.path.join(output, '%s.html' % destination.name)
+        return destination.name, filename, renderer.render_blocks(parser=source, destination=destination)
+
+    def write(page):
+        write_page(*page)
+
+    pipeline = Pipeline(destinations, [Stage('content', load_content, content_threads, depth),
+                                       Stage('render', render, render_threads, depth),
+                                       Stage('write', write, writers, depth)], source_name='parse')
+    pipeline.run()
+    sync_directories([output])
+    return pipeline
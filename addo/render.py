@@ -1,7 +1,58 @@
 """Provides the FileRenderer class, a (very) simple override of Mako's Template class. Also some small helper functions
 for the template rendering."""
 
+import os, sys, glob, time, hashlib
+from logging import getLogger
+from mako import __version__ as mako_version
+from mako.runtime import Context
 from mako.template import Template
+from . import metrics
+
+log = getLogger(__name__)
+
+# The compiled module (and its Mako ModuleInfo) of each template compiled by this process, by template key
+_compiled = {}
+
+
+def default_cache_dir():
+    """The per-user directory compiled templates are cached in"""
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'addo', 'templates')
+
+
+# The Template options which change the code of a compiled template, so a module compiled with other values of them
+# is never reused
+COMPILE_OPTIONS = ('input_encoding', 'disable_unicode', 'default_filters', 'buffer_filters', 'imports',
+                   'future_imports', 'strict_undefined', 'enable_loop', 'preprocessor')
+
+
+def _option_repr(value):
+    """A representation of an option value which is the same in every process, naming functions rather than giving
+    their address"""
+    if isinstance(value, (list, tuple)):
+        return '[%s]' % ', '.join(_option_repr(item) for item in value)
+    if callable(value):
+        return '%s.%s' % (getattr(value, '__module__', None), getattr(value, '__name__', type(value).__name__))
+    return repr(value)
+
+
+def template_key(filename, options=None):
+    """
+    Returns a (path, version) pair of digests for the template ``filename``. The path digest identifies the template
+    file, and the version digest changes whenever its mtime or content, Mako, the Python version, or any of the
+    compile ``options`` (a dict of the COMPILE_OPTIONS) does.
+    """
+    path = os.path.abspath(filename)
+    with open(path, 'rb') as fh:
+        content = fh.read()
+    version = hashlib.sha1('%r:%s:%s:%d.%d' % (os.stat(path).st_mtime, hashlib.sha1(content).hexdigest(),
+                                               mako_version, sys.version_info[0], sys.version_info[1]))
+    for name, value in sorted((options or {}).iteritems()):
+        version.update(':%s=%s' % (name, _option_repr(value)))
+    return hashlib.sha1(path).hexdigest(), version.hexdigest()
 
 
 def prettify_paragraphs(source):
@@ -11,22 +62,112 @@ def prettify_paragraphs(source):
     1. For any grouping of text that has two newlines, it wraps this group in <p> tags.
     2. If an entire paragraph is less than 40 characters, it wraps it in <b> tags (implied subheading)
 
+    The output is built in a single buffer.
+
     :param source:
     :return:
     """
-    paragraphs = []
-    for paragraph in source.split('\n\n'):
-        if len(paragraph.strip()) == 0:
-            continue
-        if len(paragraph) < 40:
-            paragraphs.append(u'<b>%s</b>' % paragraph.strip())
-        else:
-            paragraphs.append(paragraph)
+    output = []
+    append = output.append
+    for paragraph in source.split(u'\n\n'):
+        stripped = paragraph.strip()
+        if stripped:
+            if len(paragraph) < 40:
+                append(u'<p><b>')
+                append(stripped)
+                append(u'</b></p>')
+            else:
+                append(u'<p>')
+                append(paragraph)
+                append(u'</p>')
+    return u''.join(output)
 
-    return ''.join([u'<p>%s</p>' % p for p in paragraphs])
+
+class EncodedWriter(object):
+    """
+    The buffer of a Mako Context which encodes the rendered text into the binary file ``fh`` as it is rendered. Like
+    Mako's own buffer, writing mostly just appends to a list (encoding each small write is far slower than encoding
+    large blocks), but every ``block_size`` writes the text so far is encoded and written to ``fh``. Only one block
+    of the page is held in memory at a time, and ``flush`` writes the last of it at the end of the render.
+    """
+    def __init__(self, fh, encoding, errors='strict', block_size=4096):
+        self.fh = fh
+        self.encoding = encoding
+        self.errors = errors
+        self.block_size = block_size
+        self.parts = []
+        self._append = self.parts.append
+        self.written = 0
+
+    def write(self, text):
+        self._append(text)
+        if len(self.parts) >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        parts = self.parts
+        if parts:
+            data = u''.join(parts).encode(self.encoding, self.errors)
+            del parts[:]
+            self.fh.write(data)
+            self.written += len(data)
 
 
 class FileRenderer(Template):
+    """
+    A Mako Template which manages the cache of its compiled module. A template file is compiled at most once per
+    process (for each set of its ``compile_options``), and by default the compiled module is also kept on disk, in
+    ``module_directory`` or else a per-user cache directory, so later runs do not compile it again either.
+
+    ``template_cache`` is either 'disk' (the default), 'memory' to only keep compiled templates within the process,
+    which suits embedded use, or 'none' to always compile.
+
+    Files are written by ``render_file`` in the ``output_encoding``, which defaults to UTF-8.
+    """
+    CACHES = ('disk', 'memory', 'none')
+
+    def __init__(self, *args, **kwargs):
+        self.template_cache = kwargs.pop('template_cache', 'disk')
+        self._cache_dir = kwargs.pop('module_directory', None)
+        kwargs.setdefault('output_encoding', 'UTF-8')
+        if self.template_cache not in self.CACHES:
+            raise ValueError('Invalid template cache %r, expected one of %s' % (self.template_cache,
+                                                                               ', '.join(self.CACHES)))
+        super(FileRenderer, self).__init__(*args, **kwargs)
+        self.module_directory = self._cache_dir  # Mako's Template sets it to None, as it was not given one
+
+    def _compile_from_file(self, path, filename):
+        if self.template_cache == 'none':
+            return super(FileRenderer, self)._compile_from_file(None, filename)
+        path_key, version_key = key = template_key(filename, self.compile_options())
+        if key in _compiled:
+            module, self._mmarker = _compiled[key]
+            return module
+
+        module = None
+        if self.template_cache == 'disk':
+            cache_dir = self._cache_dir or default_cache_dir()
+            module_path = os.path.join(cache_dir, '%s-%s.py' % (path_key, version_key))
+            if not os.path.exists(module_path):
+                # Compiled modules of earlier versions of this template are no longer needed
+                for stale in glob.glob(os.path.join(cache_dir, '%s-*.py*' % path_key)):
+                    try:
+                        os.remove(stale)
+                    except OSError:
+                        pass
+            try:
+                module = super(FileRenderer, self)._compile_from_file(module_path, filename)
+            except (IOError, OSError), e:
+                log.warn('Could not cache the compiled template in %s: %s' % (cache_dir, e))
+        if module is None:
+            module = super(FileRenderer, self)._compile_from_file(None, filename)
+        _compiled[key] = module, self._mmarker
+        return module
+
+    def compile_options(self):
+        """The values of the COMPILE_OPTIONS of this template, which are part of its template key"""
+        return dict((name, getattr(self, name)) for name in COMPILE_OPTIONS)
+
     def render_unicode(self, *args, **data):
         """
         Inserts render helpers, not configurable in any way. Then calls the super method from the Mako Template
@@ -35,3 +176,60 @@ class FileRenderer(Template):
         data['prettify_paragraphs'] = prettify_paragraphs
         return super(FileRenderer, self).render_unicode(*args, **data)
 
+    def _render_into(self, fh, data):
+        """Renders into the binary file-like ``fh``, returning the number of bytes written. The page is reported to the
+        active metrics hooks, named after the ``destination`` it renders."""
+        hooks = metrics.active
+        if hooks is not None:
+            started = time.time()
+        data['prettify_paragraphs'] = prettify_paragraphs
+        writer = EncodedWriter(fh, self.output_encoding, self.encoding_errors)
+        context = Context(writer, **data)
+        context._outputting_as_unicode = True
+        self.render_context(context, **data)
+        writer.flush()
+        if hooks is not None:
+            hooks.page_rendered(getattr(data.get('destination'), 'name', None), time.time() - started, writer.written)
+        return writer.written
+
+    def render_file(self, filename, **data):
+        """
+        Renders into ``filename``, encoding the output as it is rendered. The file is written under a temporary name
+        and then renamed over ``filename``, so it is never seen partially written.
+        Returns the number of bytes written.
+        """
+        temp_filename = '%s.%d.tmp' % (filename, os.getpid())
+        try:
+            with open(temp_filename, 'wb') as fh:
+                written = self._render_into(fh, data)
+            replace_file(temp_filename, filename)
+        except:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            raise
+        return written
+
+    def render_blocks(self, **data):
+        """Renders into a list of encoded blocks of bytes, ready to be written out"""
+        blocks = _Blocks()
+        self._render_into(blocks, data)
+        return blocks
+
+
+class _Blocks(list):
+    write = list.append
+
+
+def replace_file(source, destination):
+    """Renames ``source`` over ``destination``"""
+    if os.name == 'nt' and os.path.exists(destination):
+        os.remove(destination)  # Windows will not rename over an existing file
+    os.rename(source, destination)
+
+
+def write_destination(renderer, parser, destination, output_dir):
+    """Render ``destination`` with ``renderer``, into a html file named after it in ``output_dir``. Returns the number
+    of bytes written."""
+    output_filename = os.path.join(output_dir, '%s.html' % destination.name)
+    log.info('Rendering %s' % destination.name)
+    return renderer.render_file(output_filename, parser=parser, destination=destination)
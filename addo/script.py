@@ -1,11 +1,19 @@
 """Contains the method used to run the generator from the command-line."""
 
-import os, argparse, codecs
+import os, sys, argparse, cProfile
+from contextlib import contextmanager
 from logging import getLogger, basicConfig
 from logging.config import fileConfig
 from ConfigParser import SafeConfigParser
-from .legacy_parser import LegacyParser
-from render import FileRenderer
+from . import metrics
+from .legacy_parser import LegacyParser, LegacyTaxonomies, select_destinations
+from .render import FileRenderer, write_destination
+from .parallel import render_parallel
+from .offsets import OffsetIndex
+from .manifest import Manifest, MergeError, find_shard_manifests, merge_manifests, parse_shard, shard_of, write_json
+from .pipeline import render_pipeline
+from .snapshot import Snapshot
+from .stats import BuildStats
 
 
 def get_args_parser():
@@ -23,11 +31,61 @@ def get_args_parser():
                         help='A directory to put temporary files into')
     parser.add_argument('-o', dest='output',
                         help='The directory to output the rendered HTML')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int,
+                        help='The number of processes to render with (default 1)')
+    parser.add_argument('--write-queue', dest='write_queue', type=int,
+                        help='The number of destinations that may wait between each stage of parsing, converting '
+                             'content, rendering and writing (default 16, 0 to run the stages in turn)')
+    parser.add_argument('--content-threads', dest='content_threads', type=int,
+                        help='The number of threads converting the content of destinations (default 1)')
+    parser.add_argument('--render-threads', dest='render_threads', type=int,
+                        help='The number of threads rendering pages (default 1)')
+    parser.add_argument('--writers', dest='writers', type=int,
+                        help='The number of threads writing rendered pages (default 4)')
+    parser.add_argument('--parse-jobs', dest='parse_jobs', type=int,
+                        help='The number of processes to parse the destinations with, each parsing a part of the file '
+                             '(default 1)')
+    parser.add_argument('--incremental', dest='incremental', action='store_const', const=True,
+                        help='Only render the destinations that changed since the last run into the output directory')
+    parser.add_argument('--only', dest='only', metavar='NAME[,NAME]',
+                        help='Only render the named destinations')
+    parser.add_argument('--subtree', dest='subtree', metavar='NAME',
+                        help='Only render the named destination and the destinations below it in the taxonomy')
+    parser.add_argument('--shard', dest='shard', metavar='i/N',
+                        help='Only render the destinations in the i-th of N shards (by a hash of their names), saving '
+                             'a manifest of the shard to be checked with `addo merge`')
+    parser.add_argument('--no-snapshot', dest='snapshot', action='store_const', const=False,
+                        help='Do not cache the parsed inputs in the temporary dir')
+    parser.add_argument('--template-cache', dest='template_cache', choices=FileRenderer.CACHES,
+                        help='Where compiled templates are cached: on disk (the default, in --tmp or a per-user '
+                             'cache dir), in memory only, or none')
+    parser.add_argument('--serial-parse', dest='concurrent_parse', action='store_const', const=False,
+                        help='Parse the taxonomy after the destinations, rather than at the same time')
+    parser.add_argument('--stream', dest='stream', action='store_const', const=True,
+                        help='Parse the destinations as a stream, to keep memory use flat on very large inputs')
+    parser.add_argument('--stats', dest='stats', action='store_const', const=True,
+                        help='Report the time taken by each phase, the render time of the pages, the bytes written '
+                             'and the peak memory used')
+    parser.add_argument('--profile', dest='profile', metavar='FILE',
+                        help='Profile a serial build with cProfile, saving the stats to FILE (for pstats or snakeviz)')
+    parser.add_argument('--statsd', dest='statsd', metavar='HOST:PORT',
+                        help='Send metrics of the build to a StatsD server')
+    parser.add_argument('--prometheus-textfile', dest='prometheus_textfile', metavar='FILE',
+                        help='Write metrics of the build to FILE, for the Prometheus textfile collector')
     parser.add_argument('--debug', dest='debug', action='store_true',
                         help='Be verbose. This allows errors to be output as they occur.')
     return parser
 
 
+def asbool(value):
+    """Interpret a config value as a boolean. Values from the CLI are already booleans, those from an ini file are
+    strings such as ``true``, ``yes``, ``on`` or ``1``.
+    """
+    if isinstance(value, basestring):
+        return value.strip().lower() in ('true', 'yes', 'on', 'y', 't', '1')
+    return bool(value)
+
+
 def get_ini_config(ini_filename, section, ini_fp=None):
     """Extract config from an ini file named in ``ini_filename``, from the ``section`` provided.
     Configure logging on the way past.
@@ -54,10 +112,183 @@ def get_ini_config(ini_filename, section, ini_fp=None):
         return {}
 
 
+def load_selection(config, taxonomy_fp):
+    """Create a LegacyParser of only the destinations selected by the ``only`` and ``subtree`` options, parsing each
+    from its range of the destinations file with an OffsetIndex kept in the temporary dir."""
+    with OffsetIndex(config['destinations'], temp_dir=config['temp_dir']) as offset_index:
+        taxonomy = LegacyTaxonomies()
+        taxonomy.parse_xml(taxonomy_fp)
+        names = select_destinations(offset_index, taxonomy, config.get('only', ()), config.get('subtree'))
+        return LegacyParser.from_offsets(offset_index, names, taxonomy=taxonomy)
+
+
+def load_parser(config, destinations_fp, taxonomy_fp):
+    """Create the LegacyParser for the configured inputs. When there is a temporary dir (and not streaming) the parsed
+    inputs are cached in a snapshot there, and loaded from it while the inputs are unchanged. With more than one
+    ``parse_jobs`` the destinations are parsed in that many processes.
+
+    When only some destinations are selected, and there is a temporary dir, only those destinations are parsed (see
+    ``load_selection``).
+    """
+    streaming = asbool(config.get('stream', False))
+    if (config.get('only') or config.get('subtree')) and 'temp_dir' in config and not streaming:
+        return load_selection(config, taxonomy_fp)
+    snapshot = None
+    if 'temp_dir' in config and not streaming and asbool(config.get('snapshot', True)):
+        snapshot = Snapshot(config['temp_dir'], config['destinations'], config['taxonomy'])
+        destination_parser = snapshot.load()
+        if destination_parser is not None:
+            return destination_parser
+    concurrent = asbool(config.get('concurrent_parse', True))
+    parse_jobs = int(config.get('parse_jobs', 1))
+    if parse_jobs > 1 and not streaming:
+        destination_parser = LegacyParser.from_sharded(config['destinations'],
+                                                       taxonomy=taxonomy_fp,
+                                                       processes=parse_jobs,
+                                                       concurrent=concurrent)
+    else:
+        destination_parser = LegacyParser(source=destinations_fp,
+                                          taxonomy=taxonomy_fp,
+                                          streaming=streaming,
+                                          concurrent=concurrent)
+    if snapshot is not None:
+        parse_times = destination_parser.parse_times
+        destination_parser = snapshot.save(destination_parser)
+        destination_parser.parse_times = parse_times
+    return destination_parser
+
+
+@contextmanager
+def _no_phase(name):
+    yield
+
+
+def get_metrics_hooks(config):
+    """The metrics hooks configured by the ``statsd`` and ``prometheus_textfile`` options"""
+    hooks = []
+    if config.get('statsd'):
+        host, port = metrics.parse_address(config['statsd'])
+        hooks.append(metrics.StatsdHooks(host, port))
+    if config.get('prometheus_textfile'):
+        hooks.append(metrics.PrometheusTextfileHooks(config['prometheus_textfile']))
+    return hooks
+
+
+def build(config, destinations_fp, taxonomy_fp, stats=None):
+    """Parses the inputs and renders the pages of the (already validated) ``config``. Returns the number of pages
+    rendered. The phases of the build are recorded in ``stats``, if given a BuildStats, which must also be installed
+    as metrics hooks to be told of each page rendered.
+    """
+    log = getLogger('addo.script')
+    phase = stats.phase if stats is not None else _no_phase
+    jobs = int(config.get('jobs', 1))
+    write_queue = int(config.get('write_queue', 16))
+
+    # Compile the template before parsing, so errors in it show up straight away
+    module_directory = config.get('temp_dir')
+    template_cache = config.get('template_cache', 'disk')
+    with phase('template compile'):
+        renderer = FileRenderer(filename=config['template'], module_directory=module_directory,
+                                template_cache=template_cache)
+
+    with phase('parse'):
+        destination_parser = load_parser(config, destinations_fp, taxonomy_fp)
+    if stats is not None:
+        for name in ('taxonomy', 'destinations'):
+            if name in destination_parser.parse_times:
+                stats.add_phase('%s parse' % name, destination_parser.parse_times[name], within='parse')
+
+    # The destinations outside of the selection, or of the shard, are never converted
+    names = None
+    if config.get('only') or config.get('subtree'):
+        names = destination_parser.select(config.get('only', ()), config.get('subtree'))
+        log.info('Selected %d of %d destinations' % (len(names), len(destination_parser.metadata)))
+    shard = config.get('shard')
+    if shard is not None:
+        index, count = shard
+        names = set(name for name in (destination_parser.metadata if names is None else names)
+                    if shard_of(name, count) == index - 1)
+        log.info('Shard %d/%d has %d destinations' % (index, count, len(names)))
+    destinations = destination_parser.destinations(names)
+    manifest = None
+    incremental = asbool(config.get('incremental', False))
+    if incremental or shard is not None:
+        manifest = Manifest(config['output'], config['template'], shard=shard, names=destination_parser.metadata)
+        if names is not None:
+            # The pages of the other destinations are left as they are, and so are their entries in the manifest
+            manifest.keep(name for name in destination_parser.metadata if name not in names)
+        destinations = manifest.changed(destinations) if incremental else manifest.record(destinations)
+
+    with phase('render and write'):
+        if jobs > 1:
+            rendered = render_parallel(destination_parser, destinations, config['template'],
+                                       config['output'], jobs, module_directory=module_directory,
+                                       template_cache=template_cache)
+        elif write_queue > 0:
+            pipeline = render_pipeline(renderer, destination_parser, destinations, config['output'],
+                                       content_threads=int(config.get('content_threads', 1)),
+                                       render_threads=int(config.get('render_threads', 1)),
+                                       writers=int(config.get('writers', 4)), depth=write_queue)
+            pipeline.log_stats()
+            rendered = pipeline.stages[-1].items
+        else:
+            rendered = 0
+            for destination in destinations:
+                write_destination(renderer, destination_parser, destination, config['output'])
+                rendered += 1
+    if stats is not None:
+        if jobs == 1 and write_queue > 0:
+            # The time the threads of each stage spent busy, which may add up to more than the wall time
+            for stage in pipeline.stages:
+                stats.add_phase('%s (busy)' % stage.name, stage.busy, within='render and write')
+        else:
+            stats.note('pages are rendered straight into their files, so render and write are timed together '
+                       '(the pipeline, with --write-queue, times each stage)')
+
+    if manifest is not None:
+        manifest.remove_stale()
+        manifest.save(rendered)
+        log.info('Skipped %d unchanged files, removed %d.' % (manifest.skipped, len(manifest.removed())))
+    return rendered
+
+
+def get_merge_args_parser():
+    """Initialises and returns the opts parser of ``addo merge``"""
+    parser = argparse.ArgumentParser(prog='addo merge', description=merge.__doc__)
+    parser.add_argument('directories', metavar='directory', nargs='+',
+                        help='The output directories of the shards, holding their manifests')
+    parser.add_argument('-o', dest='output',
+                        help='The directory to save the merged manifest in (default the first directory)')
+    return parser
+
+
+def merge(args):
+    """
+    Combines the manifests of a build split with --shard, checking that every destination was rendered by exactly one
+    shard. The merged manifest can then be used by an --incremental build.
+    """
+    parser = get_merge_args_parser()
+    args = parser.parse_args(args)
+    output = args.output or args.directories[0]
+    if not os.path.isdir(output):
+        parser.error('Invalid output directory')
+    try:
+        merged = merge_manifests(find_shard_manifests(args.directories))
+    except MergeError, e:
+        parser.exit(4, '%s\n' % e)
+    write_json(os.path.join(output, Manifest.FILENAME), merged)
+    print 'Merged %d destinations, rendered %d files.' % (len(merged['destinations']), merged['rendered'])
+
+
 def main(args=None):
     """
     Commandline implementation of Addo. Transforms the given destinations into HTML using the given template.
     """
+    if args is None:
+        args = sys.argv[1:]
+    if args and args[0] == 'merge':
+        return merge(args[1:])
+
     parser = get_args_parser()
     args = parser.parse_args(args)
 
@@ -87,36 +318,75 @@ def main(args=None):
     if not os.path.isfile(config['template']):
         parser.error('Invalid template file')
 
+    try:
+        jobs = int(config.get('jobs', 1))
+    except ValueError:
+        parser.error('Invalid `jobs` parameter.')
+    if jobs < 1:
+        parser.error('Invalid `jobs` parameter.')
+    try:
+        if int(config.get('parse_jobs', 1)) < 1:
+            parser.error('Invalid `parse_jobs` parameter.')
+    except ValueError:
+        parser.error('Invalid `parse_jobs` parameter.')
+    try:
+        write_queue = int(config.get('write_queue', 16))
+        content_threads = int(config.get('content_threads', 1))
+        render_threads = int(config.get('render_threads', 1))
+        writers = int(config.get('writers', 4))
+    except ValueError:
+        parser.error('Invalid `write_queue` or thread count parameter.')
+    if write_queue < 0 or min(content_threads, render_threads, writers) < 1:
+        parser.error('Invalid `write_queue` or thread count parameter.')
+    if 'only' in config:
+        config['only'] = [name.strip() for name in config['only'].split(',') if name.strip()]
+    if 'shard' in config:
+        try:
+            config['shard'] = parse_shard(config['shard'])
+        except ValueError:
+            parser.error('Invalid `shard` parameter.')
+    if config.get('profile'):
+        # cProfile only profiles the thread it is run on, so the whole build is run on that thread
+        getLogger('addo.script').info('Profiling a serial build, as if run with --jobs 1 --parse-jobs 1 '
+                                      '--write-queue 0 --serial-parse')
+        config.update(jobs=1, parse_jobs=1, write_queue=0, concurrent_parse=False)
+
     try:
         destinations_fp = open(config['destinations'], 'rb')
         taxonomy_fp = open(config['taxonomy'], 'rb')
     except IOError, e:
         parser.error(str(e))
 
-    log = getLogger('addo.script')
     try:
-        destination_parser = LegacyParser(source=destinations_fp,
-                                          taxonomy=taxonomy_fp)
-        if 'temp_dir' in config:
-            renderer = FileRenderer(filename=config['template'], module_directory=config['temp_dir'])
-        else:
-            log.warn('No temporary dir for templating. Performance will be greatly decreased.')
-            renderer = FileRenderer(filename=config['template'])
-
-        rendered = 0
-        for destination in destination_parser.destinations():
-            output_filename = os.path.join(config['output'], '%s.html' % destination.name)
-            with codecs.open(output_filename, 'wb', encoding='UTF-8') as output_handle:
-                log.info('Rendering %s' % destination.name)
-                output_handle.write(renderer.render_unicode(parser=destination_parser,
-                                                            destination=destination))
-            rendered += 1
+        hooks = get_metrics_hooks(config)
+    except ValueError:
+        parser.error('Invalid `statsd` parameter.')
+    stats = BuildStats() if asbool(config.get('stats', False)) else None
+    if stats is not None:
+        hooks.append(stats)
+    try:
+        with metrics.installed(*hooks):
+            if config.get('profile'):
+                profiler = cProfile.Profile()
+                try:
+                    rendered = profiler.runcall(build, config, destinations_fp, taxonomy_fp, stats)
+                finally:
+                    profiler.dump_stats(config['profile'])
+            else:
+                rendered = build(config, destinations_fp, taxonomy_fp, stats)
     except Exception, e:
         # Show the raw exception to the user if debugging
         if args.debug:
             raise
         # Show the exception string otherwise
         parser.exit(4, '%s\n' % e)
+    finally:
+        for hook in hooks:
+            hook.flush()
+            hook.close()
 
     print 'Rendered %d files.' % rendered
+    if stats is not None:
+        print
+        print stats.report()
 
@@ -0,0 +1,142 @@
+"""Parses a large destinations file in parallel, by splitting it into byte ranges.
+
+The destinations export is a flat list of ``<destination>`` elements under a single root. The file is mapped into
+memory and scanned for the start of each element (skipping CDATA sections and comments, which may contain anything),
+and the elements are split into contiguous ranges of about the same number of destinations. Each range is wrapped in
+a root element of its own and parsed by a worker process, which returns the metadata and the (pickled) content of its
+destinations. The results are merged, in source order, into the state of a LegacyParser.
+"""
+
+import re, mmap
+import cPickle as pickle
+from logging import getLogger
+from multiprocessing import Pool
+from lxml import etree
+
+log = getLogger(__name__)
+
+_MARKUP = re.compile(r'<destination[\s/>]|<!\[CDATA\[|<!--')
+_ENCODING = re.compile(r'''^(?:\xef\xbb\xbf)?\s*<\?xml[^>]*encoding\s*=\s*["']([A-Za-z0-9._-]+)["']''')
+_SECTION_ENDS = {'<![CDATA[': ']]>', '<!--': '-->'}
+
+
+def declared_encoding(data):
+    """The encoding declared by the XML declaration of ``data``, or UTF-8. Files in wide encodings (which start with
+    a byte order mark or have zero bytes in their declaration) are reported as UTF-16."""
+    if data[:2] in ('\xff\xfe', '\xfe\xff') or '\x00' in data[:4]:
+        return 'UTF-16'
+    match = _ENCODING.match(data[:200])
+    return match.group(1) if match else 'UTF-8'
+
+
+def destination_offsets(data):
+    """The offset in ``data`` (a string or mmap) of the start of each ``<destination>`` element"""
+    offsets = []
+    position = 0
+    search = _MARKUP.search
+    while True:
+        match = search(data, position)
+        if match is None:
+            return offsets
+        markup = match.group()
+        if markup in _SECTION_ENDS:
+            end = data.find(_SECTION_ENDS[markup], match.end())
+            if end == -1:
+                return offsets
+            position = end + len(_SECTION_ENDS[markup])
+        else:
+            offsets.append(match.start())
+            position = match.end()
+
+
+def shard_ranges(data, shards):
+    """Splits the destinations in ``data`` into at most ``shards`` (start, end) byte ranges, each of whole elements"""
+    offsets = destination_offsets(data)
+    if not offsets:
+        return []
+    end = data.rfind('</destinations')
+    if end < offsets[-1]:
+        end = len(data)
+    shards = max(1, min(shards, len(offsets)))
+    starts = [offsets[len(offsets) * shard // shards] for shard in range(shards)]
+    return zip(starts, starts[1:] + [end])
+
+
+def _parse_shard(job):
+    """Parses the destinations in one byte range of a file, in a worker process. Returns a list of (name, metadata,
+    atlas_id, pickled content) records in source order. Errors are raised as a WorkerError naming the byte range, as
+    the errors of lxml cannot be sent back to the parent process."""
+    from .legacy_parser import WorkerError
+    filename, start, end, encoding = job
+    try:
+        return _parse_range(filename, start, end, encoding)
+    except Exception, e:
+        raise WorkerError('Could not parse bytes %d to %d of %s: %s' % (start, end, filename, e))
+
+
+def _parse_range(filename, start, end, encoding):
+    from .legacy_parser import LegacyParser
+    with open(filename, 'rb') as fh:
+        data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            fragment = data[start:end]
+        finally:
+            data.close()
+    parser = etree.XMLParser(encoding=encoding, huge_tree=True)
+    root = etree.fromstring('<destinations>%s</destinations>' % fragment, parser)
+    converter = LegacyParser.__new__(LegacyParser)
+    records = []
+    for destination_xml in root.iterchildren('destination'):
+        name = LegacyParser._destination_name(destination_xml)
+        if name is None:
+            continue
+        content = converter._element_content(destination_xml)
+        records.append((name, LegacyParser._element_metadata(name, destination_xml),
+                        LegacyParser._element_atlas_id(destination_xml),
+                        pickle.dumps(content, pickle.HIGHEST_PROTOCOL)))
+    return records
+
+
+def parse_sharded(filename, processes, pool=None):
+    """
+    Parses the destinations file ``filename`` with ``processes`` worker processes. Returns the metadata and index
+    of the destinations, in the form of ``LegacyParser.snapshot``, or None if the file cannot be split (it is not in
+    an ASCII compatible encoding).
+
+    The workers are those of ``pool`` if given one (which should have been started before any other threads, as a
+    process forked while another thread is inside libxml2 may deadlock), or else of a new Pool. Either way the pool
+    is closed once the file is parsed.
+    """
+    if pool is None:
+        pool = Pool(processes)
+    metadata = {}
+    index = []
+    positions = {}
+    try:
+        with open(filename, 'rb') as fh:
+            data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                encoding = declared_encoding(data)
+                if encoding.upper().replace('_', '-').startswith(('UTF-16', 'UTF-32', 'UCS')):
+                    pool.close()
+                    return None
+                ranges = shard_ranges(data, processes * 4)  # More shards than processes, to even out their sizes
+            finally:
+                data.close()
+
+        jobs = [(filename, start, end, encoding) for start, end in ranges]
+        for records in pool.imap(_parse_shard, jobs):
+            for name, destination_metadata, atlas_id, pickled_content in records:
+                if name in positions:
+                    log.warn('Destination %s is duplicated in the source, the last one is used' % name)
+                    index[positions[name]] = None
+                positions[name] = len(index)
+                index.append((name, atlas_id, pickled_content))
+                metadata[name] = destination_metadata
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return {'metadata': metadata, 'index': [entry for entry in index if entry is not None]}
@@ -0,0 +1,61 @@
+"""Provides the Snapshot class, a cache of the parsed destinations and taxonomy.
+
+Parsing the XML and converting the content of each destination dominates the start up time of a run. When the
+inputs have not changed (for example, when only the template has been edited) the parsed state can instead be loaded
+from a pickle in the temporary directory.
+"""
+
+import os, glob, hashlib
+import cPickle as pickle
+from logging import getLogger
+from . import __version__
+from .legacy_parser import LegacyParser
+from .manifest import file_digest
+
+log = getLogger(__name__)
+
+
+class Snapshot(object):
+    """
+    A snapshot of a LegacyParser's state, stored in ``temp_dir``. It is keyed by the hashes of the ``inputs`` files
+    and the version of addo, so a snapshot of other inputs (or written by another version) is never loaded.
+    """
+    PREFIX = 'addo-snapshot-'
+    FORMAT = 2  # Part of the key, and increased whenever the layout of the parser state changes
+
+    def __init__(self, temp_dir, *inputs):
+        self.temp_dir = temp_dir
+        key = hashlib.sha1('%s:%d' % (__version__, self.FORMAT))
+        for filename in inputs:
+            key.update(file_digest(filename))
+        self.key = key.hexdigest()
+        self.path = os.path.join(temp_dir, '%s%s.pickle' % (self.PREFIX, self.key))
+
+    def load(self):
+        """Returns a parser created from the snapshot, or None if there is no usable snapshot"""
+        if not os.path.isfile(self.path):
+            return None
+        try:
+            with open(self.path, 'rb') as fh:
+                key, state = pickle.load(fh)
+        except Exception, e:
+            log.warn('Ignoring unreadable snapshot %s: %s' % (self.path, e))
+            return None
+        if key != self.key:
+            log.warn('Ignoring stale snapshot %s' % self.path)
+            return None
+        log.debug('Loaded snapshot %s' % self.path)
+        return LegacyParser.from_snapshot(state)
+
+    def save(self, parser):
+        """Saves the state of ``parser``, replacing any other snapshot in the directory. Returns a parser created from
+        the saved state, so the content of each destination is not converted twice.
+        """
+        state = parser.snapshot()
+        with open(self.path + '.tmp', 'wb') as fh:
+            pickle.dump((self.key, state), fh, pickle.HIGHEST_PROTOCOL)
+        for stale in glob.glob(os.path.join(self.temp_dir, '%s*.pickle' % self.PREFIX)):
+            log.debug('Removing stale snapshot %s' % stale)
+            os.remove(stale)
+        os.rename(self.path + '.tmp', self.path)
+        return LegacyParser.from_snapshot(state)
@@ -0,0 +1,139 @@
+"""Provides the BuildStats class, which collects the timings of a build for the report printed with ``--stats``.
+It is installed as metrics hooks (see addo.metrics) for the build, to be told of each page rendered.
+
+Phases are timed in wall clock and CPU time. CPU time is only measured for the whole process (along with any worker
+processes which have finished), so phases which run alongside others, such as the taxonomy parse or the threads of a
+pipeline stage, only have their wall (or busy) time recorded.
+"""
+
+import os, sys, time, heapq, bisect
+from contextlib import contextmanager
+from collections import OrderedDict
+from .metrics import Hooks
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def cpu_time():
+    """The user and system CPU seconds of this process, and of its child processes which have been waited for"""
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3]
+
+
+def peak_memory_kb():
+    """The peak resident set size of this process, or of its largest child process, in KB. None where unknown."""
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak // 1024 if sys.platform == 'darwin' else peak  # Bytes on Mac OS X, KB elsewhere
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return '%d %s' % (size, unit) if unit == 'B' else '%.1f %s' % (size, unit)
+        size /= 1024.0
+    return '%.1f GB' % size
+
+
+class BuildStats(Hooks):
+    """
+    Collects the phases of a build, the render time and size of each page, and the number of destinations parsed and
+    warnings logged. Pages may be reported from any thread, as each is simply appended to a list.
+
+    A phase recorded ``within`` another is part of it, and is indented beneath it in the report. Notes on how the
+    phases were timed are printed beneath them.
+    """
+    # The upper bounds, in seconds, of the buckets of the render time histogram
+    BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+    def __init__(self, slowest=10):
+        self.slowest_count = slowest
+        self.phases = OrderedDict()
+        self.notes = []
+        self.pages = []
+        self.destinations = 0
+        self.warnings = 0
+
+    @contextmanager
+    def phase(self, name):
+        """Times the wall and CPU time of the block within it as the phase ``name``"""
+        wall, cpu = time.time(), cpu_time()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.time() - wall, cpu_time() - cpu)
+
+    def add_phase(self, name, wall, cpu=None, within=None):
+        self.phases[name] = (wall, cpu, within)
+
+    def note(self, text):
+        self.notes.append(text)
+
+    def destination_parsed(self, name):
+        self.destinations += 1
+
+    def page_rendered(self, name, seconds, size):
+        """Records that the page for destination ``name`` took ``seconds`` to render, into ``size`` bytes"""
+        self.pages.append((seconds, name, size))
+
+    def warning(self, logger, message):
+        self.warnings += 1
+
+    @property
+    def bytes_written(self):
+        return sum(size for _, _, size in self.pages)
+
+    def histogram(self):
+        """The number of pages rendered within each bucket, as a list of (upper bound, count). The last bucket,
+        with an upper bound of None, holds those slower than all of the BUCKETS."""
+        counts = [0] * (len(self.BUCKETS) + 1)
+        for seconds, _, _ in self.pages:
+            counts[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        return zip(self.BUCKETS + (None,), counts)
+
+    def slowest(self, count=None):
+        """The (name, seconds) of the ``count`` slowest pages to render, slowest first"""
+        if count is None:
+            count = self.slowest_count
+        return [(name, seconds) for seconds, name, _ in heapq.nlargest(count, self.pages)]
+
+    def report(self):
+        """The stats as text, for printing at the end of a build"""
+        lines = ['%-28s %10s %10s' % ('Phase', 'Wall', 'CPU')]
+        for name, (wall, cpu, within) in self.phases.items():
+            label = '  %s' % name if within is not None else name
+            lines.append('%-28s %9.3fs %10s' % (label, wall, '-' if cpu is None else '%.3fs' % cpu))
+        for text in self.notes:
+            lines.append('Note: %s' % text)
+
+        if self.pages:
+            lines.append('')
+            lines.append('Render time per page:')
+            histogram = self.histogram()
+            widest = max(count for _, count in histogram)
+            previous = 0.0
+            for bound, count in histogram:
+                if bound is None:
+                    label = '> %gms' % (previous * 1000)
+                else:
+                    label = '<= %gms' % (bound * 1000)
+                    previous = bound
+                if count:
+                    lines.append('  %-10s %7d %s' % (label, count, '#' * max(1, count * 40 // widest)))
+            lines.append('')
+            lines.append('Slowest pages:')
+            for name, seconds in self.slowest():
+                lines.append('  %9.3fs %s' % (seconds, name))
+
+        lines.append('')
+        lines.append('Destinations parsed: %d, warnings: %d' % (self.destinations, self.warnings))
+        lines.append('Pages: %d, bytes written: %s' % (len(self.pages), format_size(self.bytes_written)))
+        peak = peak_memory_kb()
+        if peak is not None:
+            lines.append('Peak memory: %s' % format_size(peak * 1024))
+        return '\n'.join(lines)
@@ -0,0 +1,8 @@
+"""Benchmarks for Addo. These are not part of the installed package, run them from the root of the repository, as in:
+
+    $ python -m benchmarks.suite
+
+- ``benchmarks.generate`` writes synthetic destinations and taxonomy XML of any size and shape.
+- ``benchmarks.suite`` times each phase of a build on generated data, and compares the results against a baseline.
+- ``benchmarks.content`` compares the implementations of the conversion of destination content.
+"""
@@ -0,0 +1,67 @@
+"""Micro-benchmark of the conversion of destination content into python data.
+
+The destinations of ``example/destinations.xml`` are repeated ``--scale`` times, and converted with the original
+recursive implementation (kept here for comparison) and with ``addo.content.build_content``.
+"""
+
+import os, argparse, timeit
+import cPickle as pickle
+from lxml import etree
+from addo.content import build_content
+
+EXAMPLE = os.path.join(os.path.dirname(__file__), os.pardir, 'example', 'destinations.xml')
+
+
+def legacy_recursive_dict(element):
+    """The conversion as it was before addo.content"""
+    child_data = map(legacy_recursive_dict, element)
+    if len(child_data) == 0:
+        if element.text is None:
+            return element.tag, {}
+        else:
+            return element.tag, unicode(element.text.strip())
+
+    lists = {}
+    data = {}
+    for tag_name, tag_data in child_data:
+        if tag_name in data:
+            if tag_name in lists:
+                lists[tag_name].append(tag_data)
+            else:
+                lists[tag_name] = [data[tag_name], tag_data]
+        else:
+            data[tag_name] = tag_data
+    data.update(lists)
+    return element.tag, data
+
+
+def scaled_destinations(source, scale):
+    """The destination elements of ``source``, repeated ``scale`` times"""
+    destinations = etree.parse(source).findall('destination')
+    return destinations * scale
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--scale', type=int, default=20, help='How many times to repeat the example destinations')
+    parser.add_argument('--repeat', type=int, default=3, help='Take the best of this many runs')
+    parser.add_argument('source', nargs='?', default=EXAMPLE, help='The destinations XML to convert')
+    args = parser.parse_args(args)
+
+    destinations = scaled_destinations(args.source, args.scale)
+    implementations = [
+        ('legacy', lambda element: legacy_recursive_dict(element)[1]),
+        ('dict', build_content),
+    ]
+    print 'Converting %d destinations' % len(destinations)
+    baseline = None
+    for name, convert in implementations:
+        best = min(timeit.repeat(lambda: [convert(element) for element in destinations],
+                                 repeat=args.repeat, number=1))
+        pickled = len(pickle.dumps([convert(element) for element in destinations[:100]], pickle.HIGHEST_PROTOCOL))
+        baseline = baseline or best
+        print '%-8s %8.3fs  %5.2fx  %8d bytes pickled per 100' % (name, best, baseline / best, pickled)
+
+
+if __name__ == '__main__':
+    main()
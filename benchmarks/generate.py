@@ -0,0 +1,130 @@
+"""Generates synthetic destinations and taxonomy XML, shaped like the files in ``example/``.
+
+The taxonomy is a tree in which every node has ``fanout`` children, breadth first, until there are ``destinations``
+nodes. When ``depth`` is given the first branch is instead a chain that many nodes deep, to exercise very deep
+taxonomies. Every node has a destination, whose content has the sections of the example export with CDATA text of
+about ``cdata_size`` bytes in each.
+
+    $ python -m benchmarks.generate data_dir --destinations 100000 --fanout 20 --cdata-size 4000
+"""
+
+import os, argparse, random
+from xml.sax.saxutils import quoteattr
+
+WORDS = ('the city is a the river old market along coast with temple and national park its walls mountain '
+         'station beaches colonial quarter ferry desert island capital north south wine museum bus road').split()
+
+# The sections of a destination, as (path of tags, number of paragraphs). Repeated sections become lists.
+SECTIONS = [
+    (('history', 'history', 'history'), 6),
+    (('history', 'history', 'history'), 3),
+    (('introductory', 'introduction', 'overview'), 4),
+    (('practical_information', 'health_and_safety', 'dangers_and_annoyances', 'dangers_and_annoyances'), 2),
+    (('practical_information', 'money_and_costs', 'money', 'money'), 2),
+    (('practical_information', 'visas', 'overview'), 1),
+    (('transport', 'getting_around', 'bus_and_tram', 'overview'), 2),
+    (('transport', 'getting_there_and_away', 'air', 'overview'), 2),
+    (('weather', 'when_to_go', 'climate'), 1),
+]
+
+
+def paragraphs(rng, size, count):
+    """About ``size`` bytes of text in ``count`` paragraphs, each after a short heading"""
+    target = max(size // max(count, 1), 1)
+    text = []
+    for number in range(count):
+        words = []
+        length = 0
+        while length < target:
+            word = rng.choice(WORDS)
+            words.append(word)
+            length += len(word) + 1
+        text.append('Heading %d\n\n%s.' % (number, ' '.join(words).capitalize()))
+    return '\n\n'.join(text)
+
+
+def taxonomy_tree(destinations, fanout, depth=None):
+    """The parent (or None) of each of ``destinations`` nodes, numbered in document (pre-) order"""
+    parents = [None]
+    if depth:
+        parents.extend(range(min(depth, destinations) - 1))
+    queue = range(len(parents))
+    head = 0
+    while len(parents) < destinations:
+        parent = queue[head] if head < len(queue) else None
+        head += 1
+        for _ in range(fanout):
+            if len(parents) >= destinations:
+                break
+            parents.append(parent)
+            queue.append(len(parents) - 1)
+    return parents
+
+
+def write_taxonomy(fh, parents):
+    """Writes a taxonomy of nodes with the given ``parents``. Children are written inside their parent, so nodes are
+    renumbered into document order by a depth first walk."""
+    children = [[] for _ in parents]
+    roots = []
+    for node, parent in enumerate(parents):
+        (roots if parent is None else children[parent]).append(node)
+    fh.write('<?xml version="1.0" encoding="utf-8"?>\n<taxonomies>\n<taxonomy>\n<taxonomy_name>World</taxonomy_name>\n')
+    stack = [(node, False) for node in reversed(roots)]
+    while stack:  # Iterative, as the taxonomy may be far deeper than the recursion limit
+        node, closing = stack.pop()
+        if closing:
+            fh.write('</node>\n')
+            continue
+        fh.write('<node atlas_node_id = "%d" ethyl_content_object_id="%d" geo_id = "%d">\n'
+                 '<node_name>Destination %d</node_name>\n' % (node + 1, node, node + 1, node))
+        stack.append((node, True))
+        stack.extend((child, False) for child in reversed(children[node]))
+    fh.write('</taxonomy>\n</taxonomies>\n')
+
+
+def write_destination(fh, rng, node, cdata_size):
+    title = 'Destination %d' % node
+    fh.write('<destination atlas_id=%s asset_id=%s title=%s title-ascii=%s>\n' % (
+        quoteattr(str(node + 1)), quoteattr('%d-1' % node), quoteattr(title), quoteattr(title)))
+    for tags, count in SECTIONS:
+        fh.write(''.join('<%s>\n' % tag for tag in tags[:-1]))
+        fh.write('<%s>\n<![CDATA[%s]]>\n</%s>\n' % (tags[-1], paragraphs(rng, cdata_size, count), tags[-1]))
+        fh.write(''.join('</%s>\n' % tag for tag in reversed(tags[:-1])))
+    fh.write('</destination>\n')
+
+
+def generate(directory, destinations=1000, fanout=10, depth=None, cdata_size=2000, seed=0):
+    """Writes ``destinations.xml`` and ``taxonomy.xml`` into ``directory``, returning their paths"""
+    rng = random.Random(seed)
+    taxonomy = os.path.join(directory, 'taxonomy.xml')
+    with open(taxonomy, 'wb') as fh:
+        write_taxonomy(fh, taxonomy_tree(destinations, fanout, depth))
+    destinations_xml = os.path.join(directory, 'destinations.xml')
+    with open(destinations_xml, 'wb') as fh:
+        fh.write('<?xml version="1.0" encoding="utf-8"?>\n<destinations>\n')
+        for node in range(destinations):
+            write_destination(fh, rng, node, cdata_size)
+        fh.write('</destinations>\n')
+    return destinations_xml, taxonomy
+
+
+def add_arguments(parser):
+    parser.add_argument('--destinations', type=int, default=1000, help='The number of destinations (default 1000)')
+    parser.add_argument('--fanout', type=int, default=10, help='The children of each taxonomy node (default 10)')
+    parser.add_argument('--depth', type=int, help='The depth of the first, deepest, branch of the taxonomy')
+    parser.add_argument('--cdata-size', type=int, default=2000,
+                        help='The size of the text of each content section, in bytes (default 2000)')
+    parser.add_argument('--seed', type=int, default=0, help='The seed of the generated text')
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('directory', help='The directory to write destinations.xml and taxonomy.xml into')
+    add_arguments(parser)
+    args = parser.parse_args(args)
+    for filename in generate(args.directory, args.destinations, args.fanout, args.depth, args.cdata_size, args.seed):
+        print '%s: %d bytes' % (filename, os.path.getsize(filename))
+
+
+if __name__ == '__main__':
+    main()
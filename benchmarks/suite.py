@@ -0,0 +1,143 @@
+"""Times each phase of a build on generated data, and compares the results against a baseline.
+
+The phases are timed separately: parsing the taxonomy (``LegacyTaxonomies.parse_xml``), parsing and indexing the
+destinations (``LegacyParser.__init__``), building every destination and its content (``destinations()``), rendering
+the pages (``FileRenderer.render_unicode``) and writing them out. The peak RSS of the process is recorded after each
+phase. Each phase is timed ``--repeat`` times and the best time kept.
+
+    $ python -m benchmarks.suite --destinations 20000 --json results.json
+    $ python -m benchmarks.suite --destinations 20000 --baseline results.json
+
+With ``--baseline`` every phase which is slower than the baseline by more than ``--tolerance`` is reported as a
+regression, and the exit status is 1.
+"""
+
+import os, sys, json, time, shutil, argparse, platform, resource, tempfile
+from addo.legacy_parser import LegacyParser, LegacyTaxonomies
+from addo.output import write_page
+from addo.render import FileRenderer
+from . import generate
+
+TEMPLATE = os.path.join(os.path.dirname(__file__), os.pardir, 'addo', 'template.html')
+PHASES = ['taxonomy_parse', 'parser_init', 'destinations', 'render', 'write']
+
+
+def peak_rss_kb():
+    """The peak resident set size of this process, in KB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak  # Bytes on Mac OS X, KB elsewhere
+
+
+def best_time(function, repeat):
+    """Calls ``function`` ``repeat`` times, returning the shortest time taken and the last result"""
+    best = None
+    for _ in range(repeat):
+        started = time.time()
+        result = function()
+        taken = time.time() - started
+        best = taken if best is None else min(best, taken)
+    return best, result
+
+
+def run(destinations_xml, taxonomy_xml, output, repeat=1):
+    """Times each phase on the given files, writing pages into ``output``. Returns a dict of the results of each
+    phase."""
+    results = {}
+
+    def phase(name, function):
+        seconds, result = best_time(function, repeat)
+        results[name] = {'seconds': round(seconds, 4), 'peak_rss_kb': peak_rss_kb()}
+        return result
+
+    def parse_taxonomy():
+        taxonomy = LegacyTaxonomies()
+        taxonomy.parse_xml(taxonomy_xml)
+        return taxonomy
+
+    def load_destinations():
+        destinations = list(parser.destinations())
+        for destination in destinations:
+            destination.content
+        return destinations
+
+    renderer = FileRenderer(filename=TEMPLATE, template_cache='memory')
+    phase('taxonomy_parse', parse_taxonomy)
+    parser = phase('parser_init', lambda: LegacyParser(destinations_xml, taxonomy_xml, concurrent=False))
+    destinations = phase('destinations', load_destinations)
+    pages = phase('render', lambda: [renderer.render_unicode(parser=parser, destination=destination)
+                                     for destination in destinations])
+    pages = [(destination.name, os.path.join(output, '%s.html' % destination.name), [page.encode('UTF-8')])
+             for destination, page in zip(destinations, pages)]
+    phase('write', lambda: [write_page(*page) for page in pages])
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Returns a (phase, baseline seconds, seconds, ratio, regressed) row for each phase in both results"""
+    rows = []
+    for name in PHASES:
+        if name not in results['phases'] or name not in baseline['phases']:
+            continue
+        before = baseline['phases'][name]['seconds']
+        after = results['phases'][name]['seconds']
+        ratio = after / before if before else 1.0
+        rows.append((name, before, after, ratio, ratio > 1 + tolerance))
+    return rows
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    generate.add_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=1, help='Keep the best time of this many runs of each phase')
+    parser.add_argument('--data', help='A directory to generate the data into, and keep it (or reuse it, if it is '
+                                       'already there). By default it is generated into a temporary directory')
+    parser.add_argument('--json', dest='json_filename', help='Write the results to this file as JSON')
+    parser.add_argument('--baseline', help='Compare the results against those in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='How much slower than the baseline a phase may be, as a fraction (default 0.2)')
+    args = parser.parse_args(args)
+
+    work_dir = tempfile.mkdtemp(prefix='addo-benchmark-')
+    try:
+        data_dir = args.data or work_dir
+        destinations_xml = os.path.join(data_dir, 'destinations.xml')
+        taxonomy_xml = os.path.join(data_dir, 'taxonomy.xml')
+        if not (os.path.isfile(destinations_xml) and os.path.isfile(taxonomy_xml)):
+            if not os.path.isdir(data_dir):
+                os.makedirs(data_dir)
+            generate.generate(data_dir, args.destinations, args.fanout, args.depth, args.cdata_size, args.seed)
+        output = os.path.join(work_dir, 'output')
+        os.mkdir(output)
+        phases = run(destinations_xml, taxonomy_xml, output, args.repeat)
+    finally:
+        shutil.rmtree(work_dir)
+
+    results = {
+        'config': {'destinations': args.destinations, 'fanout': args.fanout, 'depth': args.depth,
+                   'cdata_size': args.cdata_size, 'seed': args.seed, 'repeat': args.repeat},
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'phases': phases,
+    }
+    for name in PHASES:
+        print '%-16s %9.3fs  %9d KB peak RSS' % (name, phases[name]['seconds'], phases[name]['peak_rss_kb'])
+    if args.json_filename:
+        with open(args.json_filename, 'wb') as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline, 'rb') as fh:
+            baseline = json.load(fh)
+        if baseline.get('config') != results['config']:
+            print 'Warning: the baseline was run with a different configuration: %s' % baseline.get('config')
+        regressed = False
+        print
+        for name, before, after, ratio, regression in compare(results, baseline, args.tolerance):
+            print '%-16s %9.3fs -> %9.3fs  %5.2fx%s' % (name, before, after, ratio, '  REGRESSION' if regression else '')
+            regressed = regressed or regression
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
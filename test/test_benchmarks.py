@@ -0,0 +1,39 @@
+import shutil, tempfile
+from unittest import TestCase
+from addo.legacy_parser import LegacyParser
+from benchmarks.generate import generate, taxonomy_tree
+from benchmarks.suite import compare
+
+
+class TestGenerate(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_tree(self):
+        parents = taxonomy_tree(10, fanout=3)
+        self.assertEqual(parents, [None, 0, 0, 0, 1, 1, 1, 2, 2, 2])
+
+    def test_deep_tree(self):
+        parents = taxonomy_tree(8, fanout=2, depth=5)
+        self.assertEqual(parents[:5], [None, 0, 1, 2, 3])
+        self.assertEqual(len(parents), 8)
+
+    def test_generated_files_parse(self):
+        destinations_xml, taxonomy_xml = generate(self.path, destinations=20, fanout=3, depth=8, cdata_size=200)
+        parser = LegacyParser(destinations_xml, taxonomy_xml)
+        self.assertEqual(len(parser.metadata), 20)
+        self.assertEqual(parser.taxonomy.depth('destination_7'), 7)
+        destination = next(parser.destinations())
+        self.assertIn('Heading 0', destination.content['introduction'])
+        self.assertEqual(len(destination.content['history']), 2)
+
+
+class TestCompare(TestCase):
+    def test_regression(self):
+        baseline = {'phases': {'render': {'seconds': 1.0}, 'write': {'seconds': 1.0}}}
+        results = {'phases': {'render': {'seconds': 1.1}, 'write': {'seconds': 1.5}, 'parser_init': {'seconds': 1}}}
+        self.assertEqual(compare(results, baseline, 0.2),
+                         [('render', 1.0, 1.1, 1.1, False), ('write', 1.0, 1.5, 1.5, True)])
@@ -0,0 +1,45 @@
+from unittest import TestCase
+from lxml import etree
+from addo.content import build_content
+
+CONTENT = """<destination title="Africa">
+ <section>
+  <subsection_one><![CDATA[ SS 1 ]]></subsection_one>
+  <subsection_two>
+    <has_a_list><![CDATA[SS 2 El 1]]></has_a_list>
+    <has_a_list><![CDATA[SS 2 El 2]]></has_a_list>
+    <!-- A comment is skipped -->
+    <has_a_list><![CDATA[SS 2 El 3]]></has_a_list>
+    <and_something><![CDATA[A Something!]]></and_something>
+  </subsection_two>
+ </section>
+ <empty_section/>
+ <another_section><![CDATA[Another Section]]></another_section>
+</destination>
+"""
+
+EXPECTED = {
+    'section': {
+        'subsection_one': u'SS 1',
+        'subsection_two': {'has_a_list': [u'SS 2 El 1', u'SS 2 El 2', u'SS 2 El 3'],
+                           'and_something': u'A Something!'},
+    },
+    'empty_section': {},
+    'another_section': u'Another Section',
+}
+
+
+class TestBuildContent(TestCase):
+    def test_dict(self):
+        self.assertDictEqual(build_content(etree.fromstring(CONTENT)), EXPECTED)
+
+    def test_unicode(self):
+        content = build_content(etree.fromstring(CONTENT))
+        self.assertIsInstance(content['another_section'], unicode)
+
+    def test_interned_tags(self):
+        first = build_content(etree.fromstring(CONTENT))
+        second = build_content(etree.fromstring(CONTENT))
+        first_key = [key for key in first if key == 'another_section'][0]
+        second_key = [key for key in second if key == 'another_section'][0]
+        self.assertIs(first_key, second_key)
@@ -1,6 +1,9 @@
+import logging
 from logging import basicConfig
 from unittest import TestCase
+from StringIO import StringIO
 from addo.destination import Destination
+from addo.legacy_parser import LegacyParser
 
 
 class MockSource(object):
@@ -98,6 +101,22 @@ class TestDestinationModel(TestCase):
             self.assertEqual(child['name'], 'Child Destination')
         self.assertEqual(count, 1)
 
+    def test_number_unresolved(self):
+        """Only children and parents that can be resolved are counted"""
+        destination = self.make_destination()
+        destination._children_list.append('invalid_child')
+        destination._parent_list.append('invalid_parent')
+        self.assertEqual(destination.number_children(), 1)
+        self.assertEqual(destination.number_parents(), 1)
+
+    def test_resolved_links(self):
+        """Links may be given as metadata, already resolved"""
+        child = {'name': 'resolved_child', 'title': 'Resolved Child'}
+        destination = Destination(source=MockSource(), asset_id='1', name='destination', title='Destination',
+                                  content={}, children=[child, 'child_destination'], parents=[])
+        self.assertEqual(list(destination.children()), [child, {'name': 'Child Destination'}])
+        self.assertEqual(destination.number_children(), 2)
+
     def test_invalid_parent(self):
         destination = self.make_destination()
         destination._parent_list.append('invalid_parent')
@@ -106,3 +125,130 @@ class TestDestinationModel(TestCase):
             count += 1
             self.assertEqual(parent['name'], 'Parent Destination')
         self.assertEqual(count, 1)
+
+    def test_slots(self):
+        destination = self.make_destination()
+        self.assertFalse(hasattr(destination, '__dict__'))
+        self.assertFalse(hasattr(destination, 'atlas_id'))
+        destination.atlas_id = 5
+        self.assertEqual(destination.atlas_id, 5)
+
+    def test_no_logger_per_destination(self):
+        loggers = set(logging.Logger.manager.loggerDict)
+        destination = self.make_destination()
+        destination._children_list.append('invalid_child')
+        list(destination.children())
+        self.assertEqual(set(logging.Logger.manager.loggerDict), loggers)
+
+    def test_lazy_content(self):
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return {'introduction': 'Lazy Introduction'}
+        destination = Destination(source=MockSource(), asset_id='1', name='lazy', title='Lazy',
+                                  children=[], parents=[], loader=loader)
+        self.assertEqual(destination.name, 'lazy')
+        self.assertEqual(calls, [])
+        self.assertEqual(destination.get_content('introduction'), 'Lazy Introduction')
+        self.assertEqual(destination.content, {'introduction': 'Lazy Introduction'})
+        self.assertEqual(calls, [1])
+
+    def test_set_content(self):
+        destination = Destination(source=MockSource(), asset_id='1', name='lazy', title='Lazy',
+                                  loader=lambda: {'introduction': 'Lazy Introduction'})
+        destination.content = {'introduction': 'Set Introduction'}
+        self.assertEqual(destination.get_content('introduction'), 'Set Introduction')
+
+    def test_payload(self):
+        destination = self.make_destination()
+        destination.atlas_id = 5
+        destination._children_list.append('invalid_child')
+        payload = destination.payload()
+        self.assertEqual(payload['children'], [{'name': 'Child Destination'}])
+        self.assertEqual(payload['parents'], [{'name': 'Parent Destination'}])
+        self.assertEqual(payload['atlas_id'], 5)
+
+    def test_from_payload(self):
+        payload = {
+            'asset_id': '1',
+            'name': 'super_destination',
+            'title': 'Super Destination',
+            'content': {'introduction': 'An Introduction'},
+            'children': [{'name': 'child_destination', 'title': 'Child Destination', 'asset_id': '2'}],
+            'parents': [],
+        }
+        destination = Destination.from_payload(payload)
+        self.assertEqual(destination.name, 'super_destination')
+        self.assertEqual(destination.get_content('introduction'), 'An Introduction')
+        self.assertEqual([child['title'] for child in destination.children()], ['Child Destination'])
+        self.assertEqual(destination.number_parents(), 0)
+        self.assertFalse(hasattr(destination, 'atlas_id'))
+
+
+TAXONOMY = """<?xml version="1.0" encoding="utf-8"?>
+<taxonomies>
+ <taxonomy>
+  <taxonomy_name>World</taxonomy_name>
+  <node><node_name>Africa</node_name>
+   <node><node_name>South Africa</node_name>
+    <node><node_name>Cape Town</node_name></node>
+    <node><node_name>Durban</node_name></node>
+   </node>
+  </node>
+ </taxonomy>
+</taxonomies>
+"""
+
+DESTINATIONS = """<?xml version="1.0" encoding="utf-8"?>
+<destinations>
+ <destination title="Africa"/>
+ <destination title="South Africa"/>
+ <destination title="Cape Town"/>
+ <destination title="Unknown"/>
+</destinations>
+"""
+
+
+class TestDestinationTaxonomy(TestCase):
+    def setUp(self):
+        parser = LegacyParser(StringIO(DESTINATIONS), StringIO(TAXONOMY))
+        self.destinations = {destination.name: destination for destination in parser.destinations()}
+
+    def test_descendants(self):
+        """Durban has no destination, so it is not included"""
+        self.assertEqual([descendant['name'] for descendant in self.destinations['africa'].descendants()],
+                         ['south_africa', 'cape_town'])
+
+    def test_ancestors(self):
+        self.assertEqual([ancestor['name'] for ancestor in self.destinations['cape_town'].ancestors()],
+                         ['africa', 'south_africa'])
+
+    def test_is_ancestor_of(self):
+        africa = self.destinations['africa']
+        cape_town = self.destinations['cape_town']
+        self.assertTrue(africa.is_ancestor_of(cape_town))
+        self.assertTrue(africa.is_ancestor_of('durban'))
+        self.assertTrue(africa.is_ancestor_of({'name': 'south_africa'}))
+        self.assertFalse(cape_town.is_ancestor_of(africa))
+        self.assertFalse(africa.is_ancestor_of('nowhere'))
+        self.assertTrue(cape_town.is_descendant_of(africa))
+        self.assertFalse(africa.is_descendant_of(cape_town))
+
+    def test_subtree_size(self):
+        self.assertEqual(self.destinations['africa'].subtree_size(), 4)
+        self.assertEqual(self.destinations['cape_town'].subtree_size(), 1)
+
+    def test_not_in_taxonomy(self):
+        unknown = self.destinations['unknown']
+        self.assertEqual(unknown.descendants(), [])
+        self.assertEqual(unknown.ancestors(), [])
+        self.assertFalse(unknown.is_ancestor_of('africa'))
+        self.assertFalse(unknown.is_descendant_of('africa'))
+        self.assertEqual(unknown.subtree_size(), 1)
+
+    def test_without_taxonomy(self):
+        destination = Destination.from_payload({'asset_id': None, 'name': 'africa', 'title': 'Africa',
+                                                'content': {}, 'children': [], 'parents': []})
+        self.assertEqual(destination.descendants(), [])
+        self.assertFalse(destination.is_ancestor_of('south_africa'))
@@ -1,4 +1,6 @@
-import os, shutil, tempfile
+import os, sys, json, shutil, pstats, tempfile
+from StringIO import StringIO
+from addo import render
 from addo.script import main
 from unittest import TestCase
 
@@ -38,6 +40,9 @@ class TestIntegrationScript(TestCase):
 
     def setUp(self):
         self.path = tempfile.mkdtemp()
+        self.cache_home = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = self.join('cache')
+        render._compiled.clear()
         os.mkdir(self.join('output'))
         with open(self.join('taxonomy.xml'), 'wb') as fh:
             fh.write(TEST_TAXONOMY)
@@ -45,6 +50,10 @@ class TestIntegrationScript(TestCase):
             fh.write(TEST_DESTINATION)
 
     def tearDown(self):
+        if self.cache_home is None:
+            del os.environ['XDG_CACHE_HOME']
+        else:
+            os.environ['XDG_CACHE_HOME'] = self.cache_home
         shutil.rmtree(self.path)
 
     def test_missing_template_file(self):
@@ -79,6 +88,58 @@ class TestIntegrationScript(TestCase):
                    '--tmp', self.join('tmp'),
                    '-o', self.join('output')])
         self.assertEqual(len(os.listdir(self.join('output'))), 2, msg="Invalid number of generated files")
+        self.assertEqual(len([name for name in os.listdir(self.join('tmp')) if name.endswith('.py')]), 1)
+
+    def test_template_cache_default(self):
+        main(args=['-t', self.join('taxonomy.xml'),
+                   '-d', self.join('destinations.xml'),
+                   '-o', self.join('output')])
+        self.assertEqual(len(os.listdir(self.join('output'))), 2, msg="Invalid number of generated files")
+        self.assertEqual(len([name for name in os.listdir(self.join('cache', 'addo', 'templates'))
+                              if name.endswith('.py')]), 1)
+
+    def test_sharded_parse(self):
+        os.mkdir(self.join('sharded'))
+        main(args=['-t', self.join('taxonomy.xml'),
+                   '-d', self.join('destinations.xml'),
+                   '-o', self.join('output')])
+        main(args=['-t', self.join('taxonomy.xml'),
+                   '-d', self.join('destinations.xml'),
+                   '--parse-jobs', '2',
+                   '-o', self.join('sharded')])
+        for filename in os.listdir(self.join('output')):
+            with open(self.join('output', filename), 'rb') as serial_fh:
+                with open(self.join('sharded', filename), 'rb') as sharded_fh:
+                    self.assertEqual(serial_fh.read(), sharded_fh.read())
+
+    def test_serial_parse(self):
+        main(args=['-t', self.join('taxonomy.xml'),
+                   '-d', self.join('destinations.xml'),
+                   '--serial-parse',
+                   '-o', self.join('output')])
+        self.assertEqual(len(os.listdir(self.join('output'))), 2, msg="Invalid number of generated files")
+
+    def test_streaming(self):
+        main(args=['-t', self.join('taxonomy.xml'),
+                   '-d', self.join('destinations.xml'),
+                   '--stream',
+                   '-o', self.join('output')])
+        self.assertEqual(len(os.listdir(self.join('output'))), 2, msg="Invalid number of generated files")
+
+    def test_snapshot(self):
+        os.mkdir(self.join('tmp'))
+        args = ['-t', self.join('taxonomy.xml'),
+                '-d', self.join('destinations.xml'),
+                '--tmp', self.join('tmp'),
+                '-o', self.join('output')]
+        main(args=args)
+        self.assertEqual(len([name for name in os.listdir(self.join('tmp')) if name.startswith('addo-snapshot-')]), 1)
+        with open(self.join('output', 'africa.html'), 'rb') as fh:
+            expected = fh.read()
+        os.remove(self.join('output', 'africa.html'))
+        main(args=args)
+        with open(self.join('output', 'africa.html'), 'rb') as fh:
+            self.assertEqual(fh.read(), expected)
 
     def test_with_builtin_template(self):
         main(args=['-t', self.join('taxonomy.xml'),
@@ -106,6 +167,165 @@ class TestIntegrationScript(TestCase):
         with open(self.join('output', 'south_africa.html'), 'r') as fh:
             self.assertEqual(fh.read(), 'DESTINATION: South Africa')
 
+    def test_parallel_matches_serial(self):
+        os.mkdir(self.join('parallel'))
+        main(args=['-t', self.join('taxonomy.xml'),
+                   '-d', self.join('destinations.xml'),
+                   '-o', self.join('output')])
+        main(args=['-t', self.join('taxonomy.xml'),
+                   '-d', self.join('destinations.xml'),
+                   '-j', '2',
+                   '-o', self.join('parallel')])
+        self.assertEqual(sorted(os.listdir(self.join('parallel'))), ['africa.html', 'south_africa.html'])
+        for filename in os.listdir(self.join('output')):
+            with open(self.join('output', filename), 'rb') as serial_fh:
+                with open(self.join('parallel', filename), 'rb') as parallel_fh:
+                    self.assertEqual(serial_fh.read(), parallel_fh.read())
+
+    def test_pipeline_matches_direct(self):
+        os.mkdir(self.join('direct'))
+        main(args=['-t', self.join('taxonomy.xml'),
+                   '-d', self.join('destinations.xml'),
+                   '--content-threads', '2',
+                   '--render-threads', '2',
+                   '-o', self.join('output')])
+        main(args=['-t', self.join('taxonomy.xml'),
+                   '-d', self.join('destinations.xml'),
+                   '--write-queue', '0',
+                   '-o', self.join('direct')])
+        self.assertEqual(sorted(os.listdir(self.join('output'))), ['africa.html', 'south_africa.html'])
+        for filename in os.listdir(self.join('output')):
+            with open(self.join('output', filename), 'rb') as pipeline_fh:
+                with open(self.join('direct', filename), 'rb') as direct_fh:
+                    self.assertEqual(pipeline_fh.read(), direct_fh.read())
+
+    def test_parallel_template_error(self):
+        with open(self.join('template.html'), 'wb') as fh:
+            fh.write('${mem')
+        with self.assertRaises(SystemExit):
+            main(args=['-t', self.join('taxonomy.xml'),
+                       '-d', self.join('destinations.xml'),
+                       '-r', self.join('template.html'),
+                       '-j', '2',
+                       '-o', self.join('output')])
+        self.assertEqual(len(os.listdir(self.join('output'))), 0)
+
+    def test_incremental(self):
+        args = ['-t', self.join('taxonomy.xml'),
+                '-d', self.join('destinations.xml'),
+                '--incremental',
+                '-o', self.join('output')]
+        main(args=args)
+        self.assertTrue(os.path.isfile(self.join('output', '.addo-manifest.json')))
+        os.remove(self.join('output', 'africa.html'))
+        os.utime(self.join('output', 'south_africa.html'), (0, 0))
+        main(args=args)
+        self.assertTrue(os.path.isfile(self.join('output', 'africa.html')), msg="Missing page was not rendered")
+        self.assertEqual(os.path.getmtime(self.join('output', 'south_africa.html')), 0,
+                         msg="Unchanged page was rendered")
+
+        # Renaming South Africa changes the navigation of Africa
+        os.utime(self.join('output', 'africa.html'), (0, 0))
+        with open(self.join('destinations.xml'), 'wb') as fh:
+            fh.write(TEST_DESTINATION.replace('title="South Africa"', 'title="Southern Africa"'))
+        main(args=args)
+        self.assertNotEqual(os.path.getmtime(self.join('output', 'africa.html')), 0,
+                            msg="Page with a renamed neighbour was not rendered")
+
+        with open(self.join('destinations.xml'), 'wb') as fh:
+            fh.write(TEST_DESTINATION[:TEST_DESTINATION.index(' <destination atlas_id="111333"')] +
+                     '</destinations>')
+        main(args=args)
+        self.assertFalse(os.path.isfile(self.join('output', 'south_africa.html')), msg="Removed page still exists")
+        self.assertTrue(os.path.isfile(self.join('output', 'africa.html')))
+
+    def test_sharded_matches_full(self):
+        args = ['-t', self.join('taxonomy.xml'), '-d', self.join('destinations.xml')]
+        main(args=args + ['-o', self.join('output')])
+        os.mkdir(self.join('sharded'))
+        for index in (1, 2, 3):
+            main(args=args + ['-o', self.join('sharded'), '--shard', '%d/3' % index])
+        for name in ('africa.html', 'south_africa.html'):
+            with open(self.join('output', name), 'rb') as expected, open(self.join('sharded', name), 'rb') as fh:
+                self.assertEqual(fh.read(), expected.read())
+
+        main(args=['merge', self.join('sharded'), '-o', self.join('output')])
+        with open(self.join('output', '.addo-manifest.json'), 'rb') as fh:
+            self.assertEqual(sorted(json.load(fh)['destinations']), ['africa', 'south_africa'])
+        os.remove(self.join('sharded', '.addo-manifest.shard-2-of-3.json'))
+        with self.assertRaises(SystemExit):
+            main(args=['merge', self.join('sharded')])
+
+    def test_subtree(self):
+        args = ['-t', self.join('taxonomy.xml'), '-d', self.join('destinations.xml')]
+        main(args=args + ['-o', self.join('output')])
+        os.mkdir(self.join('tmp'))
+        for name, options in (('subtree', ['--subtree', 'south_africa']),
+                              ('offsets', ['--subtree', 'south_africa', '--tmp', self.join('tmp')]),
+                              ('only', ['--only', ' south_africa,'])):
+            os.mkdir(self.join(name))
+            main(args=args + ['-o', self.join(name)] + options)
+            self.assertEqual(os.listdir(self.join(name)), ['south_africa.html'])
+            with open(self.join('output', 'south_africa.html'), 'rb') as expected, \
+                    open(self.join(name, 'south_africa.html'), 'rb') as fh:
+                self.assertEqual(fh.read(), expected.read())
+
+    def test_unknown_selection(self):
+        for options in (['--only', 'africa,sudan'], ['--subtree', 'asia']):
+            with self.assertRaises(SystemExit):
+                main(args=['-t', self.join('taxonomy.xml'),
+                           '-d', self.join('destinations.xml'),
+                           '-o', self.join('output')] + options)
+
+    def test_incremental_selection(self):
+        args = ['-t', self.join('taxonomy.xml'),
+                '-d', self.join('destinations.xml'),
+                '--incremental',
+                '-o', self.join('output')]
+        main(args=args)
+        os.remove(self.join('output', 'africa.html'))
+        main(args=args + ['--only', 'south_africa'])
+        self.assertFalse(os.path.isfile(self.join('output', 'africa.html')), msg="Unselected page was rendered")
+        with open(self.join('output', '.addo-manifest.json'), 'rb') as fh:
+            self.assertEqual(sorted(json.load(fh)['destinations']), ['africa', 'south_africa'])
+        main(args=args)
+        self.assertTrue(os.path.isfile(self.join('output', 'africa.html')))
+
+    def test_invalid_shard(self):
+        with self.assertRaises(SystemExit):
+            main(args=['-t', self.join('taxonomy.xml'),
+                       '-d', self.join('destinations.xml'),
+                       '-o', self.join('output'),
+                       '--shard', '0/2'])
+
+    def test_stats(self):
+        output = StringIO()
+        stdout, sys.stdout = sys.stdout, output
+        try:
+            main(args=['-t', self.join('taxonomy.xml'),
+                       '-d', self.join('destinations.xml'),
+                       '-o', self.join('output'),
+                       '--stats'])
+        finally:
+            sys.stdout = stdout
+        report = output.getvalue()
+        for phase in ('template compile', 'taxonomy parse', 'destinations parse', 'render and write'):
+            self.assertIn(phase, report)
+        self.assertIn('Slowest pages:', report)
+        self.assertIn('south_africa', report)
+        self.assertIn('Pages: 2, bytes written:', report)
+
+    def test_profile(self):
+        main(args=['-t', self.join('taxonomy.xml'),
+                   '-d', self.join('destinations.xml'),
+                   '-o', self.join('output'),
+                   '--profile', self.join('build.prof')])
+        self.assertEqual(len(os.listdir(self.join('output'))), 2)
+        profile = pstats.Stats(self.join('build.prof'))
+        functions = set(function[2] for function in profile.stats)
+        self.assertIn('build', functions)
+        self.assertIn('_render_into', functions)  # Rendering is profiled, rather than left to other threads
+
     def test_template_error(self):
         with open(self.join('template.html'), 'wb') as fh:
             fh.write('${mem')
@@ -132,6 +352,7 @@ destinations = %(here)s/destinations.xml
 taxonomy = %(here)s/taxonomy.xml
 output = %(here)s/output
 temp_dir = %(here)s/tmp
+jobs = 2
 """
 
 class TestIntegrationScriptIniFile(TestCase):
@@ -180,4 +401,26 @@ class TestIntegrationScriptIniFile(TestCase):
         with open(self.join('output', 'south_africa.html'), 'r') as fh:
             self.assertEqual(fh.read(), 'DESTINATION: South Africa')
 
+    def test_stats_and_profile(self):
+        with open(self.join('config.ini'), 'ab') as fh:
+            fh.write('stats = true\nprofile = %(here)s/build.prof\n')
+        output = StringIO()
+        stdout, sys.stdout = sys.stdout, output
+        try:
+            main(args=[self.join('config.ini')])
+        finally:
+            sys.stdout = stdout
+        self.assertIn('Slowest pages:', output.getvalue())
+        self.assertIn('render and write are timed together', output.getvalue())  # The profiled build is serial
+        self.assertTrue(os.path.isfile(self.join('build.prof')))
+        profile = pstats.Stats(self.join('build.prof'))
+        self.assertIn('_render_into', set(function[2] for function in profile.stats))
 
+    def test_prometheus_textfile(self):
+        with open(self.join('config.ini'), 'ab') as fh:
+            fh.write('prometheus_textfile = %(here)s/addo.prom\n')
+        main(args=[self.join('config.ini')])
+        with open(self.join('addo.prom'), 'rb') as fh:
+            lines = fh.read().splitlines()
+        self.assertIn('addo_destinations_parsed_total 2', lines)
+        self.assertIn('addo_pages_rendered_total 2', lines)
@@ -0,0 +1,178 @@
+import os, json, shutil, tempfile, hashlib
+from unittest import TestCase
+from addo.destination import Destination
+from addo.manifest import Manifest, MergeError, file_digest, shard_of, parse_shard, find_shard_manifests, \
+    merge_manifests
+
+
+class MockSource(object):
+    def __init__(self, child_title='Child Destination'):
+        self.metadata = {
+            'child_destination': {
+                'name': 'child_destination',
+                'title': child_title,
+            },
+        }
+
+
+class TestManifest(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.template = os.path.join(self.path, 'template.html')
+        with open(self.template, 'wb') as fh:
+            fh.write('${destination.title}')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def make_destination(self, name='destination', content=None, child_title='Child Destination'):
+        return Destination(source=MockSource(child_title),
+                           asset_id='1',
+                           name=name,
+                           title=name.title(),
+                           content=content or {'introduction': 'An Introduction'},
+                           children=['child_destination'],
+                           parents=[])
+
+    def build(self, *destinations):
+        """Run the destinations through a manifest, touching an output file for each one to be rendered"""
+        manifest = Manifest(self.path, self.template)
+        changed = []
+        for destination in manifest.changed(destinations):
+            changed.append(destination.name)
+            open(manifest.output_filename(destination.name), 'wb').close()
+        manifest.remove_stale()
+        manifest.save()
+        return changed
+
+    def test_file_digest(self):
+        self.assertEqual(file_digest(self.template), hashlib.sha1('${destination.title}').hexdigest())
+
+    def test_first_build(self):
+        self.assertEqual(self.build(self.make_destination()), ['destination'])
+        self.assertTrue(os.path.isfile(os.path.join(self.path, Manifest.FILENAME)))
+
+    def test_unchanged(self):
+        self.build(self.make_destination())
+        self.assertEqual(self.build(self.make_destination()), [])
+
+    def test_changed_content(self):
+        self.build(self.make_destination())
+        self.assertEqual(self.build(self.make_destination(content={'introduction': 'Changed'})), ['destination'])
+
+    def test_renamed_neighbour(self):
+        self.build(self.make_destination())
+        self.assertEqual(self.build(self.make_destination(child_title='Renamed Child')), ['destination'])
+
+    def test_changed_template(self):
+        self.build(self.make_destination())
+        with open(self.template, 'wb') as fh:
+            fh.write('${destination.name}')
+        self.assertEqual(self.build(self.make_destination()), ['destination'])
+
+    def test_missing_output(self):
+        self.build(self.make_destination())
+        os.remove(os.path.join(self.path, 'destination.html'))
+        self.assertEqual(self.build(self.make_destination()), ['destination'])
+
+    def test_removed_destination(self):
+        self.build(self.make_destination(), self.make_destination('other'))
+        self.build(self.make_destination())
+        self.assertTrue(os.path.isfile(os.path.join(self.path, 'destination.html')))
+        self.assertFalse(os.path.isfile(os.path.join(self.path, 'other.html')))
+
+    def test_unreadable_manifest(self):
+        with open(os.path.join(self.path, Manifest.FILENAME), 'wb') as fh:
+            fh.write('{error')
+        self.assertEqual(self.build(self.make_destination()), ['destination'])
+
+
+class TestShardedManifest(TestCase):
+    NAMES = ['africa', 'south_africa', 'cape_town', 'sudan', u'caf\xe9']
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.template = os.path.join(self.path, 'template.html')
+        with open(self.template, 'wb') as fh:
+            fh.write('${destination.title}')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def build_shard(self, index, count, names=None):
+        """Record the destinations of a shard in its manifest, as a sharded build would"""
+        names = names or self.NAMES
+        manifest = Manifest(self.path, self.template, shard=(index, count), names=names)
+        destinations = [Destination(source=None, asset_id='1', name=name, title=name, content={}, children=[],
+                                    parents=[])
+                        for name in names if shard_of(name, count) == index - 1]
+        rendered = len(list(manifest.record(destinations)))
+        manifest.save(rendered)
+        return manifest.path()
+
+    def test_shard_of(self):
+        self.assertEqual([shard_of(name, 1) for name in self.NAMES], [0] * len(self.NAMES))
+        shards = [shard_of(name, 3) for name in self.NAMES]
+        self.assertTrue(all(0 <= shard < 3 for shard in shards))
+        self.assertEqual(shards, [shard_of(name, 3) for name in self.NAMES])
+        self.assertEqual(shard_of('africa', 4), shard_of(u'africa', 4))
+
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard('2/4'), (2, 4))
+        for value in ('0/4', '5/4', '4', 'a/b', '1/0'):
+            self.assertRaises(ValueError, parse_shard, value)
+
+    def test_shard_filename(self):
+        self.assertEqual(os.path.basename(self.build_shard(2, 3)), '.addo-manifest.shard-2-of-3.json')
+        self.assertFalse(os.path.exists(os.path.join(self.path, Manifest.FILENAME)))
+
+    def test_merge(self):
+        for index in (1, 2, 3):
+            self.build_shard(index, 3)
+        merged = merge_manifests(find_shard_manifests([self.path]))
+        self.assertEqual(sorted(merged['destinations']), sorted(self.NAMES))
+        self.assertEqual(merged['rendered'], len(self.NAMES))
+
+    def test_merge_missing_shard(self):
+        self.build_shard(1, 3)
+        self.build_shard(3, 3)
+        with self.assertRaises(MergeError):
+            merge_manifests(find_shard_manifests([self.path]))
+
+    def test_merge_different_counts(self):
+        self.build_shard(1, 2)
+        self.build_shard(2, 2)
+        self.build_shard(1, 1)
+        with self.assertRaises(MergeError):
+            merge_manifests(find_shard_manifests([self.path]))
+
+    def test_merge_different_inputs(self):
+        self.build_shard(1, 2)
+        self.build_shard(2, 2, names=self.NAMES[:-1])
+        with self.assertRaises(MergeError):
+            merge_manifests(find_shard_manifests([self.path]))
+
+    def test_merge_produced_twice(self):
+        self.build_shard(1, 2)
+        path = self.build_shard(2, 2)
+        with open(path, 'rb') as fh:
+            data = json.load(fh)
+        data['destinations'].update(dict.fromkeys(self.NAMES, 'digest'))
+        with open(path, 'wb') as fh:
+            json.dump(data, fh)
+        with self.assertRaises(MergeError):
+            merge_manifests(find_shard_manifests([self.path]))
+
+    def test_merge_not_produced(self):
+        self.build_shard(1, 2)
+        path = self.build_shard(2, 2)
+        with open(path, 'rb') as fh:
+            data = json.load(fh)
+        data['destinations'] = {}
+        with open(path, 'wb') as fh:
+            json.dump(data, fh)
+        with self.assertRaises(MergeError):
+            merge_manifests(find_shard_manifests([self.path]))
+
+    def test_merge_nothing(self):
+        self.assertRaises(MergeError, merge_manifests, [])
@@ -0,0 +1,141 @@
+import os, socket, shutil, logging, tempfile
+from unittest import TestCase
+from StringIO import StringIO
+from addo import metrics
+from addo.legacy_parser import LegacyParser
+from addo.render import FileRenderer
+
+DESTINATIONS = """<?xml version="1.0" encoding="utf-8"?>
+<destinations>
+ <destination atlas_id="1" asset_id="1-1" title="Africa" title-ascii="Africa"><a>A</a></destination>
+ <destination atlas_id="2" asset_id="2-1" title="Sudan" title-ascii="Sudan"><a>B</a></destination>
+</destinations>
+"""
+
+
+class RecordingHooks(metrics.Hooks):
+    def __init__(self):
+        self.events = []
+
+    def destination_parsed(self, name):
+        self.events.append(('parsed', name))
+
+    def page_rendered(self, name, seconds, size):
+        self.events.append(('rendered', name, size))
+
+    def warning(self, logger, message):
+        self.events.append(('warning', logger, message))
+
+
+class TestHooks(TestCase):
+    def tearDown(self):
+        metrics.uninstall()
+
+    def test_nothing_installed(self):
+        self.assertIsNone(metrics.active)
+        self.assertIsNone(metrics._handler)
+
+    def test_installed(self):
+        hooks = RecordingHooks()
+        with metrics.installed(hooks):
+            self.assertIs(metrics.active, hooks)
+            logging.getLogger('addo.test').warn('Something odd')
+        logging.getLogger('addo.test').warn('Not reported')
+        self.assertIsNone(metrics.active)
+        self.assertEqual(hooks.events, [('warning', 'addo.test', 'Something odd')])
+
+    def test_installed_alongside(self):
+        first, second = RecordingHooks(), RecordingHooks()
+        metrics.install(first)
+        with metrics.installed(second):
+            metrics.active.destination_parsed('africa')
+        self.assertIs(metrics.active, first)
+        self.assertEqual(first.events, [('parsed', 'africa')])
+        self.assertEqual(second.events, [('parsed', 'africa')])
+
+    def test_parser_and_renderer(self):
+        hooks = RecordingHooks()
+        renderer = FileRenderer(text='${destination.title}')
+        with metrics.installed(hooks):
+            parser = LegacyParser(StringIO(DESTINATIONS))
+            destination = next(parser.destinations())
+            blocks = renderer.render_blocks(parser=parser, destination=destination)
+        self.assertEqual(hooks.events, [('parsed', 'africa'), ('parsed', 'sudan'),
+                                        ('warning', 'addo.legacy_parser',
+                                         'africa in destinations cannot be found in the taxonomy'),
+                                        ('rendered', 'africa', 6)])
+        self.assertEqual(''.join(blocks), 'Africa')
+
+    def test_parse_address(self):
+        self.assertEqual(metrics.parse_address('stats.example.com:9125'), ('stats.example.com', 9125))
+        self.assertEqual(metrics.parse_address('stats.example.com'), ('stats.example.com', 8125))
+        self.assertRaises(ValueError, metrics.parse_address, 'stats.example.com:port')
+
+
+class TestStatsdHooks(TestCase):
+    def setUp(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.settimeout(5)
+        self.hooks = metrics.StatsdHooks('127.0.0.1', self.server.getsockname()[1])
+
+    def tearDown(self):
+        self.hooks.close()
+        self.server.close()
+
+    def test_metrics(self):
+        self.hooks.destination_parsed('africa')
+        self.hooks.page_rendered('africa', 0.25, 2048)
+        self.hooks.warning('addo', 'Something odd')
+        self.hooks.flush()
+        self.assertEqual(self.server.recv(4096).split('\n'), ['addo.destinations.parsed:1|c',
+                                                             'addo.pages.rendered:1|c',
+                                                             'addo.pages.bytes:2048|c',
+                                                             'addo.pages.render_time:250.000|ms',
+                                                             'addo.warnings:1|c'])
+
+    def test_batched_into_packets(self):
+        for _ in range(100):
+            self.hooks.destination_parsed('africa')
+        self.hooks.flush()
+        received = []
+        while len(received) < 100:
+            packet = self.server.recv(4096)
+            self.assertLessEqual(len(packet), self.hooks.packet_size)
+            received.extend(packet.split('\n'))
+        self.assertEqual(set(received), {'addo.destinations.parsed:1|c'})
+
+
+class TestPrometheusTextfileHooks(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.path, 'addo.prom')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_textfile(self):
+        hooks = metrics.PrometheusTextfileHooks(self.filename)
+        hooks.destination_parsed('africa')
+        hooks.page_rendered('africa', 0.003, 100)
+        hooks.page_rendered('sudan', 10.0, 50)
+        self.assertFalse(os.path.exists(self.filename))
+        hooks.flush()
+        with open(self.filename, 'rb') as fh:
+            lines = fh.read().splitlines()
+        self.assertIn('# TYPE addo_pages_rendered_total counter', lines)
+        self.assertIn('addo_destinations_parsed_total 1', lines)
+        self.assertIn('addo_pages_rendered_total 2', lines)
+        self.assertIn('addo_page_bytes_total 150', lines)
+        self.assertIn('addo_warnings_total 0', lines)
+        self.assertIn('addo_page_render_seconds_bucket{le="0.002"} 0', lines)
+        self.assertIn('addo_page_render_seconds_bucket{le="0.005"} 1', lines)
+        self.assertIn('addo_page_render_seconds_bucket{le="5"} 1', lines)
+        self.assertIn('addo_page_render_seconds_bucket{le="+Inf"} 2', lines)
+        self.assertIn('addo_page_render_seconds_count 2', lines)
+        self.assertEqual(os.listdir(self.path), ['addo.prom'])
+
+    def test_written_while_rendering(self):
+        hooks = metrics.PrometheusTextfileHooks(self.filename, interval=0)
+        hooks.page_rendered('africa', 0.003, 100)
+        self.assertTrue(os.path.isfile(self.filename))
@@ -0,0 +1,86 @@
+import os, shutil, tempfile
+from unittest import TestCase
+from StringIO import StringIO
+from mock import patch
+from addo.legacy_parser import LegacyParser
+from addo.offsets import OffsetIndex
+
+TAXONOMY = """<?xml version="1.0" encoding="utf-8"?>
+<taxonomies>
+ <taxonomy>
+  <taxonomy_name>World</taxonomy_name>
+  <node atlas_node_id="1"><node_name>Africa</node_name>
+   <node atlas_node_id="2"><node_name>South Africa</node_name>
+    <node atlas_node_id="3"><node_name>Cape Town</node_name></node>
+   </node>
+  </node>
+ </taxonomy>
+</taxonomies>
+"""
+
+DESTINATIONS = """<?xml version="1.0" encoding="utf-8"?>
+<destinations>
+ <destination atlas_id="1" asset_id="1-1" title="Africa" title-ascii="Africa">
+  <history><history><history><![CDATA[A <destination title="Fake"> in text]]></history></history></history>
+ </destination>
+ <destination atlas_id="2" asset_id="2-1" title="South Africa" title-ascii="South Africa">
+  <overview><![CDATA[Caf\xc3\xa9]]></overview>
+ </destination>
+ <destination atlas_id="3" asset_id="3-1" title="Cape Town" title-ascii="Cape Town" note="a > b"/>
+</destinations>
+"""
+
+
+class TestOffsetIndex(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.path, 'destinations.xml')
+        with open(self.filename, 'wb') as fh:
+            fh.write(DESTINATIONS)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_index(self):
+        with OffsetIndex(self.filename) as index:
+            self.assertEqual(list(index), ['africa', 'south_africa', 'cape_town'])
+            self.assertEqual(dict(index.metadata()), LegacyParser(self.filename).metadata)
+
+    def test_element(self):
+        with OffsetIndex(self.filename) as index:
+            self.assertEqual(index.element('south_africa').get('atlas_id'), '2')
+            self.assertEqual(index.element('south_africa').findtext('overview'), u'Caf\xe9')
+            self.assertEqual(index.element('cape_town').get('note'), 'a > b')
+
+    def test_persisted(self):
+        OffsetIndex(self.filename, self.path).close()
+        self.assertEqual(len([name for name in os.listdir(self.path) if name.startswith(OffsetIndex.PREFIX)]), 1)
+        with patch.object(OffsetIndex, '_scan') as scan:
+            index = OffsetIndex(self.filename, self.path)
+            self.assertFalse(scan.called)
+        self.assertEqual(list(index), ['africa', 'south_africa', 'cape_town'])
+
+    def test_stale(self):
+        OffsetIndex(self.filename, self.path).close()
+        with open(self.filename, 'wb') as fh:
+            fh.write(DESTINATIONS.replace('title="Cape Town" title-ascii="Cape Town"', 'title="Durban"'))
+        with OffsetIndex(self.filename, self.path) as index:
+            self.assertEqual(list(index), ['africa', 'south_africa', 'durban'])
+
+    def test_parser_from_offsets(self):
+        expected = dict((destination.name, destination)
+                        for destination in LegacyParser(self.filename, StringIO(TAXONOMY)).destinations())
+        with OffsetIndex(self.filename) as index:
+            parser = LegacyParser.from_offsets(index, ['south_africa'], StringIO(TAXONOMY))
+            destinations = list(parser.destinations())
+            self.assertEqual([destination.name for destination in destinations], ['south_africa'])
+            destination = destinations[0]
+            self.assertEqual(destination.content, expected['south_africa'].content)
+            self.assertEqual(destination.atlas_id, 2)
+            self.assertEqual(list(destination.children()), list(expected['south_africa'].children()))
+            self.assertEqual(list(destination.parents()), list(expected['south_africa'].parents()))
+
+    def test_parser_unknown_name(self):
+        with OffsetIndex(self.filename) as index:
+            with self.assertRaises(KeyError):
+                LegacyParser.from_offsets(index, ['atlantis'])
@@ -0,0 +1,28 @@
+import os, shutil, tempfile
+from unittest import TestCase
+from addo.output import write_page, sync_directories, WriteError
+
+
+class TestWritePage(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def join(self, *children):
+        return os.path.join(self.path, *children)
+
+    def test_writes_page(self):
+        write_page('page7', self.join('page7.html'), ['Page ', '7'])
+        sync_directories([self.path])
+        self.assertEqual(os.listdir(self.path), ['page7.html'])
+        with open(self.join('page7.html'), 'rb') as fh:
+            self.assertEqual(fh.read(), 'Page 7')
+
+    def test_error_names_destination(self):
+        with self.assertRaises(WriteError) as raised:
+            write_page('africa', self.join('missing', 'africa.html'), ['Africa'])
+        self.assertEqual(raised.exception.name, 'africa')
+        self.assertIn('africa', str(raised.exception))
+        self.assertEqual(os.listdir(self.path), [])
@@ -1,7 +1,11 @@
+import os, shutil, logging, tempfile
+import cPickle as pickle
 from unittest import TestCase
 from StringIO import StringIO
+from lxml import etree
 from lxml.etree import XMLSyntaxError
-from addo.legacy_parser import LegacyParser, LegacyTaxonomies
+from addo import legacy_parser
+from addo.legacy_parser import LegacyParser, LegacyTaxonomies, TaxonomyNode
 from addo.destination import Destination
 
 TAXONOMY_VALID = """<?xml version="1.0" encoding="utf-8"?>
@@ -56,6 +60,60 @@ TAXONOMY_NO_ATTRIBS = """<?xml version="1.0" encoding="utf-8"?>
 </taxonomies>
 """
 
+TAXONOMY_NAME_LAST = """<?xml version="1.0" encoding="utf-8"?>
+<taxonomies>
+ <taxonomy>
+  <node geo_id = "">
+   <node>
+     <node_name>South Africa</node_name>
+   </node>
+   <node_name>Africa</node_name>
+  </node>
+  <taxonomy_name>World</taxonomy_name>
+ </taxonomy>
+</taxonomies>
+"""
+
+TAXONOMY_WIDE = """<?xml version="1.0" encoding="utf-8"?>
+<taxonomies>
+ <taxonomy>
+  <taxonomy_name>World</taxonomy_name>
+  <node><node_name>Root</node_name>
+   <node><node_name>One</node_name></node>
+   <node><node_name>Two</node_name></node>
+  </node>
+ </taxonomy>
+</taxonomies>
+"""
+
+TAXONOMY_TREE = """<?xml version="1.0" encoding="utf-8"?>
+<taxonomies>
+ <taxonomy>
+  <taxonomy_name>World</taxonomy_name>
+  <node><node_name>Africa</node_name>
+   <node><node_name>South Africa</node_name>
+    <node><node_name>Cape Town</node_name></node>
+    <node><node_name>Durban</node_name></node>
+   </node>
+   <node><node_name>Sudan</node_name></node>
+  </node>
+  <node><node_name>Asia</node_name></node>
+ </taxonomy>
+</taxonomies>
+"""
+
+TAXONOMY_MISSING_DESTINATIONS = """<?xml version="1.0" encoding="utf-8"?>
+<taxonomies>
+ <taxonomy>
+  <taxonomy_name>World</taxonomy_name>
+  <node><node_name>Africa</node_name>
+   <node><node_name>South Africa</node_name></node>
+   <node><node_name>Sudan</node_name></node>
+  </node>
+ </taxonomy>
+</taxonomies>
+"""
+
 DESTINATIONS_VALID = """<?xml version="1.0" encoding="utf-8"?>
 <destinations>
  <destination atlas_id="111222" asset_id="1-1" title="Africa" title-ascii="Africa">
@@ -96,6 +154,14 @@ DESTINATIONS_MISSING_ATTRIB = """<?xml version="1.0" encoding="utf-8"?>
 </destinations>
 """
 
+DESTINATIONS_DUPLICATED = """<?xml version="1.0" encoding="utf-8"?>
+<destinations>
+ <destination asset_id="1-1" title="Africa"/>
+ <destination title=""/>
+ <destination asset_id="1-2" title="Africa"/>
+</destinations>
+"""
+
 DESTINATIONS_CLEANUP_HISTORY = """<?xml version="1.0" encoding="utf-8"?>
 <destinations>
  <destination title="Africa">
@@ -201,6 +267,116 @@ class TestLegacyTaxonomies(TestCase):
         self.assertEqual(len(taxonomies._sets), 1)
         self.assertEqual(len(taxonomies), 2)
 
+    def test_parse_name_last(self):
+        taxonomies = LegacyTaxonomies()
+        taxonomies.parse_xml(StringIO(TAXONOMY_NAME_LAST))
+        self.assertEqual(taxonomies._sets.keys(), ['World'])
+        self.assertEqual(taxonomies['africa']['children'], ['south_africa'])
+        self.assertEqual(taxonomies['south_africa']['parents'], ['africa'])
+        self.assertIsNone(taxonomies['africa']['geo_id'])
+
+    def test_parse_deep(self):
+        """Deeper than the recursion limit"""
+        depth = 5000
+        xml = '<taxonomies><taxonomy><taxonomy_name>Deep</taxonomy_name>%s%s</taxonomy></taxonomies>' % (
+            ''.join('<node><node_name>Node %d</node_name>' % level for level in range(depth)),
+            '</node>' * depth)
+        taxonomies = LegacyTaxonomies()
+        taxonomies.parse_xml(StringIO(xml))
+        self.assertEqual(len(taxonomies), depth)
+        self.assertEqual(taxonomies['node_0']['children'], ['node_1'])
+        self.assertEqual(len(taxonomies['node_%d' % (depth - 1)]['parents']), depth - 1)
+        self.assertEqual(taxonomies['node_%d' % (depth - 1)]['parents'][-1], 'node_%d' % (depth - 2))
+
+    def test_node_table(self):
+        """Nodes are stored in arrays, and looked up through a view"""
+        taxonomies = LegacyTaxonomies()
+        taxonomies.parse_xml(StringIO(TAXONOMY_WIDE))
+        self.assertEqual(taxonomies._keys, ['root', 'one', 'two'])
+        self.assertEqual(list(taxonomies._parents), [-1, 0, 0])
+        self.assertEqual(list(taxonomies._child_offsets), [0, 2, 2, 2])
+        self.assertEqual(list(taxonomies._child_ids), [1, 2])
+        self.assertIsInstance(taxonomies['root'], TaxonomyNode)
+        self.assertEqual(taxonomies['root']['children'], ['one', 'two'])
+        self.assertEqual(taxonomies['two']['parents'], ['root'])
+        self.assertNotIn('geo_id', taxonomies['root'])
+        with self.assertRaises(KeyError):
+            taxonomies['root']['geo_id']
+        self.assertIsNone(taxonomies.get('three'))
+        self.assertEqual(sorted(dict(taxonomies['one'])), ['children', 'name', 'parents'])
+
+    def test_multiple_sets(self):
+        taxonomies = LegacyTaxonomies()
+        taxonomies.parse_xml(StringIO(TAXONOMY_WIDE))
+        taxonomies.parse_xml(StringIO(TAXONOMY_VALID))
+        self.assertEqual(len(taxonomies), 5)
+        self.assertEqual(taxonomies['root']['children'], ['one', 'two'])
+        self.assertEqual(taxonomies['africa']['children'], ['south_africa'])
+        self.assertEqual(taxonomies['south_africa']['parents'], ['africa'])
+        self.assertEqual(taxonomies['south_africa']['geo_id'], 4)
+
+    def test_descendants(self):
+        taxonomies = LegacyTaxonomies()
+        taxonomies.parse_xml(StringIO(TAXONOMY_TREE))
+        self.assertEqual(taxonomies.descendants('africa'), ['south_africa', 'cape_town', 'durban', 'sudan'])
+        self.assertEqual(taxonomies.descendants('south_africa'), ['cape_town', 'durban'])
+        self.assertEqual(taxonomies.descendants('asia'), [])
+
+    def test_ancestors(self):
+        taxonomies = LegacyTaxonomies()
+        taxonomies.parse_xml(StringIO(TAXONOMY_TREE))
+        self.assertEqual(taxonomies.ancestors('durban'), ['africa', 'south_africa'])
+        self.assertEqual(taxonomies.ancestors('asia'), [])
+
+    def test_is_ancestor(self):
+        taxonomies = LegacyTaxonomies()
+        taxonomies.parse_xml(StringIO(TAXONOMY_TREE))
+        self.assertTrue(taxonomies.is_ancestor('africa', 'durban'))
+        self.assertTrue(taxonomies.is_ancestor('south_africa', 'cape_town'))
+        self.assertFalse(taxonomies.is_ancestor('south_africa', 'sudan'))
+        self.assertFalse(taxonomies.is_ancestor('durban', 'africa'))
+        self.assertFalse(taxonomies.is_ancestor('africa', 'africa'))
+        self.assertFalse(taxonomies.is_ancestor('africa', 'asia'))
+
+    def test_subtree_size_and_depth(self):
+        taxonomies = LegacyTaxonomies()
+        taxonomies.parse_xml(StringIO(TAXONOMY_TREE))
+        self.assertEqual(taxonomies.subtree_size('africa'), 5)
+        self.assertEqual(taxonomies.subtree_size('durban'), 1)
+        self.assertEqual(taxonomies.depth('africa'), 0)
+        self.assertEqual(taxonomies.depth('cape_town'), 2)
+
+    def test_intervals_multiple_sets(self):
+        taxonomies = LegacyTaxonomies()
+        taxonomies.parse_xml(StringIO(TAXONOMY_WIDE))
+        taxonomies.parse_xml(StringIO(TAXONOMY_TREE))
+        self.assertEqual(taxonomies.descendants('root'), ['one', 'two'])
+        self.assertEqual(taxonomies.descendants('south_africa'), ['cape_town', 'durban'])
+        self.assertFalse(taxonomies.is_ancestor('root', 'africa'))
+
+    def test_intervals_missing_name(self):
+        """A node without a name, and its subtree, are not part of any interval"""
+        taxonomies = LegacyTaxonomies()
+        taxonomies.parse_xml(StringIO(TAXONOMY_NO_NAME))
+        self.assertEqual(taxonomies.descendants('africa'), [])
+        self.assertEqual(taxonomies.subtree_size('africa'), 1)
+
+    def test_pickle(self):
+        taxonomies = LegacyTaxonomies()
+        taxonomies.parse_xml(StringIO(TAXONOMY_VALID))
+        restored = pickle.loads(pickle.dumps(taxonomies, pickle.HIGHEST_PROTOCOL))
+        self.assertDictEqual(restored, taxonomies)
+        self.assertEqual(restored._sets, taxonomies._sets)
+
+    def test_parse_taxonomy_set(self):
+        """Parsing an element does not alter it"""
+        xml = etree.fromstring(TAXONOMY_VALID)
+        taxonomies = LegacyTaxonomies()
+        taxonomies.parse_taxonomy_set(xml.find('taxonomy'))
+        self.assertEqual(len(taxonomies), 2)
+        self.assertEqual(taxonomies['south_africa']['parents'], ['africa'])
+        self.assertEqual(len(xml.findall('.//node')), 2)
+
 
 class TestLegacyParser(TestCase):
     """This doesn't do much more than just check if it parses the correct XML. If we wanted to be picky about
@@ -326,3 +502,296 @@ class TestLegacyParser(TestCase):
                 })
         self.assertEqual(count, 1)
 
+
+    def test_index(self):
+        parser = LegacyParser(StringIO(DESTINATIONS_VALID))
+        self.assertEqual(parser.index.keys(), ['africa', 'south_africa'])
+        self.assertEqual(parser.index['africa'].get('title'), 'Africa')
+
+    def test_duplicated_destination(self):
+        parser = LegacyParser(StringIO(DESTINATIONS_DUPLICATED))
+        destinations = list(parser.destinations())
+        self.assertEqual(len(destinations), 1)
+        self.assertEqual(destinations[0].asset_id, '1-2')
+
+    def test_warnings_once(self):
+        """Each destination is only named once, so a missing title is only warned about once"""
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger('addo.legacy_parser')
+        logger.addHandler(handler)
+        try:
+            parser = LegacyParser(StringIO(DESTINATIONS_DUPLICATED))
+            list(parser.destinations())
+        finally:
+            logger.removeHandler(handler)
+        messages = [record.getMessage() for record in records]
+        self.assertEqual(messages.count('Destination is missing the title attribute, or it is empty.'), 1)
+
+    def test_resolved_links(self):
+        parser = LegacyParser(StringIO(DESTINATIONS_VALID), StringIO(TAXONOMY_VALID))
+        children, parents = parser.links('africa')
+        self.assertIs(children[0], parser.metadata['south_africa'])
+        self.assertEqual(parents, [])
+        self.assertEqual(parser.links('unknown'), ([], []))
+
+    def test_resolved_parents(self):
+        """Parents are listed from the top down, skipping the taxonomy nodes without a destination, whose link is
+        reported once"""
+        taxonomy = ('<?xml version="1.0" encoding="utf-8"?><taxonomies><taxonomy><taxonomy_name>World</taxonomy_name>'
+                    '<node><node_name>Africa</node_name><node><node_name>Earth</node_name>'
+                    '<node><node_name>South Africa</node_name></node></node></node></taxonomy></taxonomies>')
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger('addo.legacy_parser')
+        logger.addHandler(handler)
+        try:
+            parser = LegacyParser(StringIO(DESTINATIONS_VALID), StringIO(taxonomy))
+            children, parents = parser.links('south_africa')
+            parser.links('africa')
+        finally:
+            logger.removeHandler(handler)
+        self.assertEqual(children, [])
+        self.assertEqual(len(parents), 1)
+        self.assertIs(parents[0], parser.metadata['africa'])
+        warnings = [record.getMessage() for record in records if record.levelno == logging.WARNING]
+        self.assertEqual(warnings, ['2 taxonomy links have no destination, such as: '
+                                    'africa children earth, south_africa parents earth'])
+
+    def test_unresolved_links_summary(self):
+        """Sudan has no destination, which is reported once no matter how often it is rendered"""
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger('addo.legacy_parser')
+        logger.addHandler(handler)
+        try:
+            parser = LegacyParser(StringIO(DESTINATIONS_VALID), StringIO(TAXONOMY_MISSING_DESTINATIONS))
+            for repeat in range(3):
+                for destination in parser.destinations():
+                    list(destination.children())
+                    list(destination.parents())
+        finally:
+            logger.removeHandler(handler)
+        warnings = [record.getMessage() for record in records if record.levelno == logging.WARNING]
+        self.assertEqual(warnings, ['1 taxonomy links have no destination, such as: africa children sudan'])
+        africa = next(parser.destinations())
+        self.assertEqual(africa.number_children(), 1)
+
+    def test_lazy_content(self):
+        """Content is only converted when it is used"""
+        converted = []
+
+        class CountingParser(LegacyParser):
+            def _element_content(self, destination_xml):
+                converted.append(destination_xml.get('title'))
+                return super(CountingParser, self)._element_content(destination_xml)
+        parser = CountingParser(StringIO(DESTINATIONS_VALID), StringIO(TAXONOMY_VALID))
+        destinations = list(parser.destinations())
+        self.assertEqual([child['name'] for child in destinations[0].children()], ['south_africa'])
+        self.assertEqual(destinations[1].atlas_id, 111333)
+        self.assertEqual(converted, [])
+        self.assertEqual(destinations[1].get_content('random'), 'Random String goes here')
+        self.assertEqual(converted, ['South Africa'])
+
+    def test_snapshot(self):
+        parser = LegacyParser(StringIO(DESTINATIONS_VALID), StringIO(TAXONOMY_VALID))
+        restored = LegacyParser.from_snapshot(parser.snapshot())
+        self.assertDictEqual(restored.metadata, parser.metadata)
+        for original, destination in zip(parser.destinations(), restored.destinations()):
+            self.assertEqual(destination.name, original.name)
+            self.assertEqual(destination.content, original.content)
+            self.assertEqual(destination.atlas_id, original.atlas_id)
+            self.assertEqual(list(destination.children()), list(original.children()))
+
+
+class TestLegacyParserConcurrent(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write(self, name, xml):
+        filename = os.path.join(self.path, name)
+        with open(filename, 'wb') as fh:
+            fh.write(xml)
+        return filename
+
+    def assertSameTaxonomy(self, parser, expected):
+        self.assertEqual(parser.taxonomy, expected.taxonomy)
+        self.assertEqual(parser.taxonomy.descendants('africa'), expected.taxonomy.descendants('africa'))
+
+    def test_concurrent_matches_serial(self):
+        expected = LegacyParser(StringIO(DESTINATIONS_VALID), StringIO(TAXONOMY_TREE), concurrent=False)
+        parser = LegacyParser(StringIO(DESTINATIONS_VALID), StringIO(TAXONOMY_TREE))
+        self.assertSameTaxonomy(parser, expected)
+        self.assertEqual(parser.metadata, expected.metadata)
+
+    def test_process(self):
+        expected = LegacyParser(StringIO(DESTINATIONS_VALID), StringIO(TAXONOMY_TREE), concurrent=False)
+        threshold = legacy_parser._TaxonomyParse.PROCESS_THRESHOLD
+        legacy_parser._TaxonomyParse.PROCESS_THRESHOLD = 0
+        try:
+            with open(self.write('taxonomy.xml', TAXONOMY_TREE), 'rb') as taxonomy_fh:
+                parser = LegacyParser(StringIO(DESTINATIONS_VALID), taxonomy_fh)
+        finally:
+            legacy_parser._TaxonomyParse.PROCESS_THRESHOLD = threshold
+        self.assertSameTaxonomy(parser, expected)
+        self.assertGreaterEqual(parser.parse_times['taxonomy'], 0.0)
+
+    def test_parse_times(self):
+        for concurrent in (True, False):
+            parser = LegacyParser(StringIO(DESTINATIONS_VALID), StringIO(TAXONOMY_TREE), concurrent=concurrent)
+            self.assertEqual(sorted(parser.parse_times), ['destinations', 'taxonomy'])
+        self.assertEqual(LegacyParser(StringIO(DESTINATIONS_VALID)).parse_times.keys(), ['destinations'])
+
+    def test_taxonomy_error(self):
+        with self.assertRaises(XMLSyntaxError):
+            LegacyParser(StringIO(DESTINATIONS_VALID), StringIO('<taxonomies><taxonomy>'))
+
+    def test_process_taxonomy_error(self):
+        threshold = legacy_parser._TaxonomyParse.PROCESS_THRESHOLD
+        legacy_parser._TaxonomyParse.PROCESS_THRESHOLD = 0
+        try:
+            with open(self.write('taxonomy.xml', TAXONOMY_TREE[:-40]), 'rb') as taxonomy_fh:
+                with self.assertRaises(legacy_parser.WorkerError) as raised:
+                    LegacyParser(StringIO(DESTINATIONS_VALID), taxonomy_fh)
+        finally:
+            legacy_parser._TaxonomyParse.PROCESS_THRESHOLD = threshold
+        self.assertIn('taxonomy.xml', str(raised.exception))
+
+    def test_destinations_error_first(self):
+        """When both fail, the error of the destinations is raised"""
+        with self.assertRaises(ValueError):
+            LegacyParser(NonSeekableSource(DESTINATIONS_VALID), StringIO('<taxonomies><taxonomy>'), streaming=True)
+
+
+class NonSeekableSource(object):
+    """A source which can only be read, such as a pipe"""
+    def __init__(self, data):
+        self._data = StringIO(data)
+
+    def read(self, *args):
+        return self._data.read(*args)
+
+
+class TestLegacyParserStreaming(TestCase):
+    def test_parse_metadata(self):
+        parser = LegacyParser(StringIO(DESTINATIONS_VALID), streaming=True)
+        self.assertIsNone(parser.xml)
+        self.assertDictEqual(parser.metadata, {
+            'africa': {
+                'asset_id': '1-1',
+                'name': 'africa',
+                'title': 'Africa'},
+            'south_africa': {
+                'asset_id': '2-1',
+                'name': 'south_africa',
+                'title': 'South Africa'},
+        })
+
+    def test_parse_content(self):
+        parser = LegacyParser(StringIO(DESTINATIONS_VALID), streaming=True)
+        names = [destination.name for destination in parser.destinations()]
+        self.assertEqual(names, ['africa', 'south_africa'])
+
+    def test_index(self):
+        parser = LegacyParser(StringIO(DESTINATIONS_DUPLICATED), streaming=True)
+        self.assertDictEqual(parser.index, {'africa': 2})
+        destinations = list(parser.destinations())
+        self.assertEqual(len(destinations), 1)
+        self.assertEqual(destinations[0].asset_id, '1-2')
+
+    def test_snapshot(self):
+        parser = LegacyParser(StringIO(DESTINATIONS_VALID), streaming=True)
+        restored = LegacyParser.from_snapshot(parser.snapshot())
+        self.assertEqual([destination.name for destination in restored.destinations()], ['africa', 'south_africa'])
+
+    def test_named_destinations(self):
+        parser = LegacyParser(StringIO(DESTINATIONS_VALID), StringIO(TAXONOMY_VALID), streaming=True)
+        destinations = list(parser.destinations(names={'south_africa'}))
+        self.assertEqual([destination.name for destination in destinations], ['south_africa'])
+        self.assertEqual([parent['name'] for parent in destinations[0].parents()], ['africa'])
+
+    def test_parse_twice(self):
+        parser = LegacyParser(StringIO(DESTINATIONS_VALID), streaming=True)
+        self.assertEqual(len(list(parser.destinations())), 2)
+        self.assertEqual(len(list(parser.destinations())), 2)
+
+    def test_resolve_children(self):
+        parser = LegacyParser(StringIO(DESTINATIONS_VALID), StringIO(TAXONOMY_VALID), streaming=True)
+        destination = next(parser.destinations())
+        self.assertEqual([child['name'] for child in destination.children()], ['south_africa'])
+
+    def test_complex_content(self):
+        parser = LegacyParser(StringIO(DESTINATIONS_COMPLEX_CONTENT), streaming=True)
+        destination = next(parser.destinations())
+        self.assertEqual(destination.get_content('section', 'subsection_two', 'has_a_list'),
+                         [u'SS 2 El 1', u'SS 2 El 2', u'SS 2 El 3'])
+
+    def test_elements_cleared(self):
+        parser = LegacyParser(StringIO(DESTINATIONS_VALID), streaming=True)
+        elements = parser._iterparse()
+        first = next(elements)
+        self.assertEqual(len(first), 1)
+        second = next(elements)
+        self.assertEqual(len(first), 0)
+        root = second.getparent()
+        list(elements)
+        self.assertEqual(len(second), 0)
+        self.assertEqual(len(root), 1)
+
+    def test_parse_empty_xml(self):
+        with self.assertRaises(XMLSyntaxError):
+            LegacyParser(StringIO(XML_EMPTY), streaming=True)
+
+    def test_non_seekable_source(self):
+        with self.assertRaises(ValueError):
+            LegacyParser(NonSeekableSource(DESTINATIONS_VALID), streaming=True)
+
+
+DESTINATIONS_TREE = """<?xml version="1.0" encoding="utf-8"?>
+<destinations>
+%s
+</destinations>
+""" % '\n'.join('<destination atlas_id="%d" asset_id="%d" title="%s" title-ascii="%s"><a>%s</a></destination>' % (
+    number, number, title, title, title) for number, title in enumerate(
+        ['Africa', 'South Africa', 'Cape Town', 'Sudan', 'Asia']))
+
+
+class TestLegacyParserSelect(TestCase):
+    def setUp(self):
+        self.parser = LegacyParser(StringIO(DESTINATIONS_TREE), StringIO(TAXONOMY_TREE))
+
+    def test_subtree(self):
+        # Durban is in the taxonomy, but has no destination
+        self.assertEqual(self.parser.select(subtree='south_africa'), {'south_africa', 'cape_town'})
+        self.assertEqual(self.parser.select(subtree='africa'), {'africa', 'south_africa', 'cape_town', 'sudan'})
+        self.assertEqual(self.parser.select(subtree='asia'), {'asia'})
+
+    def test_only(self):
+        self.assertEqual(self.parser.select(only=['sudan', 'asia']), {'sudan', 'asia'})
+        self.assertEqual(self.parser.select(only=['asia'], subtree='south_africa'),
+                         {'asia', 'south_africa', 'cape_town'})
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, self.parser.select, only=['durban'])
+        self.assertRaises(ValueError, self.parser.select, subtree='europe')
+
+    def test_selected_content_only(self):
+        converted = []
+        element_content = self.parser._element_content
+
+        def record(destination_xml):
+            converted.append(destination_xml.get('title'))
+            return element_content(destination_xml)
+
+        self.parser._element_content = record
+        names = self.parser.select(subtree='south_africa')
+        destinations = [destination for destination in self.parser.destinations(names)]
+        self.assertEqual([destination.name for destination in destinations], ['south_africa', 'cape_town'])
+        self.assertEqual([destination.content['a'] for destination in destinations], ['South Africa', 'Cape Town'])
+        self.assertEqual(converted, ['South Africa', 'Cape Town'])
@@ -0,0 +1,89 @@
+import threading
+from unittest import TestCase
+from addo.pipeline import Pipeline, Stage
+
+
+class TestPipeline(TestCase):
+    def test_items_flow_through_stages(self):
+        results = []
+        lock = threading.Lock()
+
+        def collect(item):
+            with lock:
+                results.append(item)
+
+        pipeline = Pipeline(range(100), [Stage('double', lambda item: item * 2, workers=3, depth=2),
+                                         Stage('collect', collect, workers=2, depth=2)])
+        self.assertEqual(pipeline.run(), 100)
+        self.assertEqual(sorted(results), range(0, 200, 2))
+
+    def test_none_is_dropped(self):
+        results = []
+        pipeline = Pipeline(range(10), [Stage('odd', lambda item: item if item % 2 else None),
+                                        Stage('collect', results.append)])
+        self.assertEqual(pipeline.run(), 5)
+        self.assertEqual(sorted(results), [1, 3, 5, 7, 9])
+
+    def test_stats(self):
+        pipeline = Pipeline(range(10), [Stage('identity', lambda item: item)], source_name='numbers')
+        pipeline.run()
+        self.assertEqual(pipeline.source_stage.name, 'numbers')
+        self.assertEqual(pipeline.source_stage.items, 10)
+        stats = pipeline.stages[0].stats()
+        self.assertEqual(stats['items'], 10)
+        self.assertGreaterEqual(stats['input_wait'], 0.0)
+        self.assertGreaterEqual(stats['throughput'], 0.0)
+
+    def test_error_raised(self):
+        def fail(item):
+            if item == 5:
+                raise KeyError(item)
+            return item
+
+        read = []
+
+        def source():
+            for item in range(10000):
+                read.append(item)
+                yield item
+
+        pipeline = Pipeline(source(), [Stage('fail', fail, workers=2, depth=1), Stage('identity', lambda item: item)])
+        with self.assertRaises(KeyError):
+            pipeline.run()
+        self.assertLess(len(read), 10000)
+
+    def test_source_error_raised(self):
+        def source():
+            yield 1
+            raise ValueError('Broken source')
+
+        with self.assertRaises(ValueError):
+            Pipeline(source(), [Stage('identity', lambda item: item)]).run()
+
+    def test_backpressure(self):
+        release = threading.Event()
+        read = []
+
+        def source():
+            for item in range(100):
+                read.append(item)
+                yield item
+
+        def blocked(item):
+            release.wait()
+
+        pipeline = Pipeline(source(), [Stage('blocked', blocked, workers=1, depth=3)])
+        thread = threading.Thread(target=pipeline.run)
+        thread.start()
+        threading.Event().wait(0.1)
+        # One item held by the stage, three queued and one waiting to be queued by the source
+        self.assertLessEqual(len(read), 5)
+        release.set()
+        thread.join()
+        self.assertEqual(len(read), 100)
+
+    def test_invalid_stage(self):
+        with self.assertRaises(ValueError):
+            Stage('none', None, workers=0)
+        with self.assertRaises(ValueError):
+            Pipeline([], [])
@@ -1,5 +1,7 @@
+import os, shutil, tempfile
 from unittest import TestCase
-from addo.render import prettify_paragraphs, FileRenderer
+from addo import render
+from addo.render import prettify_paragraphs, FileRenderer, template_key
 
 
 class TestParagraphPrettify(TestCase):
@@ -50,4 +52,188 @@ class TestRenderGlobals(TestCase):
     def test_prettify_paragraphs(self):
         template = FileRenderer(text='${prettify_paragraphs(test_data)}')
         result = template.render_unicode(test_data='Some Data')
-        self.assertEqual(result, '<p><b>Some Data</b></p>')
\ No newline at end of file
+        self.assertEqual(result, '<p><b>Some Data</b></p>')
+
+
+class TestFileRendererCache(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.template = os.path.join(self.path, 'template.html')
+        self.cache_dir = os.path.join(self.path, 'cache')
+        with open(self.template, 'wb') as fh:
+            fh.write('Hello ${name}')
+        render._compiled.clear()
+
+    def tearDown(self):
+        render._compiled.clear()
+        shutil.rmtree(self.path)
+
+    def modules(self):
+        return sorted(name for name in os.listdir(self.cache_dir) if name.endswith('.py'))
+
+    def test_disk_cache(self):
+        template = FileRenderer(filename=self.template, module_directory=self.cache_dir)
+        self.assertEqual(template.render_unicode(name='World'), 'Hello World')
+        self.assertEqual(self.modules(), ['%s-%s.py' % template_key(self.template, template.compile_options())])
+        self.assertEqual(template.module_directory, self.cache_dir)
+
+    def test_disk_cache_reused(self):
+        FileRenderer(filename=self.template, module_directory=self.cache_dir)
+        render._compiled.clear()
+        with open(os.path.join(self.cache_dir, self.modules()[0]), 'ab') as fh:
+            fh.write('\n_reused = True\n')
+        template = FileRenderer(filename=self.template, module_directory=self.cache_dir)
+        self.assertTrue(template.module._reused)
+
+    def test_stale_modules_removed(self):
+        FileRenderer(filename=self.template, module_directory=self.cache_dir)
+        with open(self.template, 'wb') as fh:
+            fh.write('Goodbye ${name}')
+        template = FileRenderer(filename=self.template, module_directory=self.cache_dir)
+        self.assertEqual(template.render_unicode(name='World'), 'Goodbye World')
+        self.assertEqual(self.modules(), ['%s-%s.py' % template_key(self.template, template.compile_options())])
+
+    def test_memory_cache(self):
+        first = FileRenderer(filename=self.template, template_cache='memory')
+        second = FileRenderer(filename=self.template, template_cache='memory')
+        self.assertIs(first.module, second.module)
+        self.assertEqual(second.render_unicode(name='World'), 'Hello World')
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_compile_options(self):
+        """Templates compiled with other filters are not reused"""
+        plain = FileRenderer(filename=self.template, template_cache='memory')
+        escaped = FileRenderer(filename=self.template, template_cache='memory', default_filters=['h'])
+        self.assertEqual(plain.render_unicode(name='<b>'), u'Hello <b>')
+        self.assertEqual(escaped.render_unicode(name='<b>'), u'Hello &lt;b&gt;')
+
+    def test_compile_options_disk_cache(self):
+        FileRenderer(filename=self.template, module_directory=self.cache_dir)
+        render._compiled.clear()
+        escaped = FileRenderer(filename=self.template, module_directory=self.cache_dir, default_filters=['h'])
+        self.assertEqual(escaped.render_unicode(name='<b>'), u'Hello &lt;b&gt;')
+
+    def test_key_changes_with_options(self):
+        key = template_key(self.template, {'default_filters': ['unicode']})
+        self.assertEqual(template_key(self.template, {'default_filters': ['unicode']}), key)
+        self.assertNotEqual(template_key(self.template, {'default_filters': ['h']})[1], key[1])
+        self.assertEqual(template_key(self.template, {'preprocessor': os.path.join})[1],
+                         template_key(self.template, {'preprocessor': os.path.join})[1])
+
+    def test_no_cache(self):
+        first = FileRenderer(filename=self.template, template_cache='none')
+        second = FileRenderer(filename=self.template, template_cache='none')
+        self.assertIsNot(first.module, second.module)
+
+    def test_invalid_cache(self):
+        with self.assertRaises(ValueError):
+            FileRenderer(filename=self.template, template_cache='cloud')
+
+    def test_unwritable_cache_dir(self):
+        with open(self.cache_dir, 'wb') as fh:
+            fh.write('Not a directory')
+        template = FileRenderer(filename=self.template, module_directory=self.cache_dir)
+        self.assertEqual(template.render_unicode(name='World'), 'Hello World')
+
+    def test_key_changes_with_content(self):
+        key = template_key(self.template)
+        with open(self.template, 'wb') as fh:
+            fh.write('Goodbye ${name}')
+        self.assertEqual(template_key(self.template)[0], key[0])
+        self.assertNotEqual(template_key(self.template)[1], key[1])
+
+
+def legacy_prettify_paragraphs(source):
+    """The original, two list implementation of prettify_paragraphs"""
+    paragraphs = []
+    for paragraph in source.split('\n\n'):
+        if len(paragraph.strip()) == 0:
+            continue
+        if len(paragraph) < 40:
+            paragraphs.append(u'<b>%s</b>' % paragraph.strip())
+        else:
+            paragraphs.append(paragraph)
+    return ''.join([u'<p>%s</p>' % p for p in paragraphs])
+
+
+class TestParagraphPrettifyLegacy(TestCase):
+    SOURCES = [u'', u'\n\n', u'Short', u'Par1\n\nPar2\n\n\nPar3\n\n', u'\n\n\n\nStarts with breaks',
+               u'A paragraph which is certainly longer than forty characters\nwith a line break\n\n  Heading  \n\n',
+               u'Caf\xe9\n\n' * 3, 'Byte string\n\nparagraphs']
+
+    def test_matches_legacy(self):
+        for source in self.SOURCES:
+            self.assertEqual(prettify_paragraphs(source), legacy_prettify_paragraphs(source), msg=repr(source))
+
+
+class TestRenderFile(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.path, 'page.html')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def read(self):
+        with open(self.filename, 'rb') as fh:
+            return fh.read()
+
+    def test_encoded(self):
+        template = FileRenderer(text=u'${title} ${prettify_paragraphs(text)}')
+        written = template.render_file(self.filename, title=u'Caf\xe9', text=u'Cr\xe8me')
+        self.assertEqual(self.read(), u'Caf\xe9 <p><b>Cr\xe8me</b></p>'.encode('UTF-8'))
+        self.assertEqual(written, len(self.read()))
+        self.assertEqual(os.listdir(self.path), ['page.html'])
+
+    def test_matches_render_unicode(self):
+        template = FileRenderer(text=u'% for i in range(count):\n${i} \xe9\n% endfor\n')
+        template.render_file(self.filename, count=20000)
+        self.assertEqual(self.read(), template.render_unicode(count=20000).encode('UTF-8'))
+
+    def test_render_blocks(self):
+        template = FileRenderer(text=u'${title}')
+        self.assertEqual(''.join(template.render_blocks(title=u'Caf\xe9')), u'Caf\xe9'.encode('UTF-8'))
+
+    def test_output_encoding(self):
+        template = FileRenderer(text=u'${title}', output_encoding='latin-1')
+        template.render_file(self.filename, title=u'Caf\xe9')
+        self.assertEqual(self.read(), 'Caf\xe9')
+
+    def test_error_keeps_previous_file(self):
+        with open(self.filename, 'wb') as fh:
+            fh.write('Previous')
+        template = FileRenderer(text=u'Partial ${1 / zero}')
+        with self.assertRaises(ZeroDivisionError):
+            template.render_file(self.filename, zero=0)
+        self.assertEqual(self.read(), 'Previous')
+        self.assertEqual(os.listdir(self.path), ['page.html'])
+
+    def test_writer_blocks(self):
+        written = []
+
+        class File(object):
+            def write(self, data):
+                written.append(data)
+
+        writer = render.EncodedWriter(File(), 'UTF-8', block_size=2)
+        for text in [u'ab', u'c', u'd\xe9', u'f']:
+            writer.write(text)
+        writer.flush()
+        self.assertEqual(written, ['abc', 'd\xc3\xa9f'])
+        self.assertEqual(writer.written, 7)
+
+    def test_written_while_rendering(self):
+        """Blocks of the page are written to the file before the render ends, rather than all at the end"""
+        written = []
+        during_render = []
+
+        class File(object):
+            def write(self, data):
+                written.append(data)
+
+        template = FileRenderer(text=u'% for i in range(5000):\n${i}\n% endfor\n${mark()}')
+        size = template._render_into(File(), {'mark': lambda: during_render.append(len(written)) or u''})
+        self.assertGreater(during_render[0], 0)
+        self.assertGreater(len(written), during_render[0])
+        self.assertEqual(''.join(written), ''.join('%d\n' % i for i in range(5000)))
+        self.assertEqual(size, sum(len(data) for data in written))
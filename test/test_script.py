@@ -2,7 +2,7 @@ from ConfigParser import NoSectionError
 from StringIO import StringIO
 from argparse import ArgumentParser
 from unittest import TestCase
-from addo.script import get_args_parser, get_ini_config, main
+from addo.script import get_args_parser, get_ini_config, asbool, main
 
 
 class ScriptConfigurationTest(TestCase):
@@ -57,6 +57,20 @@ parameter = %(here)s/value
         with self.assertRaises(SystemExit):
             main(args=['-t', 'taxonomy.xml', '-d', 'destinations.xml', '-o', 'output_dir'])
 
+    def test_with_invalid_jobs(self):
+        with self.assertRaises(SystemExit):
+            main(args=['-t', 'taxonomy.xml', '-d', 'destinations.xml', '-o', '.', '--jobs', '0'])
+
+    def test_with_invalid_parse_jobs(self):
+        with self.assertRaises(SystemExit):
+            main(args=['-t', 'taxonomy.xml', '-d', 'destinations.xml', '-o', '.', '--parse-jobs', '0'])
+
+    def test_with_invalid_write_queue(self):
+        with self.assertRaises(SystemExit):
+            main(args=['-t', 'taxonomy.xml', '-d', 'destinations.xml', '-o', '.', '--write-queue', '-1'])
+        with self.assertRaises(SystemExit):
+            main(args=['-t', 'taxonomy.xml', '-d', 'destinations.xml', '-o', '.', '--writers', '0'])
+
     def test_config_logging(self):
         """Test that the ini config catches the logging values. We're not testing 'how' it configures it as that
         is done in the logging module"""
@@ -67,3 +81,11 @@ keys =
         with self.assertRaises(NoSectionError):
             config = get_ini_config('/some/location/config.ini', 'addo', ini_fp=StringIO(ini_file))
 
+
+    def test_asbool(self):
+        self.assertTrue(asbool(True))
+        self.assertTrue(asbool('true'))
+        self.assertTrue(asbool(' Yes '))
+        self.assertFalse(asbool(False))
+        self.assertFalse(asbool('false'))
+        self.assertFalse(asbool('0'))
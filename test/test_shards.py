@@ -0,0 +1,84 @@
+import os, shutil, tempfile
+from unittest import TestCase
+from addo.legacy_parser import LegacyParser, WorkerError
+from addo.shards import declared_encoding, destination_offsets, shard_ranges, parse_sharded
+
+DESTINATIONS = """<?xml version="1.0" encoding="utf-8"?>
+<destinations>
+ <destination atlas_id="1" asset_id="1-1" title="Africa" title-ascii="Africa">
+  <history><history><history><![CDATA[Not a <destination atlas_id="9" title="Fake">]]></history></history></history>
+ </destination>
+ <!-- <destination atlas_id="8" title="Commented"> -->
+ <destination atlas_id="2" asset_id="2-1" title="South Africa" title-ascii="South Africa">
+  <overview><![CDATA[Caf\xc3\xa9]]></overview>
+ </destination>
+ <destination atlas_id="3" asset_id="3-1" title="Cape Town" title-ascii="Cape Town"/>
+ <destination atlas_id="4" asset_id="4-1" title="Africa" title-ascii="Africa"><overview>Again</overview></destination>
+</destinations>
+"""
+
+
+class TestShards(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.path, 'destinations.xml')
+        with open(self.filename, 'wb') as fh:
+            fh.write(DESTINATIONS)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_offsets_skip_cdata_and_comments(self):
+        offsets = destination_offsets(DESTINATIONS)
+        self.assertEqual(len(offsets), 4)
+        for offset in offsets:
+            self.assertTrue(DESTINATIONS.startswith('<destination atlas_id', offset))
+
+    def test_ranges(self):
+        ranges = shard_ranges(DESTINATIONS, 3)
+        self.assertEqual(len(ranges), 3)
+        self.assertEqual(ranges[0][0], destination_offsets(DESTINATIONS)[0])
+        for (start, end), (next_start, next_end) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, next_start)
+        self.assertEqual(DESTINATIONS[ranges[-1][1]:].strip(), '</destinations>')
+
+    def test_more_shards_than_destinations(self):
+        self.assertEqual(len(shard_ranges(DESTINATIONS, 10)), 4)
+        self.assertEqual(shard_ranges('<destinations></destinations>', 4), [])
+
+    def test_declared_encoding(self):
+        self.assertEqual(declared_encoding(DESTINATIONS), 'utf-8')
+        self.assertEqual(declared_encoding('<?xml version="1.0" encoding=\'ISO-8859-1\'?><a/>'), 'ISO-8859-1')
+        self.assertEqual(declared_encoding('<destinations/>'), 'UTF-8')
+        self.assertEqual(declared_encoding(u'<destinations/>'.encode('utf-16')), 'UTF-16')
+
+    def test_matches_serial(self):
+        serial = LegacyParser(self.filename)
+        sharded = LegacyParser.from_sharded(self.filename, processes=2)
+        self.assertEqual(sharded.metadata, serial.metadata)
+        self.assertEqual(list(sharded.index), list(serial.index))
+        for expected, destination in zip(serial.destinations(), sharded.destinations()):
+            self.assertEqual(destination.name, expected.name)
+            self.assertEqual(destination.atlas_id, expected.atlas_id)
+            self.assertEqual(destination.content, expected.content)
+
+    def test_duplicates_last_wins(self):
+        state = parse_sharded(self.filename, 2)
+        self.assertEqual([name for name, atlas_id, content in state['index']], ['south_africa', 'cape_town', 'africa'])
+        self.assertEqual(dict((name, atlas_id) for name, atlas_id, content in state['index'])['africa'], 4)
+
+    def test_unsplittable_encoding(self):
+        with open(self.filename, 'wb') as fh:
+            fh.write(DESTINATIONS.replace('utf-8', 'utf-16').decode('utf-8').encode('utf-16'))
+        self.assertIsNone(parse_sharded(self.filename, 2))
+        parser = LegacyParser.from_sharded(self.filename, processes=2)
+        self.assertEqual(sorted(parser.metadata), ['africa', 'cape_town', 'south_africa'])
+
+    def test_broken_shard(self):
+        with open(self.filename, 'wb') as fh:
+            fh.write(DESTINATIONS.replace('<overview>Again</overview>', '<overview>Again</history>'))
+        with self.assertRaises(WorkerError) as raised:
+            parse_sharded(self.filename, 2)
+        self.assertRegexpMatches(str(raised.exception), r'Could not parse bytes \d+ to \d+ of .*destinations.xml')
+        with self.assertRaises(WorkerError):
+            LegacyParser.from_sharded(self.filename, processes=2)
@@ -0,0 +1,68 @@
+import os, glob, shutil, tempfile
+from unittest import TestCase
+from addo.legacy_parser import LegacyParser
+from addo.snapshot import Snapshot
+from test.test_parser import DESTINATIONS_VALID, TAXONOMY_VALID
+
+
+class TestSnapshot(TestCase):
+    def join(self, *children):
+        return os.path.join(self.path, *children)
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        with open(self.join('destinations.xml'), 'wb') as fh:
+            fh.write(DESTINATIONS_VALID)
+        with open(self.join('taxonomy.xml'), 'wb') as fh:
+            fh.write(TAXONOMY_VALID)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def make_snapshot(self):
+        return Snapshot(self.path, self.join('destinations.xml'), self.join('taxonomy.xml'))
+
+    def save(self):
+        parser = LegacyParser(self.join('destinations.xml'), self.join('taxonomy.xml'))
+        return self.make_snapshot().save(parser)
+
+    def test_missing(self):
+        self.assertIsNone(self.make_snapshot().load())
+
+    def test_save_and_load(self):
+        saved = self.save()
+        loaded = self.make_snapshot().load()
+        self.assertIsNotNone(loaded)
+        self.assertDictEqual(loaded.metadata, saved.metadata)
+        self.assertDictEqual(loaded.taxonomy, saved.taxonomy)
+        destinations = list(loaded.destinations())
+        self.assertEqual([destination.name for destination in destinations], ['africa', 'south_africa'])
+        self.assertEqual(destinations[0].get_content('random'), 'Random String goes here')
+        self.assertEqual(destinations[0].atlas_id, 111222)
+        self.assertEqual([child['name'] for child in destinations[0].children()], ['south_africa'])
+
+    def test_changed_input(self):
+        self.save()
+        with open(self.join('destinations.xml'), 'wb') as fh:
+            fh.write(DESTINATIONS_VALID.replace('Random String', 'Another String'))
+        self.assertIsNone(self.make_snapshot().load())
+
+    def test_stale_removed(self):
+        self.save()
+        with open(self.join('destinations.xml'), 'wb') as fh:
+            fh.write(DESTINATIONS_VALID.replace('Random String', 'Another String'))
+        self.save()
+        snapshots = glob.glob(self.join('%s*' % Snapshot.PREFIX))
+        self.assertEqual(snapshots, [self.make_snapshot().path])
+
+    def test_unreadable(self):
+        snapshot = self.make_snapshot()
+        with open(snapshot.path, 'wb') as fh:
+            fh.write('error')
+        self.assertIsNone(snapshot.load())
+
+    def test_wrong_key(self):
+        self.save()
+        snapshot = self.make_snapshot()
+        snapshot.key = 'another'
+        self.assertIsNone(snapshot.load())
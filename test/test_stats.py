@@ -0,0 +1,60 @@
+from unittest import TestCase
+from addo.stats import BuildStats, format_size
+
+
+class TestBuildStats(TestCase):
+    def test_phase(self):
+        stats = BuildStats()
+        with stats.phase('parse'):
+            sum(range(10000))
+        stats.add_phase('taxonomy parse', 0.5, within='parse')
+        wall, cpu, within = stats.phases['parse']
+        self.assertGreaterEqual(wall, 0.0)
+        self.assertGreaterEqual(cpu, 0.0)
+        self.assertIsNone(within)
+        self.assertEqual(stats.phases['taxonomy parse'], (0.5, None, 'parse'))
+
+    def test_phase_recorded_on_error(self):
+        stats = BuildStats()
+        with self.assertRaises(ValueError):
+            with stats.phase('render'):
+                raise ValueError()
+        self.assertIn('render', stats.phases)
+
+    def test_pages(self):
+        stats = BuildStats(slowest=2)
+        stats.page_rendered('africa', 0.0005, 100)
+        stats.page_rendered('sudan', 0.03, 200)
+        stats.page_rendered('cape_town', 0.3, 300)
+        stats.page_rendered('durban', 10.0, 400)
+        self.assertEqual(stats.bytes_written, 1000)
+        self.assertEqual(stats.slowest(), [('durban', 10.0), ('cape_town', 0.3)])
+        self.assertEqual(stats.slowest(3)[-1], ('sudan', 0.03))
+
+        histogram = dict(stats.histogram())
+        self.assertEqual(histogram[0.001], 1)
+        self.assertEqual(histogram[0.05], 1)
+        self.assertEqual(histogram[0.5], 1)
+        self.assertEqual(histogram[None], 1)
+        self.assertEqual(sum(histogram.values()), 4)
+
+    def test_report(self):
+        stats = BuildStats()
+        stats.add_phase('parse', 1.25, 1.0)
+        stats.add_phase('taxonomy parse', 0.5, within='parse')
+        stats.note('render and write are timed together')
+        stats.page_rendered('africa', 0.002, 2048)
+        stats.page_rendered('durban', 6.0, 1024)
+        report = stats.report()
+        self.assertIn('parse', report)
+        self.assertIn('  taxonomy parse', report)
+        self.assertIn('Note: render and write are timed together', report)
+        self.assertIn('<= 2ms', report)
+        self.assertIn('> 5000ms', report)
+        self.assertIn('6.000s durban', report)
+        self.assertIn('Pages: 2, bytes written: 3.0 KB', report)
+
+    def test_format_size(self):
+        self.assertEqual(format_size(10), '10 B')
+        self.assertEqual(format_size(1536), '1.5 KB')
+        self.assertEqual(format_size(3 << 30), '3.0 GB')